@@ -1,25 +1,263 @@
-from fastapi import FastAPI
+import asyncio
+import hmac
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from rag_core import query_chromadb
+import metrics
+import rag_core
+from rag_core import aquery_chromadb, aquery_chromadb_batch, astream_query
+from scheduler import PRIORITIES, AdmissionError, QueueFull
 
-app = FastAPI(title="RAG API with ChromaDB + Ollama")
+
+# Логи в stdout контейнера, в том числе тайминги фаз старта
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Без строки лога на каждый запрос к Ollama
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Модель, индекс и пулы поднимаются и прогреваются до приёма запросов
+    await rag_core.astartup()
+    # Новая версия индекса (chroma_setup.py --rebuild) подхватывается без перезапуска;
+    # с общим сервером векторизации (RAG_INFERENCE_SOCKET) за индексом следит он
+    watcher = (
+        asyncio.create_task(rag_core.watch_index_version())
+        if rag_core.RETRIEVER_RELOAD_INTERVAL > 0 and not rag_core.INFERENCE_SOCKET else None
+    )
+    # Исключённые бэкенды Ollama возвращаются в пул, как только снова отвечают
+    health_checks = asyncio.create_task(rag_core.llm_pool.run_health_checks())
+    yield
+    health_checks.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    # Закрываем пул соединений к Ollama
+    await rag_core.aclose()
+
+
+app = FastAPI(title="RAG API with ChromaDB + Ollama", lifespan=lifespan)
+
+# Как часто проверяем, не отключился ли клиент, пока ждём генерацию (с)
+DISCONNECT_POLL_INTERVAL = 0.5
+# Токен для /admin/* (заголовок X-Admin-Token); без него административные эндпоинты выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 # Модель входа
 class QueryRequest(BaseModel):
     question: str
+    # Вернуть в ответе тайминги стадий и usage от Ollama
+    debug: bool = False
 
 # Модель ответа
 class QueryResponse(BaseModel):
     question: str
     answer: str
     chunks: list[str]
+    prompt_tokens: int | None = None
+    cache: str | None = None
+    timings: dict[str, float] | None = None
+    usage: dict[str, int] | None = None
+
+# Пакетный запрос
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
+    top_k: int = 10
+    retrieval_only: bool = False
+    concurrency: int | None = None
+
+class BatchQueryItem(BaseModel):
+    question: str
+    answer: str | None = None
+    chunks: list[str]
+    distances: list[float]
+    cache: str | None = None
+
+class BatchQueryResponse(BaseModel):
+    results: list[BatchQueryItem]
+
 
+# Запросы к пайплайну до окончания старта (или после неудачного старта) не принимаем
+def require_ready():
+    if not rag_core.is_ready():
+        raise HTTPException(status_code=503, detail=f"Пайплайн не готов: {rag_core.startup_state['status']}")
+
+
+# /admin/* слушает тот же публичный порт — пускаем только с X-Admin-Token
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Административные эндпоинты выключены: не задан ADMIN_TOKEN")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Неверный X-Admin-Token")
+
+
+# X-Cache-Bypass: 1 — не брать ответ из кэшей (ответов и генераций); свежий ответ в кэш всё равно записывается
+def cache_bypass(x_cache_bypass: str | None = Header(default=None)) -> bool:
+    return (x_cache_bypass or "").strip().lower() in ("1", "true", "yes")
+
+
+# X-Request-Timeout: дедлайн запроса в секундах (по умолчанию GENERATION_TIMEOUT)
+def request_deadline(x_request_timeout: float | None = Header(default=None)) -> float | None:
+    return rag_core.request_deadline(x_request_timeout)
+
+
+# Для /query/batch X-Request-Timeout ограничивает каждую генерацию пакета, а не весь пакет
+def request_timeout(x_request_timeout: float | None = Header(default=None)) -> float | None:
+    return x_request_timeout
+
+
+# X-Priority: interactive (по умолчанию для одиночных запросов) или batch — пропускает интерактивные вперёд
+def request_priority(x_priority: str | None = Header(default=None)) -> str:
+    priority = (x_priority or "interactive").strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный приоритет {priority}, допустимы: {list(PRIORITIES)}")
+    return priority
+
+
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request: Request, exc: AdmissionError):
+    # Быстрый отказ вместо ожидания: клиент повторит через Retry-After
+    return JSONResponse(
+        {"detail": str(exc)}, status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)}
+    )
 
-@app.post("/query", response_model=QueryResponse)
-def handle_query(req: QueryRequest):
-    result = query_chromadb(req.question)
+
+# Обработка запроса отменяется, если клиент отключился: генерация в Ollama обрывается,
+# слот планировщика освобождается для следующих в очереди
+async def _cancel_on_disconnect(request: Request, coro):
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                logging.info(f"Клиент отключился, запрос {request.url.path} отменён")
+                # 499 (client closed request) никто не прочитает, но попадёт в логи доступа
+                raise HTTPException(status_code=499, detail="Клиент отключился")
+    finally:
+        task.cancel()
+
+
+@app.get("/healthz")
+def healthz():
+    # Процесс жив; готовность к запросам проверяет /readyz
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    state = rag_core.startup_state
+    # Воркер без живого сервера векторизации запросы не обслужит
+    if rag_core.is_ready() and rag_core.INFERENCE_SOCKET and not rag_core.model.ready():
+        return JSONResponse({**state, "status": "inference_unavailable"}, status_code=503)
+    return JSONResponse(state, status_code=200 if rag_core.is_ready() else 503)
+
+
+@app.post("/query", response_model=QueryResponse, dependencies=[Depends(require_ready)])
+async def handle_query(req: QueryRequest, request: Request, bypass_cache: bool = Depends(cache_bypass),
+                       deadline: float | None = Depends(request_deadline),
+                       priority: str = Depends(request_priority)):
+    result = await _cancel_on_disconnect(request, aquery_chromadb(
+        req.question, bypass_cache=bypass_cache, priority=priority, deadline=deadline
+    ))
     return QueryResponse(
         question=result["query"],
         answer=result["answer"],
-        chunks=result["chunks"]
+        chunks=result["chunks"],
+        prompt_tokens=result["prompt_tokens"],
+        cache=result["cache"],
+        timings=result["timings"] if req.debug else None,
+        usage=result.get("usage") if req.debug else None
     )
+
+
+@app.post("/query/batch", response_model=BatchQueryResponse, dependencies=[Depends(require_ready)])
+async def handle_query_batch(req: BatchQueryRequest, request: Request, bypass_cache: bool = Depends(cache_bypass),
+                             timeout: float | None = Depends(request_timeout)):
+    # Генерации пакета идут с приоритетом batch: интерактивные запросы их обгоняют
+    results = await _cancel_on_disconnect(request, aquery_chromadb_batch(
+        req.questions,
+        top_k=req.top_k,
+        retrieval_only=req.retrieval_only,
+        concurrency=req.concurrency,
+        bypass_cache=bypass_cache,
+        timeout=timeout
+    ))
+    return BatchQueryResponse(results=[
+        BatchQueryItem(
+            question=result["query"],
+            answer=result["answer"],
+            chunks=result["chunks"],
+            distances=result["distances"],
+            cache=result["cache"]
+        )
+        for result in results
+    ])
+
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin), Depends(require_ready)])
+async def admin_reload(force: bool = False):
+    # Перечитать указатель активной версии индекса и переключиться на неё (force — переоткрыть текущую)
+    try:
+        return await asyncio.to_thread(rag_core.reload_retriever, force)
+    except Exception as e:
+        logging.exception("Перезагрузка индекса не удалась")
+        raise HTTPException(status_code=500, detail=f"Перезагрузка индекса не удалась: {e}")
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Гистограммы стадий (rag_stage_seconds), счётчики запросов и токенов в формате Prometheus
+    return Response(metrics.generate_latest(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+@app.get("/llm/backends")
+def llm_backends():
+    # Бэкенды Ollama: доступность, незавершённые запросы, ошибки и средняя латентность
+    return rag_core.llm_pool.stats()
+
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return rag_core.generation_scheduler.stats()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = rag_core.answer_cache.stats()
+    if rag_core.completion_cache is not None:
+        stats["completions"] = rag_core.completion_cache.stats()
+    return stats
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/query/stream", dependencies=[Depends(require_ready)])
+async def handle_query_stream(req: QueryRequest, bypass_cache: bool = Depends(cache_bypass),
+                              deadline: float | None = Depends(request_deadline),
+                              priority: str = Depends(request_priority)):
+    scheduler = rag_core.generation_scheduler
+    if scheduler.full():
+        # Отказываем до начала потока, пока ещё можно вернуть статус 429
+        raise QueueFull(f"Очередь генераций заполнена ({scheduler.max_queue})", scheduler.retry_after())
+
+    # События: chunks (сразу после поиска), token (фрагменты ответа), done (ответ и тайминги),
+    # error — если запрос не допущен к генерации уже после начала потока.
+    # При отключении клиента Starlette отменяет генератор, и поток из Ollama закрывается.
+    async def events():
+        try:
+            async for event, data in astream_query(
+                req.question, bypass_cache=bypass_cache, priority=priority, deadline=deadline
+            ):
+                yield _sse(event, data)
+        except AdmissionError as e:
+            yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
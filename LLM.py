@@ -1,36 +1,373 @@
-# ollama_client.py
-
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+import httpx
 import requests
+import metrics
+
+# Клиент Ollama для всего проекта: пул из одного или нескольких инстансов (OLLAMA_HOSTS через запятую).
+# Запрос уходит на бэкенд с наименьшим числом незавершённых запросов; упавший бэкенд исключается
+# на OLLAMA_EJECT_SECONDS, а запрос повторяется на другом. Фоновая проверка здоровья возвращает
+# бэкенд в пул, латентность и ошибки по бэкендам видны в /metrics и /llm/backends.
+OLLAMA_HOSTS = [
+    host.strip().rstrip("/")
+    for host in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")).split(",")
+    if host.strip()
+]
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1")
+
+# Таймауты HTTP-клиента Ollama (секунды). Генерация deepseek-r1 бывает долгой,
+# поэтому таймаут чтения большой, а на установку соединения — маленький.
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+# Размер пула keep-alive соединений к каждому бэкенду
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+# На сколько секунд исключаем бэкенд после ошибки и как часто проверяем здоровье бэкендов
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+# Сколько бэкендов пробуем для одного запроса (не больше, чем их в пуле)
+OLLAMA_MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "3"))
+
+INSTRUCTION = "Дай максимально лаконичный ответ на данный вопрос.\n\n"
 
-OLLAMA_HOST  = "http://127.0.0.1:11434"
-OLLAMA_MODEL = "deepseek-r1"  # Или любая установленная модель через `ollama run`
 
 def strip_think_sections(raw: str) -> str:
     parts = raw.split("</think>")
-    if len(parts) >= 3:
-        return parts[2].strip()
-    elif len(parts) == 2:
-        return parts[1].strip()
-    else:
-        return raw.strip()
-
-def ask_ollama_http(prompt: str, max_tokens: int = 2048, temperature: float = 0.0) -> str:
-    instruction = "Дай максимально лаконичный ответ на данный вопрос.\n\n"
-    payload_prompt = instruction + prompt
-
-    url = f"{OLLAMA_HOST}/v1/completions"
+    return "".join(parts[1:]).strip() if len(parts) > 1 else raw.strip()
+
+
+class ThinkStripper:
+    """Инкрементальная версия strip_think_sections для потоковой генерации, с тем же результатом.
+
+    До первого </think> (или конца потока) ничего не выдаётся: шаблоны вроде DeepSeek-R1
+    подставляют <think> в промпт, и рассуждение приходит без открывающего тега.
+    Дальше повторные </think> выкидываются, а хвост, который может оказаться началом тега,
+    и пробелы в конце придерживаются до следующего фрагмента.
+    """
+
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._space = ""
+        self._answer = False
+        self._emitted = False
+
+    @staticmethod
+    def _partial_tag_len(text: str, tag: str) -> int:
+        # Длина самого длинного суффикса text, который является началом tag
+        for n in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:n]):
+                return n
+        return 0
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        text = self._space + text
+        if not self._emitted:
+            text = text.lstrip()
+        body = text.rstrip()
+        self._space = "" if final else text[len(body):]
+        self._emitted = self._emitted or bool(body)
+        return body
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+
+        if not self._answer:
+            idx = self._buffer.find(self.CLOSE_TAG)
+            if idx < 0:
+                return ""
+            self._buffer = self._buffer[idx + len(self.CLOSE_TAG):]
+            self._answer = True
+
+        # Как и strip_think_sections, выкидываем повторные </think> из ответа
+        out = []
+        while (idx := self._buffer.find(self.CLOSE_TAG)) >= 0:
+            out.append(self._buffer[:idx])
+            self._buffer = self._buffer[idx + len(self.CLOSE_TAG):]
+        hold = len(self._buffer) - self._partial_tag_len(self._buffer, self.CLOSE_TAG)
+        out.append(self._buffer[:hold])
+        self._buffer = self._buffer[hold:]
+        return self._emit("".join(out))
+
+    def finish(self) -> str:
+        # Без </think> весь поток и есть ответ
+        out, self._buffer = self._buffer, ""
+        return self._emit(out, final=True)
+
+
+def completion_payload(prompt: str, max_tokens: int, temperature: float, stream: bool = False,
+                       model: str = OLLAMA_MODEL) -> dict:
     payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": payload_prompt,
+        "model": model,
+        "prompt": INSTRUCTION + prompt,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
+    if stream:
+        payload["stream"] = True
+        # Последний фрагмент потока несёт usage (число токенов промпта и ответа)
+        payload["stream_options"] = {"include_usage": True}
+    return payload
 
-    resp = requests.post(url, json=payload)
-    resp.raise_for_status()
-    data = resp.json()
 
+# Текст ответа /v1/completions (OpenAI-совместимый API Ollama) без секции <think>
+def parse_completion(data: dict) -> str:
+    if data.get("choices"):
+        return strip_think_sections(data["choices"][0]["text"])
+    # Старый формат ответа, который ждал прежний LLM.py
     if "completion" in data:
         return strip_think_sections(data["completion"])
-    else:
-        return str(data)
+    return str(data)
+
+
+# Ошибки, после которых бэкенд исключается, а запрос можно повторить на другом:
+# нет соединения / таймаут и 5xx. На 4xx (неверный запрос) повторять бессмысленно.
+def _is_backend_failure(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout))
+
+
+class Backend:
+    """Один инстанс Ollama: клиенты, незавершённые запросы, исключение из пула и статистика."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.latency_ema = None
+        self.last_error = None
+        self._async_client: httpx.AsyncClient | None = None
+        # Синхронная сессия переиспользует соединения между вызовами из CLI
+        self.session = requests.Session()
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def async_client(self) -> httpx.AsyncClient:
+        # Создаётся лениво внутри работающего event loop
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+                )
+            )
+        return self._async_client
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.session.close()
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ema_s": round(self.latency_ema, 3) if self.latency_ema is not None else None,
+            "last_error": self.last_error
+        }
+
+
+class OllamaPool:
+    def __init__(self, hosts=OLLAMA_HOSTS, eject_seconds=OLLAMA_EJECT_SECONDS, max_attempts=OLLAMA_MAX_ATTEMPTS):
+        if not hosts:
+            raise ValueError("Не задан ни один бэкенд Ollama (OLLAMA_HOSTS)")
+        self.backends = [Backend(url) for url in hosts]
+        self.eject_seconds = eject_seconds
+        self.max_attempts = max(1, min(max_attempts, len(self.backends)))
+        # Счётчики меняются и из event loop, и из потоков синхронного пути
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        for backend in self.backends:
+            metrics.LLM_BACKEND_UP.labels(backend=backend.url).set(1)
+
+    # Наименее загруженный из здоровых (при равенстве — по кругу); если исключены все — из всех
+    def _pick(self, tried: set) -> Backend:
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in tried and b.healthy]
+            if not candidates:
+                candidates = [b for b in self.backends if b.url not in tried] or self.backends
+            offset = next(self._round_robin)
+            backend = min(
+                candidates,
+                key=lambda b: (b.outstanding, (self.backends.index(b) - offset) % len(self.backends))
+            )
+            backend.outstanding += 1
+        metrics.LLM_BACKEND_OUTSTANDING.labels(backend=backend.url).inc()
+        return backend
+
+    def _done(self, backend: Backend, started: float, error: Exception | None = None) -> None:
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            if error is None:
+                backend.latency_ema = elapsed if backend.latency_ema is None else 0.9 * backend.latency_ema + 0.1 * elapsed
+        metrics.LLM_BACKEND_OUTSTANDING.labels(backend=backend.url).dec()
+        if error is None:
+            metrics.LLM_BACKEND_SECONDS.labels(backend=backend.url).observe(elapsed)
+        elif _is_backend_failure(error):
+            self.eject(backend, error)
+
+    def eject(self, backend: Backend, error: Exception) -> None:
+        with self._lock:
+            backend.errors += 1
+            backend.last_error = f"{type(error).__name__}: {error}"
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+        metrics.LLM_BACKEND_ERRORS.labels(backend=backend.url).inc()
+        metrics.LLM_BACKEND_UP.labels(backend=backend.url).set(0)
+        logging.warning(f"Бэкенд Ollama {backend.url} исключён на {self.eject_seconds:.0f} с: {backend.last_error}")
+
+    def _restore(self, backend: Backend) -> None:
+        if not backend.healthy:
+            logging.info(f"Бэкенд Ollama {backend.url} снова доступен")
+        backend.ejected_until = 0.0
+        metrics.LLM_BACKEND_UP.labels(backend=backend.url).set(1)
+
+    def post_sync(self, path: str, payload: dict) -> dict:
+        tried = set()
+        for attempt in range(self.max_attempts):
+            backend = self._pick(tried)
+            tried.add(backend.url)
+            started = time.perf_counter()
+            try:
+                resp = backend.session.post(
+                    backend.url + path, json=payload, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+                )
+                resp.raise_for_status()
+                data = resp.json()
+            except requests.RequestException as e:
+                self._done(backend, started, e)
+                if not _is_backend_failure(e) or attempt == self.max_attempts - 1:
+                    raise
+                continue
+            self._done(backend, started)
+            return data
+
+    async def post(self, path: str, payload: dict) -> dict:
+        tried = set()
+        for attempt in range(self.max_attempts):
+            backend = self._pick(tried)
+            tried.add(backend.url)
+            started = time.perf_counter()
+            try:
+                resp = await backend.async_client().post(path, json=payload)
+                resp.raise_for_status()
+                data = resp.json()
+            except httpx.HTTPError as e:
+                self._done(backend, started, e)
+                if not _is_backend_failure(e) or attempt == self.max_attempts - 1:
+                    raise
+                continue
+            except BaseException as e:
+                # Отмена (клиент ушёл, дедлайн) — не вина бэкенда
+                self._done(backend, started, e)
+                raise
+            self._done(backend, started)
+            return data
+
+    @asynccontextmanager
+    async def stream(self, path: str, payload: dict):
+        """Потоковый запрос. Повтор на другом бэкенде возможен только до получения ответа:
+        после первых фрагментов ошибка пробрасывается вызывающему."""
+        tried = set()
+        for attempt in range(self.max_attempts):
+            backend = self._pick(tried)
+            tried.add(backend.url)
+            started = time.perf_counter()
+            stack = AsyncExitStack()
+            try:
+                resp = await stack.enter_async_context(backend.async_client().stream("POST", path, json=payload))
+                resp.raise_for_status()
+            except httpx.HTTPError as e:
+                await stack.aclose()
+                self._done(backend, started, e)
+                if not _is_backend_failure(e) or attempt == self.max_attempts - 1:
+                    raise
+                continue
+            except BaseException as e:
+                await stack.aclose()
+                self._done(backend, started, e)
+                raise
+            break
+
+        error = None
+        try:
+            async with stack:
+                yield resp
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._done(backend, started, error)
+
+    # Бэкенд жив, если отвечает без 5xx (ответ 4xx на /api/version — тоже признак живого сервера)
+    async def _check(self, backend: Backend) -> None:
+        try:
+            resp = await backend.async_client().get("/api/version", timeout=OLLAMA_CONNECT_TIMEOUT)
+            if resp.status_code >= 500:
+                resp.raise_for_status()
+        except httpx.HTTPError as e:
+            if backend.healthy:
+                self.eject(backend, e)
+            return
+        self._restore(backend)
+
+    async def health_check(self) -> list[dict]:
+        await asyncio.gather(*(self._check(backend) for backend in self.backends))
+        return self.stats()
+
+    # Фоновая задача API: исключённые бэкенды возвращаются в пул, как только отвечают
+    async def run_health_checks(self, interval: float = OLLAMA_HEALTH_INTERVAL) -> None:
+        while True:
+            await self.health_check()
+            await asyncio.sleep(interval)
+
+    # Один и тот же запрос на все бэкенды (например, подгрузка модели); ошибка — только если упали все
+    async def broadcast(self, path: str, payload: dict) -> None:
+        async def send(backend: Backend):
+            resp = await backend.async_client().post(path, json=payload)
+            resp.raise_for_status()
+
+        results = await asyncio.gather(*(send(b) for b in self.backends), return_exceptions=True)
+        errors = [(b, r) for b, r in zip(self.backends, results) if isinstance(r, Exception)]
+        for backend, error in errors:
+            logging.warning(f"Бэкенд Ollama {backend.url}: {path} не выполнен: {error}")
+        if len(errors) == len(self.backends):
+            raise errors[-1][1]
+
+    def stats(self) -> list[dict]:
+        return [backend.stats() for backend in self.backends]
+
+    async def aclose(self) -> None:
+        for backend in self.backends:
+            await backend.aclose()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Вопрос к Ollama напрямую, без поиска")
+    parser.add_argument("prompt")
+    parser.add_argument("--max-tokens", type=int, default=2048)
+    args = parser.parse_args()
+
+    pool = OllamaPool()
+    print(parse_completion(pool.post_sync("/v1/completions", completion_payload(args.prompt, args.max_tokens, 0.0))))
@@ -0,0 +1,63 @@
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+from pathlib import Path
+
+# Общие части бенчмарков: замер latency, перцентили и запись результатов в JSON для сравнения версий
+RESULTS_DIR = Path("benchmarks/results")
+
+
+def latency_stats(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+
+# Замер функции: warmup прогонов без учёта, затем repeat прогонов с latency каждого вызова
+def measure(func, repeat=100, warmup=5, items_per_call=1) -> dict:
+    for _ in range(warmup):
+        func()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {**latency_stats(samples), "items_per_s": repeat * items_per_call / elapsed}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(benchmark: str, params: dict, results: dict, output=None) -> Path:
+    record = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params,
+        "results": results
+    }
+    path = Path(output) if output else RESULTS_DIR / f"{benchmark}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return path
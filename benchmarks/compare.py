@@ -0,0 +1,47 @@
+import json
+
+# Сравнение двух файлов результатов (например, до и после изменения): отношение p50 / p99 и пропускной способности
+
+
+def _flatten(results: dict, prefix="") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "count" in value:
+            flat[name] = value
+        elif isinstance(value, dict) and "latency" in value:
+            flat[name] = {**value["latency"], "items_per_s": value.get("questions_per_s")}
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+    return flat
+
+
+def compare(baseline: dict, candidate: dict) -> list[tuple]:
+    old, new = _flatten(baseline["results"]), _flatten(candidate["results"])
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        row = [name]
+        for metric in ("p50_ms", "p99_ms", "items_per_s"):
+            before, after = old[name].get(metric), new[name].get(metric)
+            row.append(after / before if before and after else None)
+        rows.append(tuple(row))
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарков")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    print(f"{baseline['git_commit']} -> {candidate['git_commit']} (отношение новое / старое)")
+    print(f"{'метрика':40s} {'p50':>8s} {'p99':>8s} {'items/s':>8s}")
+    for name, *ratios in compare(baseline, candidate):
+        print(f"{name:40s} " + " ".join(f"{r:8.2f}" if r is not None else f"{'-':>8s}" for r in ratios))
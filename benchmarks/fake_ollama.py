@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Заглушка Ollama для бенчмарков без GPU: OpenAI-совместимый /v1/completions (обычный и потоковый)
+# и /api/generate для подгрузки модели. Задержки задаются переменными окружения или флагами CLI:
+#   FAKE_OLLAMA_TTFT        — задержка до первого токена, с
+#   FAKE_OLLAMA_TOKEN_DELAY — задержка между токенами, с
+#   FAKE_OLLAMA_TOKENS      — число токенов ответа
+#   FAKE_OLLAMA_THINK       — число токенов в секции <think> перед ответом
+TTFT = float(os.getenv("FAKE_OLLAMA_TTFT", "0.2"))
+TOKEN_DELAY = float(os.getenv("FAKE_OLLAMA_TOKEN_DELAY", "0.02"))
+TOKENS = int(os.getenv("FAKE_OLLAMA_TOKENS", "32"))
+THINK_TOKENS = int(os.getenv("FAKE_OLLAMA_THINK", "0"))
+
+app = FastAPI(title="Fake Ollama")
+
+
+def _tokens() -> list[str]:
+    think = [" думаю"] * THINK_TOKENS
+    answer = [" ответ"] * TOKENS
+    if think:
+        return ["<think>"] + think + ["</think>"] + answer
+    return answer
+
+
+def _usage(prompt: str, tokens: list[str]) -> dict:
+    # Оценка числа токенов промпта достаточна для метрик; точность здесь не важна
+    prompt_tokens = max(1, len(prompt) // 3)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)}
+
+
+def _chunk(model: str, text: str | None = None, finish_reason=None, usage=None) -> str:
+    data = {
+        "id": "cmpl-fake",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if text is None else [{"text": text, "index": 0, "finish_reason": finish_reason}]
+    }
+    if usage is not None:
+        data["usage"] = usage
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    prompt = body.get("prompt", "")
+    tokens = _tokens()[:body.get("max_tokens") or None]
+
+    if not body.get("stream"):
+        await asyncio.sleep(TTFT + TOKEN_DELAY * max(0, len(tokens) - 1))
+        return JSONResponse({
+            "id": "cmpl-fake",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"text": "".join(tokens), "index": 0, "finish_reason": "stop"}],
+            "usage": _usage(prompt, tokens)
+        })
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        await asyncio.sleep(TTFT)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(TOKEN_DELAY)
+            yield _chunk(model, token, "stop" if i == len(tokens) - 1 else None)
+        if include_usage:
+            yield _chunk(model, usage=_usage(prompt, tokens))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    return {"model": body.get("model", "fake"), "response": "", "done": True}
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Заглушка Ollama с настраиваемой задержкой")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=TTFT, help="задержка до первого токена, с")
+    parser.add_argument("--token-delay", type=float, default=TOKEN_DELAY, help="задержка между токенами, с")
+    parser.add_argument("--tokens", type=int, default=TOKENS, help="токенов в ответе")
+    parser.add_argument("--think", type=int, default=THINK_TOKENS, help="токенов в секции <think>")
+    args = parser.parse_args()
+
+    TTFT, TOKEN_DELAY, TOKENS, THINK_TOKENS = args.ttft, args.token_delay, args.tokens, args.think
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
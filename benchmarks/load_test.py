@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import httpx
+from pathlib import Path
+from benchmarks.common import latency_stats, write_results
+
+# Нагрузочный тест API: N конкурентных клиентов шлют вопросы в /query, /query/stream или /query/batch,
+# считаются пропускная способность, p50/p95/p99 latency, ошибки и (для stream) время до первого токена.
+# С --start-api / --start-fake-ollama всё поднимается локально, без GPU и сети.
+DEFAULT_QUESTIONS = [
+    "футбольный клуб в россии",
+    "примеры футбольных клубов россии",
+    "столица российской империи",
+    "кто написал роман война и мир",
+    "самая длинная река в европе",
+    "когда основан московский университет",
+    "какой город называют северной столицей",
+    "кто был первым президентом россии"
+]
+
+
+def load_questions(path) -> list[str]:
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix == ".jsonl":
+            return [json.loads(line)["question"] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip()]
+
+
+async def _one_request(client: httpx.AsyncClient, endpoint: str, question: str, batch_size: int) -> dict:
+    started = time.perf_counter()
+    if endpoint == "stream":
+        ttft = None
+        async with client.stream("POST", "/query/stream", json={"question": question}) as resp:
+            status = resp.status_code
+            async for line in resp.aiter_lines():
+                if ttft is None and line == "event: token":
+                    ttft = time.perf_counter() - started
+        return {"status": status, "latency": time.perf_counter() - started, "ttft": ttft}
+
+    if endpoint == "batch":
+        resp = await client.post("/query/batch", json={"questions": [question] * batch_size})
+    else:
+        resp = await client.post("/query", json={"question": question})
+    return {"status": resp.status_code, "latency": time.perf_counter() - started, "ttft": None}
+
+
+async def run_load(base_url: str, endpoint: str, questions: list[str], concurrency: int,
+                   total_requests: int, batch_size: int = 8, timeout: float = 300.0) -> dict:
+    samples = []
+    errors = {}
+    next_request = 0
+
+    async def worker(client):
+        nonlocal next_request
+        while next_request < total_requests:
+            i = next_request
+            next_request += 1
+            try:
+                sample = await _one_request(client, endpoint, questions[i % len(questions)], batch_size)
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            if sample["status"] != 200:
+                errors[str(sample["status"])] = errors.get(str(sample["status"]), 0) + 1
+                continue
+            samples.append(sample)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    questions_per_request = batch_size if endpoint == "batch" else 1
+    return {
+        "requests": total_requests,
+        "ok": len(samples),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(samples) / elapsed,
+        "questions_per_s": len(samples) * questions_per_request / elapsed,
+        "latency": latency_stats([s["latency"] for s in samples]),
+        "ttft": latency_stats([s["ttft"] for s in samples if s["ttft"] is not None])
+    }
+
+
+def _start(args: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **env})
+
+
+def _wait_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} не ответил за {timeout} с")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Нагрузочный тест RAG API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=("query", "stream", "batch"), default="query")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="уровни конкурентности, прогон на каждый")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждый уровень")
+    parser.add_argument("--batch-size", type=int, default=8, help="вопросов в одном /query/batch")
+    parser.add_argument("--questions", default=None, help="файл вопросов: .txt (по строке) или .jsonl с полем question")
+    parser.add_argument("--start-api", action="store_true", help="поднять API:app через uvicorn")
+    parser.add_argument("--start-fake-ollama", action="store_true", help="поднять benchmarks.fake_ollama")
+    parser.add_argument("--fake-ollama-port", type=int, default=11435)
+    parser.add_argument("--fake-ttft", type=float, default=0.2)
+    parser.add_argument("--fake-token-delay", type=float, default=0.02)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions) if args.questions else DEFAULT_QUESTIONS
+    processes = []
+    api_env = {}
+    try:
+        if args.start_fake_ollama:
+            fake_url = f"http://127.0.0.1:{args.fake_ollama_port}"
+            processes.append(_start([
+                "-m", "benchmarks.fake_ollama", "--port", str(args.fake_ollama_port),
+                "--ttft", str(args.fake_ttft), "--token-delay", str(args.fake_token_delay)
+            ], {}))
+            _wait_ready(fake_url + "/docs", args.startup_timeout)
+            # OLLAMA_HOSTS из окружения иначе перекрыл бы заглушку
+            api_env["OLLAMA_HOSTS"] = fake_url
+        if args.start_api:
+            host, port = httpx.URL(args.url).host, httpx.URL(args.url).port or 8000
+            # Кэши ответов и генераций отключены, иначе повторяющиеся вопросы измеряют только кэш.
+            # Заданные в окружении ANSWER_CACHE_SIZE / COMPLETION_CACHE_PATH не перетираются
+            for name, value in (("ANSWER_CACHE_SIZE", "0"), ("COMPLETION_CACHE_PATH", "")):
+                if name not in os.environ:
+                    api_env[name] = value
+            processes.append(_start(
+                ["-m", "uvicorn", "API:app", "--host", host, "--port", str(port), "--log-level", "warning"], api_env
+            ))
+        _wait_ready(args.url + "/readyz", args.startup_timeout)
+
+        results = {}
+        for concurrency in args.concurrency:
+            # Каждый уровень — отдельный прогон; первые запросы прогревают соединения
+            asyncio.run(run_load(args.url, args.endpoint, questions, concurrency, min(concurrency, args.requests),
+                                 args.batch_size))
+            report = asyncio.run(run_load(args.url, args.endpoint, questions, concurrency, args.requests,
+                                          args.batch_size))
+            results[f"c{concurrency}"] = report
+            latency = report["latency"]
+            print(
+                f"concurrency={concurrency}: {report['requests_per_s']:.1f} req/s, "
+                f"p50={latency.get('p50_ms', 0):.1f} ms p95={latency.get('p95_ms', 0):.1f} ms "
+                f"p99={latency.get('p99_ms', 0):.1f} ms, ошибок: {sum(report['errors'].values())}"
+            )
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=30)
+
+    path = write_results("load", {**vars(args), "questions": len(questions)}, results, args.output)
+    print(f"Результаты сохранены в {path}")
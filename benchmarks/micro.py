@@ -0,0 +1,146 @@
+import logging
+import numpy as np
+import prompt_builder
+from bm25_index import BM25Index
+from benchmarks.common import measure, write_results
+from retriever import NumpyRetriever
+
+# Микро-бенчмарки стадий пайплайна: encode, search (exact / int8 / Chroma HNSW), BM25 и сборка промпта.
+# Коллекция синтетическая (случайные векторы и тексты из словаря) или выборка из артефакта векторов.
+WORDS = (
+    "футбол клуб россия москва город история война год река страна президент фильм роман "
+    "театр музыка университет наука учёный премия команда чемпионат кубок область район "
+    "население столица империя революция писатель художник актёр журнал газета завод"
+).split()
+
+
+def synthetic_collection(size: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    texts = [" ".join(rng.choice(WORDS, size=rng.integers(20, 80))) for _ in range(size)]
+    columns = {
+        "uid": [str(i) for i in range(size)],
+        "ru_wiki_pageid": [str(i // 4) for i in range(size)],
+        "text": texts
+    }
+    return vectors, columns
+
+
+def sampled_collection(path, size: int, seed: int = 0):
+    from vector_store import load_vectors
+
+    vectors, columns = load_vectors(path)
+    rows = np.sort(np.random.default_rng(seed).choice(len(vectors), size=min(size, len(vectors)), replace=False))
+    sample = {name: [columns[name][i] for i in rows] for name in ("uid", "ru_wiki_pageid", "text")}
+    return np.asarray(vectors[rows], dtype=np.float32), sample
+
+
+def bench_encode(backend: str, texts: list[str], repeat: int) -> dict:
+    from embedder import load_embedder
+
+    embedder = load_embedder(backend)
+    batch = texts[:64]
+    return {
+        "single": measure(lambda: embedder.encode([texts[0]]), repeat=repeat),
+        "batch64": measure(lambda: embedder.encode(batch, batch_size=64), repeat=max(1, repeat // 10),
+                           items_per_call=len(batch))
+    }
+
+
+def bench_search(vectors, columns, queries, top_k: int, repeat: int, with_chroma: bool) -> dict:
+    results = {}
+    query_iter = iter(range(10 ** 9))
+
+    def next_query():
+        return queries[next(query_iter) % len(queries)][np.newaxis, :]
+
+    for name, quantize in (("numpy_exact", None), ("numpy_int8", "int8")):
+        retriever = NumpyRetriever(vectors, columns, quantize=quantize)
+        results[name] = measure(lambda: retriever.search(next_query(), top_k), repeat=repeat)
+        results[name + "_batch32"] = measure(
+            lambda: retriever.search(queries[:32], top_k), repeat=max(1, repeat // 10), items_per_call=32
+        )
+
+    if with_chroma:
+        try:
+            import chromadb
+        except ImportError:
+            logging.warning("chromadb не установлен, бенчмарк HNSW пропущен")
+            return results
+        from retriever import ChromaRetriever
+
+        collection = chromadb.EphemeralClient().create_collection("bench")
+        for start in range(0, len(vectors), 5000):
+            end = start + 5000
+            collection.add(
+                ids=columns["uid"][start:end],
+                embeddings=vectors[start:end].tolist(),
+                documents=columns["text"][start:end],
+                metadatas=[{"uid": uid, "ru_wiki_pageid": page}
+                           for uid, page in zip(columns["uid"][start:end], columns["ru_wiki_pageid"][start:end])]
+            )
+        retriever = ChromaRetriever(collection)
+        results["chroma_hnsw"] = measure(lambda: retriever.search(next_query(), top_k), repeat=repeat)
+    return results
+
+
+def bench_bm25(columns, repeat: int) -> dict:
+    index = BM25Index.build({"uid": uid, "text": text} for uid, text in zip(columns["uid"], columns["text"]))
+    rng = np.random.default_rng(1)
+    queries = [" ".join(rng.choice(WORDS, size=4)) for _ in range(64)]
+    query_iter = iter(range(10 ** 9))
+    return measure(lambda: index.search(queries[next(query_iter) % len(queries)], 30), repeat=repeat)
+
+
+def bench_prompt(columns, top_k: int, repeat: int, tokenizer: str | None) -> dict:
+    count_tokens = prompt_builder.TokenCounter(tokenizer)
+    chunks = columns["text"][:top_k]
+    metadatas = [{"ru_wiki_pageid": page} for page in columns["ru_wiki_pageid"][:top_k]]
+    distances = [0.1 * i for i in range(len(chunks))]
+    return measure(
+        lambda: prompt_builder.build_prompt(
+            "футбольный клуб в россии", chunks, metadatas, distances, count_tokens=count_tokens,
+            token_budget=1500, max_per_page=2, dedup_threshold=0.8
+        ),
+        repeat=repeat
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки encode / search / BM25 / prompt build")
+    parser.add_argument("--size", type=int, default=50000, help="размер коллекции")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--vectors", default=None, help="брать выборку из артефакта векторов вместо синтетики")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--backend", default=None, help="бэкенд векторизации (torch / onnx / onnx-int8)")
+    parser.add_argument("--skip-encode", action="store_true", help="не грузить модель (например, без сети)")
+    parser.add_argument("--chroma", action="store_true", help="добавить HNSW ChromaDB (in-memory коллекция)")
+    parser.add_argument("--tokenizer", default=None, help="токенайзер для подсчёта токенов промпта")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors, columns = sampled_collection(args.vectors, args.size)
+    else:
+        vectors, columns = synthetic_collection(args.size, args.dim)
+    queries = np.random.default_rng(2).standard_normal((64, vectors.shape[1])).astype(np.float32)
+
+    results = {}
+    if not args.skip_encode:
+        results["encode"] = bench_encode(args.backend, columns["text"], args.repeat)
+    results["search"] = bench_search(vectors, columns, queries, args.top_k, args.repeat, args.chroma)
+    results["bm25"] = bench_bm25(columns, args.repeat)
+    results["prompt"] = bench_prompt(columns, args.top_k, args.repeat, args.tokenizer)
+
+    params = {**vars(args), "size": len(vectors), "dim": int(vectors.shape[1])}
+    path = write_results("micro", params, results, args.output)
+    for stage, stats in results.items():
+        for name, value in (stats.items() if "count" not in stats else [("", stats)]):
+            print(f"{stage:8s} {name:18s} p50={value['p50_ms']:.3f} ms p99={value['p99_ms']:.3f} ms "
+                  f"{value['items_per_s']:.1f}/s")
+    print(f"Результаты сохранены в {path}")
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import numpy as np
+from pathlib import Path
+from collection_versions import versioned_name
+from json_stream import iter_json_array
+
+# Лексический индекс BM25 по обработанным параграфам (выход preprocess_data).
+# Постинги хранятся в CSR-виде: term_offsets[t]:term_offsets[t+1] — срез doc_ids / tfs для терма t.
+# Массивы лежат в отдельных .npy и открываются через memmap, в память подтягиваются только нужные постинги.
+# Каждое сохранение пишет новую версию <path>/bm25__v<время>/ и переключает файл-указатель <path>/current:
+# файлы, открытые работающим API через memmap, не перезаписываются, а массивы и словарь всегда из одной версии.
+BM25_INDEX_PATH = Path("data/bm25_index")
+TOKEN_RE = re.compile(r'\w+')
+ARRAYS = ("term_offsets", "doc_ids", "tfs", "doc_lengths")
+CURRENT_POINTER_FILE = "current"
+# Сколько версий оставлять: предыдущую может ещё дочитывать процесс, прочитавший старый указатель
+KEEP_VERSIONS = 2
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def read_index_version(path) -> str | None:
+    try:
+        return (Path(path) / CURRENT_POINTER_FILE).read_text(encoding='utf-8').strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Каталог с файлами версии; без указателя (индекс, сохранённый до версий) — сам path
+def index_dir(path, version: str | None) -> Path:
+    return Path(path) / version if version else Path(path)
+
+
+def _remove_stale_versions(path: Path, current: str) -> None:
+    versions = sorted(p.name for p in path.glob("bm25__v*") if p.is_dir() and p.name != current)
+    for name in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(path / name, ignore_errors=True)
+    # Файлы старого формата прямо в path: уже открытые memmap переживут удаление
+    for name in (*(f"{array}.npy" for array in ARRAYS), "vocab.json"):
+        (path / name).unlink(missing_ok=True)
+
+
+class BM25Index:
+    def __init__(self, vocab, term_offsets, doc_ids, tfs, doc_lengths, uids, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.uids = uids
+        self.k1 = k1
+        self.b = b
+
+        n_docs = len(doc_lengths)
+        df = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+        # Нормировка длины документа считается один раз при загрузке
+        self._length_norm = (k1 * (1.0 - b + b * doc_lengths / (avg_length or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, records, **kwargs):
+        # records может быть и потоком (например, iter_json_array по обработанному файлу)
+        vocab = {}
+        postings = []  # (term_id, doc_id, tf)
+        doc_lengths = []
+        uids = []
+        for doc_id, item in enumerate(records):
+            tokens = tokenize(item['text'])
+            doc_lengths.append(len(tokens))
+            uids.append(str(item['uid']))
+            counts = {}
+            for token in tokens:
+                term_id = vocab.setdefault(token, len(vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            postings.extend((term_id, doc_id, tf) for term_id, tf in counts.items())
+
+        triples = np.array(postings, dtype=np.int64).reshape(-1, 3)
+        order = np.lexsort((triples[:, 1], triples[:, 0]))
+        triples = triples[order]
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(triples[:, 0], minlength=len(vocab)), out=term_offsets[1:])
+
+        logging.info(f"BM25: {len(uids)} документов, {len(vocab)} термов, {len(triples)} постингов")
+        return cls(
+            vocab, term_offsets,
+            triples[:, 1].astype(np.int32), triples[:, 2].astype(np.uint16),
+            np.asarray(doc_lengths, dtype=np.float32), uids, **kwargs
+        )
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        version = versioned_name("bm25")
+        # Версия собирается во временном каталоге и появляется под своим именем только целиком
+        tmp_dir = path / (version + ".tmp")
+        tmp_dir.mkdir()
+        for name in ARRAYS:
+            np.save(tmp_dir / f"{name}.npy", getattr(self, name))
+        with open(tmp_dir / "vocab.json", 'w', encoding='utf-8') as f:
+            json.dump({"terms": list(self.vocab), "uids": self.uids}, f, ensure_ascii=False)
+        os.replace(tmp_dir, path / version)
+
+        pointer = path / CURRENT_POINTER_FILE
+        tmp_pointer = pointer.with_suffix(".tmp")
+        tmp_pointer.write_text(version, encoding='utf-8')
+        # os.replace атомарен: читатель видит либо старую, либо новую версию
+        os.replace(tmp_pointer, pointer)
+        _remove_stale_versions(path, version)
+        logging.info(f"BM25-индекс сохранён в {path / version}")
+        return path / version
+
+    @classmethod
+    def load(cls, path, version: str | None = None, **kwargs):
+        path = index_dir(path, version or read_index_version(path))
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode='r') for name in ARRAYS}
+        with open(path / "vocab.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vocab = {term: i for i, term in enumerate(meta["terms"])}
+        return cls(
+            vocab, arrays["term_offsets"], arrays["doc_ids"], arrays["tfs"],
+            arrays["doc_lengths"], meta["uids"], **kwargs
+        )
+
+    def search(self, query_text: str, top_k: int = 10) -> list[tuple[str, float]]:
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term in set(tokenize(query_text)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1.0) / (tf + self._length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if matched.size == 0:
+            return []
+        top = matched[np.argsort(-scores[matched], kind='stable')[:top_k]]
+        return [(self.uids[i], float(scores[i])) for i in top]
+
+
+class LazyBM25Index:
+    """Загружает индекс с диска при первом запросе; до этого API не тратит на него память."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.version = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return (index_dir(self.path, read_index_version(self.path)) / "vocab.json").exists()
+
+    def _load(self) -> None:
+        version = read_index_version(self.path)
+        self._index = BM25Index.load(self.path, version)
+        self.version = version
+
+    def get(self) -> BM25Index:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._load()
+        return self._index
+
+    # Подхватить новую версию, если индекс уже загружен; ещё не загруженный прочитает свежую при первом запросе
+    def reload(self, force: bool = False) -> bool:
+        with self._lock:
+            if self._index is None or not self.exists():
+                return False
+            if read_index_version(self.path) == self.version and not force:
+                return False
+            self._load()
+            return True
+
+
+# Reciprocal rank fusion нескольких ранжированных списков id
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(filename='preprocess.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Построение BM25-индекса по обработанным параграфам")
+    parser.add_argument("--input", default="data/processed_RuBQ_2.0_paragraphs.json")
+    parser.add_argument("--output", default=str(BM25_INDEX_PATH))
+    args = parser.parse_args()
+
+    records = (item for item in iter_json_array(args.input) if item.get('text'))
+    saved = BM25Index.build(records).save(args.output)
+    size = sum(os.path.getsize(saved / f"{name}.npy") for name in ARRAYS)
+    print(f"BM25-индекс сохранён в {saved} ({size / 2 ** 20:.1f} MiB)")
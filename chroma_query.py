@@ -1,86 +1,175 @@
-import numpy as np
-import chromadb
-from sentence_transformers import SentenceTransformer
+import asyncio
+import csv
+import json
 import logging
+import os
+import time
 from pathlib import Path
-import requests
+import numpy as np
+import rag_core
 
 # Настройка логирования
 logging.basicConfig(filename='chromadb.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-PERSIST_DIR = Path("chroma_data").absolute()
-
-
-def query_chromadb(query_text, collection_name="ru_bq_collection", top_k=10):
-    logging.info(f"Инициализация PersistentClient для запроса: {query_text}")
-    client = chromadb.PersistentClient(path=str(PERSIST_DIR))
-    collection = client.get_collection(name=collection_name)
-
-    logging.info("Загрузка SentenceTransformer и векторизация запроса")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    query_vector = model.encode([query_text]).astype(np.float32)
-
-    logging.info(f"Выполнение поиска по вектору. Top_k={top_k}")
-    results = collection.query(
-        query_embeddings=query_vector,
-        n_results=top_k
-    )
-
-    logging.info(f"Найдено {len(results['ids'][0])} результатов")
-
-    # Сбор контекста для промпта
-    context_chunks = results['documents'][0]
-    prompt_lines = ["Вы получили следующие фрагменты текста, релевантные запросу:"]
-    for i, chunk in enumerate(context_chunks, start=1):
-        prompt_lines.append(f"{i}) {chunk}")
-    prompt_lines.append("")
-    prompt_lines.append(f"На основе этих фрагментов ответьте на вопрос: «{query_text}»")
-    prompt = "\n".join(prompt_lines)
-
-    # Генерация через Ollama
-    answer = ask_ollama_http(prompt)
-
-    return results, answer, prompt
-
-
-OLLAMA_HOST = "http://127.0.0.1:11434"
-OLLAMA_MODEL = "deepseek-r1"
-
-
-def strip_think_sections(raw: str) -> str:
-    parts = raw.split("</think>")
-    if len(parts) > 1:
-        final_part = "".join(parts[1:]).strip()
-        return final_part
-    else:
-        return raw.strip()
-
-
-def ask_ollama_http(prompt: str, max_tokens: int = 2048, temperature: float = 0.0) -> str:
-    instruction = "Дай максимально лаконичный ответ на данный вопрос.\n\n"
-    payload_prompt = instruction + prompt
-
-    url = f"{OLLAMA_HOST}/v1/completions"
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": payload_prompt,
-        "max_tokens": max_tokens,
-        "temperature": temperature
+# CLI поверх rag_core: модель, индекс и соединения с Ollama поднимаются один раз на сессию.
+# Без --questions — интерактивный режим, с файлом вопросов — пакетный прогон для офлайн-оценки:
+# поиск батчами, генерации параллельно, результаты пишутся в JSONL по мере готовности.
+
+
+# Вопросы из .jsonl / .json (строки или записи с question / question_text, как в RuBQ), .csv (колонка question
+# или первая колонка) или .txt (по строке). Возвращает пары (исходная запись, текст вопроса);
+# записи без текста вопроса пропускаются с предупреждением
+def load_questions(path) -> list[tuple[dict, str]]:
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.suffix == ".jsonl":
+            records = [json.loads(line) for line in f if line.strip()]
+        elif path.suffix == ".json":
+            records = json.load(f)
+        elif path.suffix == ".csv":
+            reader = csv.DictReader(f)
+            if not reader.fieldnames:
+                records = []
+            else:
+                column = "question" if "question" in reader.fieldnames else reader.fieldnames[0]
+                records = [(row, row[column]) for row in reader]
+        else:
+            records = [line.strip() for line in f if line.strip()]
+    if not isinstance(records, list):
+        raise ValueError(f"{path}: ожидался список вопросов")
+
+    questions = []
+    for record in records:
+        if isinstance(record, tuple):
+            source, text = record
+        elif isinstance(record, dict):
+            source, text = record, record.get("question_text") or record.get("question")
+        else:
+            source, text = {"question": record}, record
+        if isinstance(text, str) and text.strip():
+            questions.append((source, text))
+    if len(questions) < len(records):
+        logging.warning(f"{path}: пропущено {len(records) - len(questions)} записей без текста вопроса")
+        print(f"Пропущено {len(records) - len(questions)} записей без текста вопроса")
+    return questions
+
+
+# Продолжение прерванного прогона: в файле остаётся по одной успешной строке на вопрос
+# (ошибочные и оборванные строки будут посчитаны заново), возвращаются номера готовых вопросов
+def _prepare_resume(output_path) -> set[int]:
+    path = Path(output_path)
+    if not path.exists():
+        return set()
+    kept = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"{path}: пропущена повреждённая строка")
+                continue
+            if not row.get("error"):
+                kept.setdefault(row["index"], line.rstrip("\n"))
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(line + "\n" for line in kept.values())
+    os.replace(tmp_path, path)
+    return set(kept)
+
+
+def _output_record(index: int, source: dict, result: dict, elapsed: float) -> dict:
+    return {
+        "index": index,
+        "question": result["query"],
+        "answer": result["answer"],
+        "chunks": result["chunks"],
+        "distances": result["distances"],
+        "uids": [meta.get("uid") for meta in result["metadatas"]],
+        "prompt_tokens": result.get("prompt_tokens"),
+        "usage": result.get("usage"),
+        "cache": result.get("cache"),
+        "elapsed": round(elapsed, 3),
+        "source": source
     }
 
-    resp = requests.post(url, json=payload)
-    resp.raise_for_status()
-    data = resp.json()
 
-    if "choices" in data and data["choices"]:
-        raw_text = data["choices"][0]["text"]
-        return strip_think_sections(raw_text)
-    else:
-        return str(data)
+async def run_batch(questions: list[tuple[dict, str]], output_path, top_k=10, batch_size=64, concurrency=4,
+                    retrieval_only=False, use_cache=True, resume=False) -> dict:
+    done = _prepare_resume(output_path) if resume else set()
+    pending = [(i, source, text) for i, (source, text) in enumerate(questions) if i not in done]
+    logging.info(f"Пакетный прогон: вопросов {len(questions)}, уже готово {len(done)}, к обработке {len(pending)}")
+
+    await asyncio.to_thread(rag_core.init_pipeline)
+    # Лимит Ollama задаёт планировщик процесса (OLLAMA_MAX_CONCURRENCY на бэкенд); больше генераций,
+    # чем он пропускает и держит в очереди, не отправляем — иначе часть вопросов получит QueueFull
+    scheduler = rag_core.generation_scheduler
+    capacity = scheduler.max_concurrency + scheduler.max_queue
+    if concurrency > capacity:
+        logging.warning(f"--concurrency {concurrency} больше ёмкости планировщика генераций, используем {capacity}")
+        concurrency = capacity
+    limiter = asyncio.Semaphore(concurrency)
+    stats = {"questions": 0, "errors": 0, "retrieval_s": 0.0, "latencies": []}
+    started = time.perf_counter()
+
+    with open(output_path, 'a' if resume else 'w', encoding='utf-8') as out:
+        def write(record: dict) -> None:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            stats["questions"] += 1
+            stats["errors"] += bool(record.get("error"))
+            if stats["questions"] % 100 == 0:
+                rate = stats["questions"] / (time.perf_counter() - started)
+                print(f"Обработано {stats['questions']} из {len(pending)} ({rate:.2f} вопросов/с)")
+
+        async def answer(index: int, source: dict, text: str, single: dict, batch_started: float) -> None:
+            try:
+                context = rag_core.build_prompt(text, single)
+                completion = await rag_core.acomplete(context['prompt'], use_cache=use_cache, priority="batch")
+                result = rag_core.make_result(text, context, *completion)
+                elapsed = time.perf_counter() - batch_started
+                stats["latencies"].append(elapsed)
+                write(_output_record(index, source, result, elapsed))
+            except Exception as e:
+                logging.exception(f"Вопрос {index} не обработан")
+                write({"index": index, "question": text, "error": str(e), "source": source})
+            finally:
+                limiter.release()
+
+        tasks = []
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            texts = [text for _, _, text in batch]
+            # Поиск следующего батча идёт, пока генерируются ответы на предыдущий
+            batch_started = time.perf_counter()
+            _, results = await rag_core.run_in_executor(rag_core.retrieve_batch, texts, top_k)
+            stats["retrieval_s"] += time.perf_counter() - batch_started
+
+            for j, (index, source, text) in enumerate(batch):
+                single = rag_core.split_results(results, j)
+                if retrieval_only:
+                    write(_output_record(index, source, rag_core.make_retrieval_result(text, single), 0.0))
+                    continue
+                await limiter.acquire()
+                tasks.append(asyncio.create_task(answer(index, source, text, single, batch_started)))
+        await asyncio.gather(*tasks)
+
+    await rag_core.aclose()
+    total = time.perf_counter() - started
+    latencies = np.asarray(stats.pop("latencies") or [0.0])
+    return {
+        **stats,
+        "total_s": total,
+        "questions_per_s": stats["questions"] / total if total else 0.0,
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p95_s": float(np.percentile(latencies, 95))
+    }
 
 
-if __name__ == "__main__":
+def interactive(top_k=10) -> None:
     print("Введите вопрос для обработки (для выхода введите 'exit'):")
+    rag_core.init_pipeline()
 
     while True:
         query_text = input("> ").strip()
@@ -93,24 +182,52 @@ if __name__ == "__main__":
             print("Пожалуйста, введите непустой вопрос.")
             continue
 
-        results, answer, prompt = query_chromadb(query_text, top_k=10)
+        result = rag_core.query_chromadb(query_text, top_k=top_k)
 
         print(f"Запрос: {query_text}")
-        print("\n=== Найденные чанки ===")
-        for i, (text, meta, distance) in enumerate(
-                zip(results['documents'][0], results['metadatas'][0], results['distances'][0])):
+        print("\n=== Чанки в промпте ===")
+        for i, (text, meta, distance) in enumerate(zip(result['chunks'], result['metadatas'], result['distances'])):
             print(f"{i + 1}. UID: {meta['uid']}, расстояние: {distance:.4f}")
             print(f"Текст: {text}\n")
 
-        print("\n=== Сформированный prompt ===\n")
-        print(prompt)
+        print(f"\n=== Ответ модели Ollama ({result['prompt_tokens']} токенов промпта) ===\n")
+        print(result['answer'])
 
-        print("\n=== Ответ модели Ollama ===\n")
-        print(answer)
 
-        with open("README.md", "a", encoding='utf-8') as f:
-            f.write("\n## Результаты работы с ChromaDB + Ollama\n")
-            f.write(f"- Запрос: {query_text}\n")
-            f.write(f"- Ответ: {answer}\n")
-            f.write(f"- Кол-во чанков: {len(results['documents'][0])}\n")
-            f.write(f"- Пример расстояния: {min(results['distances'][0]):.4f}\n")
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Вопросы к RAG: интерактивно или пакетом из файла")
+    parser.add_argument("--questions", default=None, help="файл вопросов (.jsonl, .json, .csv или .txt)")
+    parser.add_argument("--output", default="data/answers.jsonl", help="JSONL с ответами (пишется по мере готовности)")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64, help="вопросов на один пакетный поиск")
+    parser.add_argument("--concurrency", type=int, default=rag_core.BATCH_LLM_CONCURRENCY,
+                        help="сколько генераций держать в работе (одновременно в Ollama — не больше лимита планировщика)")
+    parser.add_argument("--limit", type=int, default=None, help="взять только первые N вопросов")
+    parser.add_argument("--retrieval-only", action="store_true", help="только поиск, без генерации")
+    parser.add_argument("--no-cache", action="store_true", help="не брать ответы из кэша генераций")
+    parser.add_argument("--resume", action="store_true", help="дописать в --output, пропустив готовые вопросы")
+    args = parser.parse_args()
+
+    if args.questions is None:
+        interactive(args.top_k)
+    else:
+        questions = load_questions(args.questions)[:args.limit]
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        summary = asyncio.run(run_batch(
+            questions, args.output,
+            top_k=args.top_k,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            retrieval_only=args.retrieval_only,
+            use_cache=not args.no_cache,
+            resume=args.resume
+        ))
+        logging.info(f"Пакетный прогон завершён: {summary}")
+        print(
+            f"Готово: {summary['questions']} вопросов за {summary['total_s']:.1f} с "
+            f"({summary['questions_per_s']:.2f} вопросов/с), ошибок {summary['errors']}, "
+            f"поиск {summary['retrieval_s']:.1f} с, p50 {summary['p50_s']:.2f} с, p95 {summary['p95_s']:.2f} с. "
+            f"Результаты: {args.output}"
+        )
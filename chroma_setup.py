@@ -1,9 +1,17 @@
-import json
 import numpy as np
 import chromadb
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
 import os
+import yaml
+from collection_versions import (
+    delete_collection, garbage_collect, list_shards, resolve_collection, shard_name, shard_of, validate_collection,
+    versioned_name, write_active_collection
+)
+from retriever import ChromaRetriever, ShardedRetriever
+from semantic_cache import write_collection_version
+from vector_store import VECTORS_PATH, load_vectors
 
 # Настройка логирования
 logging.basicConfig(
@@ -12,67 +20,253 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Загрузка данных из JSON-файла
+PERSIST_DIR = Path("chroma_data").absolute()
+CONFIG_PATH = Path("configs/config.yaml")
+# Параметры HNSW по умолчанию — как у ChromaDB; подобранные hnsw_tuning.py пишутся в секцию hnsw конфига
+HNSW_DEFAULTS = {"space": "l2", "M": 16, "construction_ef": 100, "search_ef": 10}
+
+# Параметры HNSW из конфига (недостающие — по умолчанию)
+def load_hnsw_settings(config_path=CONFIG_PATH):
+    settings = dict(HNSW_DEFAULTS)
+    if Path(config_path).exists():
+        with open(config_path, 'r', encoding='utf-8') as f:
+            settings.update((yaml.safe_load(f) or {}).get('hnsw') or {})
+    return settings
+
+# Метаданные коллекции с параметрами индекса (space, M и construction_ef задаются только при создании)
+def hnsw_metadata(settings):
+    return {f"hnsw:{key}": value for key, value in settings.items() if key in HNSW_DEFAULTS}
+
+# search_ef можно менять у существующей коллекции; процессы подхватывают его при следующей загрузке индекса
+def set_search_ef(collection, search_ef):
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+    except TypeError:
+        # Старые версии ChromaDB без configuration: параметр хранится в метаданных
+        metadata = {k: v for k, v in (collection.metadata or {}).items() if k != "hnsw:space"}
+        collection.modify(metadata={**metadata, "hnsw:search_ef": search_ef})
+
+# Загрузка векторов (memmap) и колонок метаданных
 def load_data(input_path):
     logging.info(f"Загрузка данных из {input_path}")
-    with open(input_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_vectors(input_path)
+
+# Метаданные записей; text_hash нужен для инкрементальной синхронизации
+def _build_metadatas(columns):
+    return [
+        {"uid": str(uid), "ru_wiki_pageid": str(pageid), "text_hash": h}
+        for uid, pageid, h in zip(columns['uid'], columns['ru_wiki_pageid'], columns['hash'])
+    ]
+
+# Хэши текстов, уже лежащих в коллекции: uid -> text_hash (читаем постранично)
+def _existing_hashes(collection, page_size=10000):
+    hashes = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        for uid, meta in zip(page['ids'], page['metadatas']):
+            hashes[uid] = (meta or {}).get("text_hash")
+        if len(page['ids']) < page_size:
+            return hashes
+        offset += page_size
+
+# Инкрементальная синхронизация одной коллекции (или шарда) со строками rows артефакта
+def _sync_collection(collection, vectors, columns, rows, batch_size, hnsw):
+    # Параметры построения графа у существующей коллекции не меняются — только через --rebuild
+    current = collection.metadata or {}
+    stale = {
+        key: (current.get(f"hnsw:{key}", HNSW_DEFAULTS[key]), hnsw[key])
+        for key in ("space", "M", "construction_ef")
+        if current.get(f"hnsw:{key}", HNSW_DEFAULTS[key]) != hnsw[key]
+    }
+    if stale:
+        logging.warning(f"Параметры HNSW коллекции отличаются от конфига {stale}, примените их через --rebuild")
+    set_search_ef(collection, hnsw["search_ef"])
 
-# Настройка ChromaDB и загрузка данных
-def setup_chromadb(data, collection_name="ru_bq_collection", batch_size=5000):
-    # Директория для хранения данных ChromaDB
-    persist_dir = Path("chroma_data").absolute()
+    existing = _existing_hashes(collection)
+    ids = [str(uid) for uid in columns['uid']]
+    changed = [i for i in rows if existing.get(ids[i]) != columns['hash'][i]]
+    removed = sorted(set(existing) - {ids[i] for i in rows})
+    logging.info(
+        f"Синхронизация {collection.name}: в коллекции {len(existing)}, в артефакте {len(rows)}, "
+        f"к обновлению {len(changed)}, к удалению {len(removed)}"
+    )
+
+    metadatas = _build_metadatas(columns)
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        collection.upsert(
+            ids=[ids[i] for i in batch],
+            embeddings=np.asarray(vectors[batch], dtype=np.float32),
+            documents=[columns['text'][i] for i in batch],
+            metadatas=[metadatas[i] for i in batch]
+        )
+
+    for start in range(0, len(removed), batch_size):
+        collection.delete(ids=removed[start:start + batch_size])
+    return len(changed), len(removed)
+
+# Инкрементальная синхронизация: upsert новых и изменённых записей, удаление исчезнувших uid
+def sync_chromadb(vectors, columns, collection_name="ru_bq_collection", batch_size=5000,
+                  persist_dir=PERSIST_DIR, hnsw=None):
+    hnsw = hnsw or load_hnsw_settings()
     os.makedirs(persist_dir, exist_ok=True)
 
-    # Создание клиента ChromaDB (новый API)
     logging.info(f"Создание PersistentClient в директории {persist_dir}")
     client = chromadb.PersistentClient(path=str(persist_dir))
+    # Синхронизируем активную версию коллекции (после blue/green-пересборки это <имя>__v<время>)
+    collection_name = resolve_collection(persist_dir, collection_name)
+    shards = list_shards(client, collection_name)
+    if shards:
+        # Число шардов задано при сборке; каждая запись остаётся в шарде по хэшу своего uid
+        rows_by_shard = [[] for _ in shards]
+        for i, uid in enumerate(columns['uid']):
+            rows_by_shard[shard_of(uid, len(shards))].append(i)
+        targets = [(client.get_collection(name=name), rows) for name, rows in zip(shards, rows_by_shard)]
+    else:
+        collection = client.get_or_create_collection(name=collection_name, metadata=hnsw_metadata(hnsw))
+        targets = [(collection, list(range(len(vectors))))]
+
+    upserted = deleted = 0
+    for collection, rows in targets:
+        changed, removed = _sync_collection(collection, vectors, columns, rows, batch_size, hnsw)
+        upserted += changed
+        deleted += removed
+
+    if upserted or deleted:
+        # Новая метка версии сбрасывает кэш ответов у запущенного API
+        write_collection_version(persist_dir)
+    else:
+        logging.info("Коллекция уже актуальна, изменений нет.")
+    return {"upserted": upserted, "deleted": deleted, "total": len(vectors)}
 
+# Пересоздание коллекции и загрузка в неё строк rows по пакетам
+def _load_collection(client, collection_name, vectors, columns, rows, batch_size, hnsw):
     # Попытка получить или пересоздать коллекцию
     try:
         collection = client.get_collection(name=collection_name)
         logging.warning(f"Коллекция {collection_name} уже существует, удаляем и создаём заново...")
-        collection.delete()
-        collection = client.create_collection(name=collection_name)
+        client.delete_collection(name=collection_name)
+        collection = client.create_collection(name=collection_name, metadata=hnsw_metadata(hnsw))
     except:
-        collection = client.create_collection(name=collection_name)
+        collection = client.create_collection(name=collection_name, metadata=hnsw_metadata(hnsw))
         logging.info(f"Создана новая коллекция {collection_name}")
 
     # Подготовка данных
-    ids = [str(item['uid']) for item in data]
-    texts = [item['text'] for item in data]
-    vectors = np.array([item['vector'] for item in data], dtype=np.float32)
-    metadatas = [{"uid": str(item['uid']), "ru_wiki_pageid": str(item['ru_wiki_pageid'])} for item in data]
-
-    # Загрузка данных по пакетам
-    for i in range(0, len(data), batch_size):
-        batch_ids = ids[i:i + batch_size]
-        batch_texts = texts[i:i + batch_size]
-        batch_vectors = vectors[i:i + batch_size]
-        batch_metadatas = metadatas[i:i + batch_size]
+    total = len(rows)
+    ids = [str(uid) for uid in columns['uid']]
+    texts = columns['text']
+    metadatas = _build_metadatas(columns)
 
+    # Загрузка данных по пакетам; векторы читаются из memmap срезами
+    for i in range(0, total, batch_size):
+        batch = rows[i:i + batch_size]
         logging.info(
-            f"Добавление пакета {i // batch_size + 1} из {len(data) // batch_size + 1} (с {i} по {min(i + batch_size, len(data))})"
+            f"{collection_name}: пакет {i // batch_size + 1} из {total // batch_size + 1} (с {i} по {min(i + batch_size, total)})"
         )
         collection.add(
-            ids=batch_ids,
-            embeddings=batch_vectors,
-            documents=batch_texts,
-            metadatas=batch_metadatas
+            ids=[ids[j] for j in batch],
+            embeddings=np.asarray(vectors[batch], dtype=np.float32),
+            documents=[texts[j] for j in batch],
+            metadatas=[metadatas[j] for j in batch]
         )
 
-    logging.info(f"Успешно добавлено {len(data)} записей в коллекцию.")
+    logging.info(f"Успешно добавлено {total} записей в коллекцию {collection_name}.")
+    return collection
+
+# Полная пересборка ChromaDB и загрузка данных. При shards > 1 записи делятся по хэшу uid
+# на коллекции <имя>__s00.., у каждой свой HNSW-граф меньшего размера; шарды строятся параллельно.
+# Возвращает собранные коллекции (одну или по одной на шард).
+def setup_chromadb(vectors, columns, collection_name="ru_bq_collection", batch_size=5000,
+                   persist_dir=PERSIST_DIR, hnsw=None, shards=1):
+    # Параметры индекса: space, M, construction_ef, search_ef (см. hnsw_tuning.py)
+    hnsw = hnsw or load_hnsw_settings()
+    os.makedirs(persist_dir, exist_ok=True)
+
+    # Создание клиента ChromaDB (новый API)
+    logging.info(f"Создание PersistentClient в директории {persist_dir}")
+    client = chromadb.PersistentClient(path=str(persist_dir))
+    logging.info(f"Параметры HNSW: {hnsw}, шардов: {shards}")
+
+    if shards <= 1:
+        collections = [_load_collection(client, collection_name, vectors, columns, list(range(len(vectors))),
+                                        batch_size, hnsw)]
+    else:
+        rows_by_shard = [[] for _ in range(shards)]
+        for i, uid in enumerate(columns['uid']):
+            rows_by_shard[shard_of(uid, shards)].append(i)
+        # Построение HNSW идёт в нативном коде ChromaDB, поэтому потоки дают реальный параллелизм
+        with ThreadPoolExecutor(max_workers=shards) as executor:
+            collections = list(executor.map(
+                lambda shard: _load_collection(client, shard_name(collection_name, shard), vectors, columns,
+                                               rows_by_shard[shard], batch_size, hnsw),
+                range(shards)
+            ))
+
+    # Метку версии (сброс кэша ответов API) пишет вызывающий: при --rebuild — только после переключения
     logging.info(f"Содержимое директории {persist_dir}: {os.listdir(persist_dir)}")
+    return collections
 
+# Пересборка без простоя: новая версия коллекции собирается рядом с активной, проверяется
+# (число записей и пробные запросы) и только затем становится активной через файл-указатель.
+# Запущенный API подхватывает указатель сам (или по POST /admin/reload), старые версии удаляются.
+def rebuild_chromadb(vectors, columns, collection_name="ru_bq_collection", keep=2, n_probes=5,
+                     persist_dir=PERSIST_DIR, hnsw=None, shards=1):
+    previous = resolve_collection(persist_dir, collection_name)
+    new_name = versioned_name(collection_name)
+    collections = setup_chromadb(vectors, columns, collection_name=new_name, persist_dir=persist_dir,
+                                 hnsw=hnsw, shards=shards)
+    client = chromadb.PersistentClient(path=str(persist_dir))
+    # Проверяем тем же поиском, что и API: по шардам — с веерным запросом и слиянием
+    shard_retrievers = [ChromaRetriever(collection) for collection in collections]
+    retriever = shard_retrievers[0] if shards <= 1 else ShardedRetriever(shard_retrievers)
+
+    probe_rows = np.linspace(0, len(vectors) - 1, num=min(n_probes, len(vectors)), dtype=np.int64)
+    try:
+        validate_collection(
+            retriever,
+            new_name,
+            expected_count=len(vectors),
+            probe_ids=[str(columns['uid'][i]) for i in probe_rows],
+            probe_vectors=np.asarray(vectors[probe_rows], dtype=np.float32)
+        )
+    except Exception:
+        logging.exception(f"Новая версия {new_name} не прошла проверку, активной остаётся {previous}")
+        delete_collection(client, new_name)
+        raise
+
+    write_active_collection(persist_dir, new_name)
+    # Метка версии после переключения: кэш ответов API не должен хранить выдачу старой версии
+    write_collection_version(persist_dir)
+    logging.info(f"Активная коллекция: {previous} -> {new_name}")
+
+    removed = garbage_collect(client, collection_name, new_name, keep=keep)
+    return {"active": new_name, "previous": previous, "removed": removed}
 
 if __name__ == "__main__":
-    input_path = Path("data/vectored_RuBQ_2.0_paragraphs.json")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Загрузка векторов в ChromaDB")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="собрать новую версию коллекции и переключить на неё API вместо инкрементальной синхронизации")
+    parser.add_argument("--keep", type=int, default=2,
+                        help="сколько версий коллекции хранить после --rebuild (активная и предыдущие для отката)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="на сколько коллекций (по хэшу uid) разложить записи при --rebuild")
+    args = parser.parse_args()
+
+    input_path = VECTORS_PATH
 
     # Проверка наличия файла
     if not input_path.exists():
         logging.error(f"Файл {input_path} не найден.")
         print(f"Файл не найден: {input_path}")
     else:
-        data = load_data(input_path)
-        setup_chromadb(data)
+        vectors, columns = load_data(input_path)
+        if args.rebuild:
+            stats = rebuild_chromadb(vectors, columns, keep=args.keep, shards=args.shards)
+            print(f"Активная коллекция: {stats['active']} (была {stats['previous']}), удалены: {stats['removed']}")
+        else:
+            stats = sync_chromadb(vectors, columns)
+            print(f"Обновлено записей: {stats['upserted']}, удалено: {stats['deleted']}")
         print("Данные успешно загружены и сохранены в ChromaDB.")
@@ -0,0 +1,101 @@
+import logging
+import os
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+
+# Blue/green-версии коллекции ChromaDB: каждая полная пересборка идёт в новую коллекцию
+# <base>__v<время>, проверяется и атомарно становится активной через файл-указатель в persist_dir.
+# API читает указатель при старте и следит за ним (или перечитывает по /admin/reload).
+ACTIVE_POINTER_FILE = "active_collection"
+VERSION_SEPARATOR = "__v"
+# Шардированная коллекция <имя> хранится как <имя>__s00, <имя>__s01, ... (записи делятся по хэшу uid)
+SHARD_SEPARATOR = "__s"
+
+
+# Метка с микросекундами: две пересборки подряд не должны получить имя активной версии
+def versioned_name(base: str) -> str:
+    now = time.time()
+    return f"{base}{VERSION_SEPARATOR}{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now % 1 * 1e6):06d}"
+
+
+def shard_name(name: str, shard: int) -> str:
+    return f"{name}{SHARD_SEPARATOR}{shard:02d}"
+
+
+# Стабильный шард записи: crc32 не зависит от PYTHONHASHSEED и одинаков при сборке и синхронизации
+def shard_of(uid, n_shards: int) -> int:
+    return zlib.crc32(str(uid).encode('utf-8')) % n_shards
+
+
+def _collection_names(client) -> list[str]:
+    return [getattr(c, "name", c) for c in client.list_collections()]
+
+
+# Шарды коллекции по порядку номеров; пустой список — коллекция не шардирована
+def list_shards(client, name: str) -> list[str]:
+    return sorted(n for n in _collection_names(client) if n.startswith(name + SHARD_SEPARATOR))
+
+
+def _strip_shard(name: str) -> str:
+    head, sep, tail = name.rpartition(SHARD_SEPARATOR)
+    return head if sep and tail.isdigit() else name
+
+
+def read_active_collection(persist_dir) -> str | None:
+    try:
+        return (Path(persist_dir) / ACTIVE_POINTER_FILE).read_text(encoding='utf-8').strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Активная коллекция; без указателя (старые установки) — базовое имя
+def resolve_collection(persist_dir, base: str) -> str:
+    return read_active_collection(persist_dir) or base
+
+
+def write_active_collection(persist_dir, name: str) -> None:
+    path = Path(persist_dir) / ACTIVE_POINTER_FILE
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(name, encoding='utf-8')
+    # os.replace атомарен: читатель видит либо старое, либо новое имя
+    os.replace(tmp_path, path)
+
+
+# Версии от старых к новым; коллекция с базовым именем (до перехода на версии) считается самой старой
+def list_versions(client, base: str) -> list[str]:
+    names = {_strip_shard(name) for name in _collection_names(client)}
+    versions = sorted(name for name in names if name.startswith(base + VERSION_SEPARATOR))
+    return ([base] if base in names else []) + versions
+
+
+# Проверка перед переключением: число записей и пробный запрос — вектор записи должен найти её саму.
+# retriever — ChromaRetriever или ShardedRetriever новой версии (поиск идёт так же, как в API)
+def validate_collection(retriever, name: str, expected_count: int, probe_ids: list[str],
+                        probe_vectors: np.ndarray) -> None:
+    count = retriever.count()
+    if count != expected_count:
+        raise ValueError(f"В коллекции {name} {count} записей вместо {expected_count}")
+    result = retriever.search(np.asarray(probe_vectors, dtype=np.float32), 1)
+    missed = [doc_id for doc_id, found in zip(probe_ids, result['ids']) if doc_id not in found]
+    if missed:
+        raise ValueError(f"Пробный запрос к {name} не нашёл записи {missed}")
+    logging.info(f"Коллекция {name} проверена: {count} записей, пробных запросов {len(probe_ids)}")
+
+
+# Удаление коллекции вместе с её шардами
+def delete_collection(client, name: str) -> None:
+    for collection_name in [name, *list_shards(client, name)]:
+        if collection_name in _collection_names(client):
+            client.delete_collection(name=collection_name)
+
+
+# Удаление старых версий: остаются активная и keep - 1 последних до неё (для отката)
+def garbage_collect(client, base: str, active: str, keep: int = 2) -> list[str]:
+    versions = [name for name in list_versions(client, base) if name != active]
+    stale = versions[:max(0, len(versions) - (keep - 1))]
+    for name in stale:
+        delete_collection(client, name)
+        logging.info(f"Удалена старая версия коллекции {name}")
+    return stale
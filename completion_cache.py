@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Дисковый кэш генераций LLM на SQLite: ключ — хэш модели, инструкции, промпта, max_tokens и temperature.
+# Переживает перезапуск и общий для всех воркеров uvicorn (WAL допускает параллельное чтение и запись из
+# разных процессов). Кэшируются только детерминированные генерации (temperature == 0).
+# Размер ограничен числом записей, вытесняются давно не читанные (LRU по accessed_at).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    usage TEXT,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at);
+"""
+
+
+def completion_key(model: str, instruction: str, prompt: str, max_tokens: int, temperature: float) -> str:
+    payload = json.dumps([model, instruction, prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(temperature: float) -> bool:
+    return temperature == 0.0
+
+
+class CompletionCache:
+    def __init__(self, path, max_entries=10000, busy_timeout=5.0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        logging.info(f"Кэш генераций: {self.path}, записей {self._count(conn)}, лимит {max_entries}")
+
+    # Своё соединение на поток: sqlite3-соединения нельзя делить между потоками
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _count(conn) -> int:
+        return conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def get(self, key: str) -> tuple[str, dict | None] | None:
+        conn = self._connection()
+        try:
+            row = conn.execute("SELECT answer, usage FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            # Кэш не должен ронять запрос: при проблемах с файлом просто идём в LLM
+            logging.warning(f"Кэш генераций недоступен: {e}")
+            row = None
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def put(self, key: str, model: str, answer: str, usage: dict | None = None) -> None:
+        now = time.time()
+        conn = self._connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, answer, usage, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, answer, json.dumps(usage) if usage else None, now, now)
+            )
+            excess = self._count(conn) - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY accessed_at LIMIT ?)", (excess,)
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"Не удалось записать в кэш генераций: {e}")
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM completions")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "path": str(self.path),
+            "entries": self._count(self._connection()),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses
+        }
@@ -1,7 +1,8 @@
-import pandas as pd
-import requests
-import json
+import hashlib
+import math
 import logging
+from pathlib import Path
+from json_stream import download_file, iter_json_array
 
 # Настройка логирования
 logging.basicConfig(filename='data_analysis.log', level=logging.INFO,
@@ -11,10 +12,7 @@ logging.basicConfig(filename='data_analysis.log', level=logging.INFO,
 def download_dataset(url, output_path):
     """Скачивает датасет и сохраняет его локально."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(response.json(), f, ensure_ascii=False)
+        download_file(url, Path(output_path))
         logging.info(f"Датасет успешно скачан и сохранен в {output_path}")
     except Exception as e:
         logging.error(f"Ошибка при скачивании датасета: {e}")
@@ -24,18 +22,48 @@ def download_dataset(url, output_path):
 def analyze_dataset(file_path):
     """Анализирует датасет и возвращает статистику."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        df = pd.DataFrame(data)
+        # Статистика считается потоком, как pandas на целом датафрейме:
+        # длины — только по строкам, дубликаты — число повторов после первого вхождения
+        total = 0
+        has_text = has_uid = False
+        text_count = text_length = empty = 0
+        seen_uids, seen_texts = set(), set()
+        duplicate_uids = duplicate_texts = 0
+
+        for item in iter_json_array(file_path):
+            total += 1
+            if 'uid' in item:
+                has_uid = True
+            uid = item.get('uid')
+            if uid in seen_uids:
+                duplicate_uids += 1
+            else:
+                seen_uids.add(uid)
+
+            if 'text' in item:
+                has_text = True
+            text = item.get('text')
+            if isinstance(text, str):
+                text_count += 1
+                text_length += len(text)
+                if not text.strip():
+                    empty += 1
+                key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+            else:
+                if text is None or (isinstance(text, float) and math.isnan(text)):
+                    empty += 1
+                key = repr(text)
+            if key in seen_texts:
+                duplicate_texts += 1
+            else:
+                seen_texts.add(key)
 
-        # Проверка наличия ключей и базовый анализ
         stats = {
-            'total_documents': len(df),
-            'average_text_length': df['text'].str.len().mean() if 'text' in df.columns else 0,
-            'empty_documents': len(
-                df[df['text'].isna() | (df['text'].str.strip() == '')]) if 'text' in df.columns else 0,
-            'duplicate_uids': df['uid'].duplicated().sum() if 'uid' in df.columns else 0,
-            'duplicate_texts': df['text'].duplicated().sum() if 'text' in df.columns else 0
+            'total_documents': total,
+            'average_text_length': text_length / text_count if has_text and text_count else 0,
+            'empty_documents': empty if has_text else 0,
+            'duplicate_uids': duplicate_uids if has_uid else 0,
+            'duplicate_texts': duplicate_texts if has_text else 0
         }
 
         logging.info("Результаты анализа данных:")
@@ -0,0 +1,187 @@
+import inspect
+import logging
+import os
+import numpy as np
+from pathlib import Path
+
+# Бэкенды векторизации all-MiniLM-L6-v2:
+#   torch      — SentenceTransformer (PyTorch fp32, CPU или CUDA)
+#   onnx       — экспортированная модель в ONNX Runtime
+#   onnx-int8  — та же ONNX-модель с динамической int8-квантизацией весов
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_DIR = Path(os.getenv("ONNX_DIR", "models/all-MiniLM-L6-v2-onnx"))
+# Как у SentenceTransformer для all-MiniLM-L6-v2
+MAX_SEQ_LENGTH = 256
+
+
+def _default_device() -> str:
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class TorchEmbedder:
+    def __init__(self, model_name=EMBED_MODEL, device=None):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device or _default_device())
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxEmbedder:
+    """Mean pooling + L2-нормировка поверх ONNX-модели, как в пайплайне SentenceTransformer."""
+
+    def __init__(self, model_dir=ONNX_DIR, quantized=False, threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        model_path = model_dir / ("model_int8.onnx" if quantized else "model.onnx")
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = {inp.name for inp in self.session.get_inputs()}
+        self._dim = self.session.get_outputs()[0].shape[-1]
+        logging.info(f"ONNX-модель загружена: {model_path}")
+
+    def _encode_batch(self, texts) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+        )
+        feeds = {name: tokens[name].astype(np.int64) for name in self._input_names if name in tokens}
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = tokens["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        batches = range(0, len(texts), batch_size)
+        if show_progress_bar:
+            from tqdm import tqdm
+            batches = tqdm(batches, desc="Batches")
+        return np.concatenate([self._encode_batch(texts[i:i + batch_size]) for i in batches])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self._dim)
+
+
+# Экспорт трансформера из SentenceTransformer в ONNX (+ токенайзер рядом)
+def export_onnx(model_name=EMBED_MODEL, model_dir=ONNX_DIR):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    st_model.tokenizer.save_pretrained(model_dir)
+
+    sample = st_model.tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    # Обёртка с именованными аргументами: порядок позиционных аргументов forward различается между версиями transformers
+    class HiddenStates(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Новые версии torch по умолчанию экспортируют через dynamo; нужен классический экспорт с dynamic_axes
+        export_kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates().eval(),
+            tuple(sample[name] for name in input_names),
+            str(model_dir / "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **export_kwargs
+        )
+    logging.info(f"Модель {model_name} экспортирована в {model_dir / 'model.onnx'}")
+
+
+# Динамическая int8-квантизация весов ONNX-модели
+def quantize_onnx(model_dir=ONNX_DIR):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model_dir = Path(model_dir)
+    quantize_dynamic(str(model_dir / "model.onnx"), str(model_dir / "model_int8.onnx"), weight_type=QuantType.QInt8)
+    logging.info(f"Квантизованная модель сохранена в {model_dir / 'model_int8.onnx'}")
+
+
+def load_embedder(backend=None, model_name=EMBED_MODEL, device=None, threads=None):
+    backend = backend or EMBED_BACKEND
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд векторизации {backend}, ожидался один из {EMBED_BACKENDS}")
+    if backend == "torch":
+        return TorchEmbedder(model_name, device=device)
+
+    quantized = backend == "onnx-int8"
+    if not (ONNX_DIR / "model.onnx").exists():
+        export_onnx(model_name, ONNX_DIR)
+    if quantized and not (ONNX_DIR / "model_int8.onnx").exists():
+        quantize_onnx(ONNX_DIR)
+    return OnnxEmbedder(ONNX_DIR, quantized=quantized, threads=threads)
+
+
+# Сверка бэкенда с эталонными fp32-векторами: косинус между парами векторов одного текста
+def check_parity(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {
+        "count": int(len(cosines)),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "p01_cosine": float(np.percentile(cosines, 1))
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from vector_store import VECTORS_PATH, load_vectors
+
+    logging.basicConfig(filename='vectorize.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Экспорт ONNX / int8 и проверка паритета с fp32-векторами корпуса")
+    parser.add_argument("--backend", choices=EMBED_BACKENDS[1:], default="onnx-int8")
+    parser.add_argument("--vectors", default=str(VECTORS_PATH), help="эталонный артефакт fp32-векторов")
+    parser.add_argument("--sample", type=int, default=2000, help="сколько текстов корпуса сверить")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="порог паритета")
+    args = parser.parse_args()
+
+    embedder = load_embedder(args.backend)
+    vectors, columns = load_vectors(args.vectors)
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(vectors), size=min(args.sample, len(vectors)), replace=False))
+
+    started = time.perf_counter()
+    candidate = embedder.encode([columns['text'][i] for i in rows], batch_size=64)
+    elapsed = time.perf_counter() - started
+    report = check_parity(np.asarray(vectors[rows], dtype=np.float32), candidate)
+    print(f"{args.backend}: {report} — {len(rows) / elapsed:.1f} текстов/с")
+    if report["min_cosine"] < args.min_cosine:
+        raise SystemExit(f"Паритет не пройден: min_cosine={report['min_cosine']:.4f} < {args.min_cosine}")
@@ -0,0 +1,190 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import chromadb
+import numpy as np
+import yaml
+from pathlib import Path
+from chroma_setup import CONFIG_PATH, HNSW_DEFAULTS, set_search_ef, setup_chromadb
+from retriever import _normalize, top_k_indices
+from vector_store import VECTORS_PATH, load_vectors
+
+# Подбор параметров HNSW: точные соседи (косинус, полный перебор) как эталон, затем перебор
+# space / M / construction_ef (новая сборка индекса) и search_ef (на готовом индексе).
+# Для каждой комбинации — recall@k, latency запроса, время сборки и размер индекса на диске.
+REPORT_PATH = Path("data/hnsw_tuning.json")
+
+
+# Запросы: вопросы из файла (векторизуются моделью) или случайные параграфы коллекции.
+# Для параграфа он сам исключается из эталона и выдачи, иначе recall завышен.
+def load_queries(vectors, columns, questions_path=None, sample=500, seed=0):
+    if questions_path:
+        from embedder import load_embedder
+
+        path = Path(questions_path)
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.suffix == ".jsonl":
+                questions = [json.loads(line) for line in f if line.strip()]
+            elif path.suffix == ".json":
+                questions = json.load(f)
+            else:
+                questions = [line.strip() for line in f if line.strip()]
+        # RuBQ: записи с полем question_text; допускаем и question, и просто строки
+        texts = [
+            q if isinstance(q, str) else q.get("question_text") or q.get("question") for q in questions
+        ][:sample]
+        return load_embedder().encode(texts, batch_size=64), [None] * len(texts)
+
+    rows = np.random.default_rng(seed).choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+    return np.asarray(vectors[np.sort(rows)], dtype=np.float32), [str(columns['uid'][i]) for i in np.sort(rows)]
+
+
+def exact_neighbours(vectors, ids, queries, exclude, top_k, chunk_size=16384):
+    """Эталонные top_k id по косинусу полным перебором (векторы читаются кусками)."""
+    queries = _normalize(queries)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        block = _normalize(vectors[start:start + chunk_size])
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(
+            np.arange(start, start + len(block)), (len(queries), len(block))
+        )], axis=1)
+        top = top_k_indices(scores, top_k + 1)
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return [
+        [ids[j] for j in row if ids[j] != own][:top_k]
+        for row, own in zip(best_rows, exclude)
+    ]
+
+
+def recall_at_k(found: list[list[str]], truth: list[list[str]]) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth) if t]))
+
+
+def _dir_size(path) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def evaluate(collection, queries, exclude, truth, top_k) -> dict:
+    # Первый запрос подгружает индекс с диска — в latency его не учитываем
+    collection.query(query_embeddings=queries[:1], n_results=top_k + 1, include=[])
+    found, latencies = [], []
+    for query, own in zip(queries, exclude):
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=query[np.newaxis, :], n_results=top_k + 1, include=[])
+        latencies.append(time.perf_counter() - started)
+        found.append([doc_id for doc_id in result['ids'][0] if doc_id != own][:top_k])
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "recall": recall_at_k(found, truth),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean())
+    }
+
+
+# search_ef применяется при загрузке индекса в процесс, поэтому каждое значение проверяем
+# на свежей копии собранного индекса: правим параметр до первого запроса к ней
+def _with_search_ef(build_dir, workdir, search_ef):
+    copy_dir = Path(workdir) / f"search_ef_{search_ef}"
+    shutil.copytree(build_dir, copy_dir)
+    collection = chromadb.PersistentClient(path=str(copy_dir)).get_collection(name="hnsw_tuning")
+    set_search_ef(collection, search_ef)
+    return collection
+
+
+def sweep(vectors, columns, queries, exclude, top_k, spaces, ms, construction_efs, search_efs) -> list[dict]:
+    ids = [str(uid) for uid in columns['uid']]
+    truth = exact_neighbours(vectors, ids, queries, exclude, top_k)
+    results = []
+    for space, m, construction_ef in itertools.product(spaces, ms, construction_efs):
+        build = {"space": space, "M": m, "construction_ef": construction_ef, "search_ef": max(search_efs)}
+        workdir = Path(tempfile.mkdtemp(prefix="hnsw_tuning_"))
+        persist_dir = workdir / "build"
+        try:
+            started = time.perf_counter()
+            setup_chromadb(vectors, columns, collection_name="hnsw_tuning", persist_dir=persist_dir, hnsw=build)
+            build_time = time.perf_counter() - started
+            size = _dir_size(persist_dir)
+            for search_ef in search_efs:
+                collection = _with_search_ef(persist_dir, workdir, search_ef)
+                metrics = evaluate(collection, queries, exclude, truth, top_k)
+                row = {**build, "search_ef": search_ef, "build_s": build_time, "index_mib": size / 2 ** 20, **metrics}
+                logging.info(f"HNSW {row}")
+                print(
+                    f"space={space:6s} M={m:<3d} construction_ef={construction_ef:<4d} search_ef={search_ef:<4d} "
+                    f"recall@{top_k}={metrics['recall']:.4f} p50={metrics['p50_ms']:.2f} ms "
+                    f"p95={metrics['p95_ms']:.2f} ms build={build_time:.1f} s size={size / 2 ** 20:.1f} MiB"
+                )
+                results.append(row)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# Самая быстрая (по p95) конфигурация, достигшая целевого recall
+def choose(results: list[dict], target_recall: float) -> dict | None:
+    passing = [row for row in results if row["recall"] >= target_recall]
+    return min(passing, key=lambda row: (row["p95_ms"], row["build_s"])) if passing else None
+
+
+def write_hnsw_config(settings: dict, config_path=CONFIG_PATH) -> None:
+    config = {}
+    if Path(config_path).exists():
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+    config['hnsw'] = {key: settings[key] for key in HNSW_DEFAULTS}
+    with open(config_path, 'w', encoding='utf-8') as f:
+        yaml.dump(config, f, allow_unicode=True, sort_keys=False)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recall@k против latency для параметров HNSW в ChromaDB")
+    parser.add_argument("--vectors", default=str(VECTORS_PATH))
+    parser.add_argument("--questions", default=None,
+                        help="вопросы (.json RuBQ с question_text, .jsonl или .txt); по умолчанию — случайные параграфы")
+    parser.add_argument("--sample", type=int, default=500, help="число запросов")
+    parser.add_argument("--limit", type=int, default=None, help="взять только первые N векторов коллекции")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--spaces", nargs="+", default=["l2", "cosine", "ip"])
+    parser.add_argument("--m", nargs="+", type=int, default=[16, 32])
+    parser.add_argument("--construction-ef", nargs="+", type=int, default=[100, 200])
+    parser.add_argument("--search-ef", nargs="+", type=int, default=[10, 20, 50, 100, 200])
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--report", default=str(REPORT_PATH))
+    parser.add_argument("--write-config", action="store_true",
+                        help="записать выбранные параметры в секцию hnsw конфига (применяются chroma_setup.py)")
+    args = parser.parse_args()
+
+    vectors, columns = load_vectors(args.vectors)
+    if args.limit:
+        vectors = vectors[:args.limit]
+        columns = {name: values[:args.limit] for name, values in columns.items()}
+    queries, exclude = load_queries(vectors, columns, args.questions, args.sample)
+
+    results = sweep(vectors, columns, queries, exclude, args.top_k,
+                    args.spaces, args.m, args.construction_ef, args.search_ef)
+    best = choose(results, args.target_recall)
+
+    report_path = Path(args.report)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"params": vars(args), "results": results, "chosen": best}, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт сохранён в {report_path}")
+
+    if best is None:
+        print(f"Ни одна конфигурация не достигла recall@{args.top_k} >= {args.target_recall}")
+    else:
+        print(f"Выбрано: {({key: best[key] for key in HNSW_DEFAULTS})}, recall={best['recall']:.4f}, "
+              f"p95={best['p95_ms']:.2f} ms")
+        if args.write_config:
+            write_hnsw_config(best)
+            print(f"Параметры записаны в {CONFIG_PATH}; пересоберите коллекцию: python chroma_setup.py --rebuild")
@@ -0,0 +1,86 @@
+import base64
+import logging
+import time
+import httpx
+import numpy as np
+
+# Клиент общего процесса векторизации и поиска (inference_server.py) для воркеров API.
+# Воркеры не держат ни модели, ни индекса: запросы идут через Unix-сокет, векторы
+# передаются как base64 от сырых float32 (в разы компактнее и быстрее JSON-списков).
+RESULT_KEYS = ("ids", "documents", "metadatas", "distances")
+
+
+def pack_array(array: np.ndarray) -> dict:
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"data": base64.b64encode(array.tobytes()).decode('ascii'), "shape": list(array.shape)}
+
+
+def unpack_array(packed: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(packed["data"]), dtype=np.float32).reshape(packed["shape"])
+
+
+class InferenceClient:
+    """Замена модели и индекса в процессе воркера: encode как у модели эмбеддингов,
+    search как rag_core.search (включая гибридный поиск на стороне сервера)."""
+
+    def __init__(self, socket_path, timeout=60.0):
+        self.socket_path = str(socket_path)
+        # httpx.Client потокобезопасен: им пользуются батчер и пул поиска
+        self._client = httpx.Client(
+            transport=httpx.HTTPTransport(uds=self.socket_path),
+            base_url="http://inference",
+            timeout=timeout
+        )
+
+    def _post(self, path: str, payload: dict) -> dict:
+        resp = self._client.post(path, json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    def ready(self, timeout=2.0) -> bool:
+        try:
+            return self._client.get("/readyz", timeout=timeout).status_code == 200
+        except httpx.TransportError:
+            return False
+
+    # Сервер поднимает модель и индекс дольше воркеров — ждём его готовности
+    def wait_ready(self, timeout=300.0, poll_interval=1.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.ready():
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Сервер векторизации на {self.socket_path} не готов за {timeout:.0f} с")
+            time.sleep(poll_interval)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False) -> np.ndarray:
+        return unpack_array(self._post("/encode", {"texts": list(texts)}))
+
+    def search(self, query_vectors: np.ndarray, top_k: int = 10, query_texts: list[str] | None = None) -> dict:
+        return self._post("/search", {
+            "vectors": pack_array(np.atleast_2d(query_vectors)),
+            "top_k": top_k,
+            "query_texts": query_texts
+        })
+
+    def reload(self, force: bool = False) -> dict:
+        return self._post("/reload", {"force": force})
+
+    def close(self) -> None:
+        self._client.close()
+        logging.info(f"Соединение с сервером векторизации {self.socket_path} закрыто")
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    # Проверка готовности сервера векторизации (healthcheck в docker-compose)
+    parser = argparse.ArgumentParser(description="Проверка готовности сервера векторизации")
+    parser.add_argument("--socket", default="/tmp/rag_inference.sock", help="путь к Unix-сокету")
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if not InferenceClient(args.socket).ready(args.timeout):
+        print(f"Сервер векторизации на {args.socket} не готов")
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from inference_client import RESULT_KEYS, pack_array, unpack_array
+
+# Общий процесс векторизации и поиска для нескольких воркеров uvicorn: модель эмбеддингов,
+# индекс (ChromaDB / NumPy) и BM25 загружаются один раз, а не в каждом воркере.
+# Воркеры API запускаются с RAG_INFERENCE_SOCKET и ходят сюда через Unix-сокет.
+# Конкурентные /encode от разных воркеров собираются общим EmbeddingBatcher в один батч.
+#   python inference_server.py --socket /tmp/rag_inference.sock
+#   RAG_INFERENCE_SOCKET=/tmp/rag_inference.sock uvicorn API:app --workers 4
+DEFAULT_SOCKET = "/tmp/rag_inference.sock"
+
+# Сам сервер — владелец модели и индекса, поэтому rag_core в нём работает в локальном режиме
+SOCKET_PATH = os.environ.pop("RAG_INFERENCE_SOCKET", "") or DEFAULT_SOCKET
+
+import rag_core  # noqa: E402
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await rag_core.astartup()
+    # Новую версию индекса подхватывает только этот процесс — воркеры о ней не знают
+    watcher = (
+        asyncio.create_task(rag_core.watch_index_version())
+        if rag_core.RETRIEVER_RELOAD_INTERVAL > 0 else None
+    )
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    await rag_core.aclose()
+
+
+app = FastAPI(title="RAG inference server", lifespan=lifespan)
+
+
+class EncodeRequest(BaseModel):
+    texts: list[str]
+
+
+class SearchRequest(BaseModel):
+    vectors: dict
+    top_k: int = 10
+    query_texts: list[str] | None = None
+
+
+class ReloadRequest(BaseModel):
+    force: bool = False
+
+
+@app.get("/readyz")
+def readyz():
+    return JSONResponse(rag_core.startup_state, status_code=200 if rag_core.is_ready() else 503)
+
+
+@app.post("/encode")
+async def encode(req: EncodeRequest):
+    # Каждый текст отдельно в общий батчер: запросы соседних воркеров попадут в тот же encode
+    vectors = await asyncio.gather(*(rag_core.encode_query_async(text) for text in req.texts))
+    dim = rag_core.model.get_sentence_embedding_dimension()
+    return pack_array(np.concatenate(vectors) if vectors else np.empty((0, dim), dtype=np.float32))
+
+
+@app.post("/search")
+async def search(req: SearchRequest):
+    results = await rag_core.run_in_executor(
+        rag_core.search, unpack_array(req.vectors), req.top_k, req.query_texts
+    )
+    return {**{key: results[key] for key in RESULT_KEYS}, "index_version": rag_core.index_version()}
+
+
+@app.post("/reload")
+async def reload(req: ReloadRequest):
+    result = await asyncio.to_thread(rag_core.reload_retriever, req.force)
+    return {**result, "index_version": rag_core.index_version()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Общий процесс векторизации и поиска для воркеров API")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="путь к Unix-сокету")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Сокет от предыдущего запуска мешает bind
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    uvicorn.run(app, uds=args.socket, log_level="warning")
@@ -0,0 +1,81 @@
+import json
+import os
+import requests
+
+# Потоковое скачивание и чтение JSON-массива записей без загрузки всего файла в память
+
+
+# Скачивание файла на диск кусками; до полного завершения он лежит под временным именем
+def download_file(url, output_path, chunk_size=1 << 20):
+    output_path.parent.mkdir(exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".part")
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    os.replace(tmp_path, output_path)
+
+
+def iter_json_array(path, buffer_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(buffer_size)
+            if not chunk:
+                eof = True
+            # Отбрасываем уже разобранную часть буфера
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        skip(" \t\r\n")
+        if pos >= len(buffer) or buffer[pos] != "[":
+            raise ValueError(f"{path}: ожидался JSON-массив")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buffer):
+                raise ValueError(f"{path}: неожиданный конец файла")
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if not eof and (end == len(buffer) or buffer[end] not in " \t\r\n,]"):
+                # Значение упёрлось в конец буфера или число оборвано на середине ("3." из "3.5e-7") —
+                # дочитываем и разбираем заново
+                fill()
+                continue
+            pos = end
+            yield item
+
+
+# Разбиение потока на списки фиксированного размера
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
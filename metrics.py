@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Метрики пайплайна в формате Prometheus (отдаются API на /metrics).
+# Стадии: encode, search, prompt, llm_ttft, llm, total (одиночные запросы), batch_retrieval (пакетные),
+# llm_queue (ожидание слота генерации в планировщике)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Длительность стадии обработки запроса", ["stage"], buckets=STAGE_BUCKETS
+)
+QUERIES = Counter("rag_queries_total", "Обработанные запросы", ["mode", "cache"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Токены по usage из ответов Ollama", ["kind"])
+LLM_ERRORS = Counter("rag_llm_errors_total", "Ошибки обращений к Ollama")
+# По бэкендам Ollama (LLM.OllamaPool): латентность успешных запросов, незавершённые запросы, ошибки и доступность
+LLM_BACKEND_SECONDS = Histogram(
+    "rag_llm_backend_seconds", "Длительность запроса к бэкенду Ollama", ["backend"], buckets=STAGE_BUCKETS
+)
+LLM_BACKEND_OUTSTANDING = Gauge("rag_llm_backend_outstanding", "Незавершённые запросы к бэкенду Ollama", ["backend"])
+LLM_BACKEND_ERRORS = Counter("rag_llm_backend_errors_total", "Ошибки бэкенда Ollama (с исключением из пула)", ["backend"])
+LLM_BACKEND_UP = Gauge("rag_llm_backend_up", "Бэкенд Ollama в пуле (1) или исключён (0)", ["backend"])
+GENERATION_QUEUE = Gauge("rag_generation_queue", "Запросы в очереди генераций", ["priority"])
+ADMISSION_REJECTED = Counter(
+    "rag_admission_rejected_total", "Запросы, не допущенные к генерации (очередь полна или истёк дедлайн)", ["reason"]
+)
+
+__all__ = ["CONTENT_TYPE_LATEST", "StageTimer", "generate_latest", "observe_usage", "count_query"]
+
+
+class StageTimer:
+    """Тайминги стадий одного запроса: пишутся в гистограмму и собираются в словарь для debug-ответа."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def finish(self) -> dict:
+        self.record("total", time.perf_counter() - self.started)
+        return {stage: round(seconds, 6) for stage, seconds in self.timings.items()}
+
+
+def observe_usage(usage: dict | None) -> None:
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.labels(kind=kind.removesuffix("_tokens")).inc(usage[kind])
+
+
+def count_query(mode: str, result: dict) -> None:
+    QUERIES.labels(mode=mode, cache=result.get("cache") or "miss").inc()
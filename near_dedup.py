@@ -0,0 +1,137 @@
+import json
+import logging
+import zlib
+import numpy as np
+from pathlib import Path
+
+# Поиск почти-дубликатов параграфов: MinHash-сигнатуры по символьным n-граммам нормализованного текста
+# и LSH-бандинг для поиска кандидатов. Кандидаты проверяются оценкой Жаккара по сигнатурам.
+# Обработка инкрементальная: первое вхождение остаётся представителем кластера, последующие похожие — отбрасываются.
+NEAR_DEDUP_DEFAULTS = {
+    'enabled': True,
+    'threshold': 0.85,
+    'num_perm': 128,
+    'ngram': 5,
+    'report_path': 'data/near_duplicates_report.json'
+}
+# Простое число больше 2^32: хэши n-грамм 32-битные, a < 2^31, поэтому a * x + b помещается в uint64
+_PRIME = np.uint64((1 << 32) + 15)
+_PREVIEW_LENGTH = 200
+
+
+def near_dedup_config(config) -> dict:
+    return {**NEAR_DEDUP_DEFAULTS, **((config or {}).get('near_dedup') or {})}
+
+
+# Число полос b и строк r (b * r = num_perm): порог срабатывания LSH (1/b)^(1/r) берём не выше threshold,
+# чтобы не терять пары около порога — лишних кандидатов отсеет проверка по сигнатурам
+def lsh_params(threshold, num_perm):
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        lsh_threshold = (1.0 / bands) ** (1.0 / rows)
+        if lsh_threshold <= threshold and (best is None or lsh_threshold > best[2]):
+            best = (bands, rows, lsh_threshold)
+    return best[:2] if best else (num_perm, 1)
+
+
+class MinHasher:
+    def __init__(self, num_perm=128, ngram=5, seed=1):
+        self.num_perm = num_perm
+        self.ngram = ngram
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        n = self.ngram
+        grams = {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+        return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        return ((hashes[:, np.newaxis] * self._a + self._b) % _PRIME).min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts) -> np.ndarray:
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, text in enumerate(texts):
+            result[i] = self.signature(text)
+        return result
+
+
+class NearDuplicateFilter:
+    """Инкрементальный фильтр почти-дубликатов. В памяти — только сигнатуры и LSH-корзины оставленных документов."""
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=None):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        if bands is None:
+            bands, _ = lsh_params(threshold, num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._uids = []
+        self.clusters = {}  # uid представителя -> отброшенные почти-дубликаты
+        self.dropped = 0
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    # Возвращает uid представителя, если документ — почти-дубликат уже оставленного, иначе оставляет его и возвращает None
+    def add(self, uid, signature, text=None):
+        keys = self._band_keys(signature)
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+
+        best, best_similarity = None, 0.0
+        for idx in candidates:
+            similarity = float(np.mean(self._signatures[idx] == signature))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = idx, similarity
+
+        if best is not None:
+            representative = self._uids[best]
+            entry = {'uid': uid, 'similarity': round(best_similarity, 4)}
+            if text is not None:
+                entry['text'] = text[:_PREVIEW_LENGTH]
+            self.clusters.setdefault(representative, []).append(entry)
+            self.dropped += 1
+            return representative
+
+        idx = len(self._signatures)
+        self._signatures.append(signature)
+        self._uids.append(uid)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(idx)
+        return None
+
+    # Маска оставляемых записей для пачки (порядок записей важен: оставляется первое вхождение)
+    def filter(self, uids, signatures, texts=None) -> np.ndarray:
+        texts = texts if texts is not None else [None] * len(uids)
+        keep = np.ones(len(uids), dtype=bool)
+        for i, (uid, signature, text) in enumerate(zip(uids, signatures, texts)):
+            keep[i] = self.add(uid, signature, text) is None
+        return keep
+
+    def report(self) -> dict:
+        clusters = sorted(self.clusters.items(), key=lambda item: len(item[1]), reverse=True)
+        return {
+            'threshold': self.threshold,
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'rows': self.rows,
+            'kept': len(self._uids),
+            'dropped': self.dropped,
+            'clusters': [{'representative': uid, 'duplicates': dropped} for uid, dropped in clusters]
+        }
+
+    def save_report(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2, default=str)
+        logging.info(f"Отчёт о почти-дубликатах ({len(self.clusters)} кластеров, {self.dropped} записей) сохранён в {path}")
@@ -1,7 +1,6 @@
-import json
-import requests
 from pathlib import Path
 import logging
+from json_stream import download_file, iter_json_array
 
 # Настройка логирования
 logging.basicConfig(filename='parse_log.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -9,24 +8,20 @@ logging.basicConfig(filename='parse_log.log', level=logging.INFO, format='%(asct
 
 def download_and_parse_json(url, output_path):
     try:
-        # Скачивание файла
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        logging.info(f"Датасет успешно загружен. Тип данных: {type(data)}")
-
-        # Проверка структуры
-        if not isinstance(data, list):
-            logging.error("Данные не являются списком. Проверь структуру JSON.")
-            raise ValueError("Ожидался список словарей.")
-
-        logging.info(f"Количество записей: {len(data)}")
-        logging.info(f"Пример первой записи: {data[0]}")
-
-        # Сохранение спарсенных данных
-        output_path.parent.mkdir(exist_ok=True)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Скачивание файла: исходный JSON сохраняется как есть, без пересериализации с отступами
+        download_file(url, output_path)
+
+        # Проверка структуры потоковым разбором
+        count = 0
+        for item in iter_json_array(output_path):
+            if count == 0:
+                logging.info(f"Пример первой записи: {item}")
+            if not isinstance(item, dict):
+                logging.error("Данные не являются списком словарей. Проверь структуру JSON.")
+                raise ValueError("Ожидался список словарей.")
+            count += 1
+
+        logging.info(f"Датасет успешно загружен. Количество записей: {count}")
         logging.info(f"Данные сохранены в {output_path}")
 
     except Exception as e:
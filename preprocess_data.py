@@ -1,12 +1,16 @@
 import pandas as pd
+import hashlib
 import json
 import logging
 import re
+import sqlite3
 import yaml
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-
-# Настройка логирования
-logging.basicConfig(filename='preprocess.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from bm25_index import BM25_INDEX_PATH, BM25Index
+from json_stream import iter_chunks, iter_json_array
+from near_dedup import NEAR_DEDUP_DEFAULTS, MinHasher, NearDuplicateFilter, near_dedup_config
 
 
 # Загрузка конфигурации
@@ -31,6 +35,37 @@ def preprocess_text(text, min_length=10):
         return None
 
 
+# Векторизованная версия preprocess_text для целого столбца (тот же результат, без .apply по строкам)
+def preprocess_series(texts, min_length=10):
+    texts = texts.where(texts.map(lambda value: isinstance(value, str)))
+    stripped = texts.str.strip()
+    result = (
+        stripped
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.replace(r'[^\w\s.,!?]', '', regex=True)
+        .str.lower()
+    )
+    return result.where((stripped.str.len() > 0) & (result.str.len() >= min_length))
+
+
+def _near_dedup_tools(config):
+    near_config = near_dedup_config(config)
+    if not near_config['enabled']:
+        return near_config, None, None
+    hasher = MinHasher(near_config['num_perm'], near_config['ngram'])
+    near_filter = NearDuplicateFilter(near_config['threshold'], near_config['num_perm'])
+    logging.info(
+        f"Поиск почти-дубликатов: порог {near_filter.threshold}, {near_filter.bands} полос x {near_filter.rows} строк"
+    )
+    return near_config, hasher, near_filter
+
+
+def _save_near_dedup_report(near_config, near_filter):
+    logging.info(f"Удалено почти-дубликатов: {near_filter.dropped} в {len(near_filter.clusters)} кластерах")
+    if near_config.get('report_path'):
+        near_filter.save_report(near_config['report_path'])
+
+
 # Проверка качества данных
 def quality_check(df, config):
     logging.info(f"Столбцы датафрейма: {df.columns.tolist()}")
@@ -40,7 +75,7 @@ def quality_check(df, config):
 
     logging.info(f"Тип данных в столбце 'text': {df['text'].dtype}")
     initial_count = len(df)
-    filtered_df = df.copy()
+    filtered_df = df
 
     try:
         logging.info(f"Количество записей до обработки: {len(filtered_df)}")
@@ -60,9 +95,17 @@ def quality_check(df, config):
             filtered_df = filtered_df.drop_duplicates(subset=['text'], keep='first')
 
         # Применение предобработки текста
-        filtered_df['text'] = filtered_df['text'].apply(preprocess_text, min_length=config.get('min_length', 10))
+        filtered_df = filtered_df.assign(text=preprocess_series(filtered_df['text'], config.get('min_length', 10)))
         filtered_df = filtered_df.dropna(subset=['text'])
 
+        # Удаление почти-дубликатов (MinHash + LSH) по уже нормализованным текстам
+        near_config, hasher, near_filter = _near_dedup_tools(config)
+        if near_filter is not None:
+            texts = filtered_df['text'].tolist()
+            keep = near_filter.filter(filtered_df['uid'].tolist(), hasher.signatures(texts), texts)
+            filtered_df = filtered_df[keep]
+            _save_near_dedup_report(near_config, near_filter)
+
         final_count = len(filtered_df)
         logging.info(f"Изначальное количество документов: {initial_count}")
         logging.info(f"Осталось документов после фильтрации: {final_count}")
@@ -74,7 +117,142 @@ def quality_check(df, config):
         raise
 
 
+# Дедупликация потока записей с той же семантикой, что и в quality_check:
+# сначала по uid (первое вхождение), затем по исходному тексту среди оставшихся.
+# Просмотренные uid и 16-байтные хэши текстов лежат во временной SQLite-базе на диске
+# (удаляется при close), а не в множествах Python: память не растёт с числом записей,
+# в ней только страничный кэш SQLite (cache_kib). Проверка точная, без ложных срабатываний.
+class StreamingDeduplicator:
+    def __init__(self, path="", cache_kib=65536):
+        # Пустое имя — приватная временная база SQLite, при нехватке кэша сбрасывается на диск
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(f"PRAGMA cache_size=-{int(cache_kib)}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS uids (uid TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS texts (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.duplicate_uids = 0
+        self.duplicate_texts = 0
+
+    def filter(self, records):
+        kept = []
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for item in records:
+                # JSON различает 1 и "1", как и сравнение в pandas
+                uid = json.dumps(item.get('uid'), ensure_ascii=False, default=str)
+                cursor.execute("INSERT OR IGNORE INTO uids VALUES (?)", (uid,))
+                if cursor.rowcount == 0:
+                    self.duplicate_uids += 1
+                    continue
+
+                text = item.get('text')
+                if isinstance(text, str):
+                    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+                    cursor.execute("INSERT OR IGNORE INTO texts VALUES (?)", (digest,))
+                    if cursor.rowcount == 0:
+                        self.duplicate_texts += 1
+                        continue
+                kept.append(item)
+        finally:
+            cursor.execute("COMMIT")
+        return kept
+
+    def close(self):
+        self._conn.close()
+
+
+# Обработка одного чанка: возвращает записи, сериализованные по одной в JSON, их uid и тексты,
+# а при включённом поиске почти-дубликатов — ещё и MinHash-сигнатуры (считаются в воркере)
+def _process_chunk(records, min_length, hasher=None):
+    # Дедупликация могла отбросить весь чанк — у пустого DataFrame нет столбца text
+    if not records:
+        return [], [], [], None
+    df = pd.DataFrame(records)
+    df = df.assign(text=preprocess_series(df['text'], min_length)).dropna(subset=['text'])
+    if df.empty:
+        return [], [], [], None
+    lines = df.to_json(orient='records', lines=True, force_ascii=False).rstrip("\n").split("\n")
+    texts = df['text'].tolist()
+    signatures = hasher.signatures(texts) if hasher is not None else None
+    return lines, df['uid'].tolist(), texts, signatures
+
+
+# Потоковая предобработка: записи читаются по одной, обрабатываются чанками фиксированного размера
+# (при workers > 1 — в пуле процессов) и дописываются в выходной JSON-массив
+def preprocess_stream(input_path, output_path, config, chunk_size=50000, workers=1):
+    min_length = config.get('min_length', 10)
+    dedup = StreamingDeduplicator()
+    # Фильтр почти-дубликатов работает в основном процессе по порядку записей, сигнатуры приходят из воркеров
+    near_config, hasher, near_filter = _near_dedup_tools(config)
+    stats = {"initial_count": 0, "final_count": 0}
+
+    def chunks():
+        for chunk in iter_chunks(iter_json_array(input_path), chunk_size):
+            stats["initial_count"] += len(chunk)
+            yield dedup.filter(chunk)
+
+    def results(pool):
+        if pool is None:
+            for chunk in chunks():
+                yield _process_chunk(chunk, min_length, hasher)
+            return
+        # Не больше 2 * workers чанков в работе одновременно; результаты отдаём в исходном порядке,
+        # поэтому выход совпадает с обработкой всего файла целиком
+        in_flight = deque()
+        for chunk in chunks():
+            in_flight.append(pool.submit(_process_chunk, chunk, min_length, hasher))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write("[")
+            for lines, uids, texts, signatures in results(pool):
+                if near_filter is not None and lines:
+                    keep = near_filter.filter(uids, signatures, texts)
+                    lines = [line for line, kept in zip(lines, keep) if kept]
+                if not lines:
+                    continue
+                if stats["final_count"]:
+                    f.write(",")
+                f.write(",".join(lines))
+                stats["final_count"] += len(lines)
+            f.write("]")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        dedup.close()
+
+    logging.info(f"Найдено записей с дублирующимися uid: {dedup.duplicate_uids}")
+    logging.info(f"Найдено записей с дублирующимися текстами: {dedup.duplicate_texts}")
+    if near_filter is not None:
+        _save_near_dedup_report(near_config, near_filter)
+    logging.info(f"Изначальное количество документов: {stats['initial_count']}")
+    logging.info(f"Осталось документов после фильтрации: {stats['final_count']}")
+    logging.info(f"Удалено документов: {stats['initial_count'] - stats['final_count']}")
+    return stats
+
+
 if __name__ == "__main__":
+    import argparse
+
+    # Лог в файл настраивается только при запуске скрипта, не при импорте (тесты, пул процессов)
+    logging.basicConfig(filename='preprocess.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Предобработка параграфов RuBQ")
+    parser.add_argument("--stream", action="store_true",
+                        help="потоковый режим для больших дампов: чтение по записям и обработка чанками")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="записей в одном чанке (потоковый режим)")
+    parser.add_argument("--workers", type=int, default=1, help="процессов для обработки чанков (потоковый режим)")
+    parser.add_argument("--no-near-dedup", action="store_true",
+                        help="не удалять почти-дубликаты (MinHash/LSH), только точные")
+    args = parser.parse_args()
+
     data_path = Path("data/parsed_RuBQ_2.0_paragraphs.json")
     config_path = Path("configs/config.yaml")
 
@@ -82,25 +260,43 @@ if __name__ == "__main__":
         config = {
             'data_path': str(data_path),
             'min_length': 10,
-            'output_path': 'data/processed_RuBQ_2.0_paragraphs.json'
+            'output_path': 'data/processed_RuBQ_2.0_paragraphs.json',
+            'near_dedup': dict(NEAR_DEDUP_DEFAULTS)
         }
         config_path.parent.mkdir(exist_ok=True)
         with open(config_path, 'w', encoding='utf-8') as f:
             yaml.dump(config, f)
 
-    with open(data_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    logging.info(f"Тип данных после загрузки: {type(data)}, первые 2 записи: {data[:2]}")
-    df = pd.DataFrame(data)
-
     config = load_config(config_path)
-    processed_df = quality_check(df, config)
+    if args.no_near_dedup:
+        config['near_dedup'] = {**(config.get('near_dedup') or {}), 'enabled': False}
+
+    if args.stream:
+        stats = preprocess_stream(
+            data_path, config['output_path'], config, chunk_size=args.chunk_size, workers=args.workers
+        )
+        initial_count, final_count = stats['initial_count'], stats['final_count']
+        logging.info(f"Обработанные данные сохранены в {config['output_path']}")
+
+        # BM25 строится по тому же выходу, читая его потоком
+        BM25Index.build(iter_json_array(config['output_path'])).save(BM25_INDEX_PATH)
+    else:
+        with open(data_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        logging.info(f"Тип данных после загрузки: {type(data)}, первые 2 записи: {data[:2]}")
+        df = pd.DataFrame(data)
+
+        processed_df = quality_check(df, config)
+        initial_count, final_count = len(df), len(processed_df)
+
+        processed_df.to_json(config['output_path'], orient='records', force_ascii=False)
+        logging.info(f"Обработанные данные сохранены в {config['output_path']}")
 
-    processed_df.to_json(config['output_path'], orient='records', force_ascii=False)
-    logging.info(f"Обработанные данные сохранены в {config['output_path']}")
+        # Лексический индекс для гибридного поиска строится по тем же обработанным текстам
+        BM25Index.build(processed_df.to_dict('records')).save(BM25_INDEX_PATH)
 
     with open("README.md", "a", encoding='utf-8') as f:
         f.write("\n## Результаты предобработки\n")
-        f.write(f"- Изначальное количество документов: {len(df)}\n")
-        f.write(f"- Осталось документов после фильтрации: {len(processed_df)}\n")
-        f.write(f"- Удалено документов: {len(df) - len(processed_df)}\n")
\ No newline at end of file
+        f.write(f"- Изначальное количество документов: {initial_count}\n")
+        f.write(f"- Осталось документов после фильтрации: {final_count}\n")
+        f.write(f"- Удалено документов: {initial_count - final_count}\n")
@@ -0,0 +1,107 @@
+import logging
+import math
+import re
+import threading
+
+# Формирование промпта из найденных фрагментов: отсев далёких и почти одинаковых чанков,
+# ограничение числа чанков с одной страницы и укладка контекста в бюджет токенов.
+PROMPT_HEADER = "Вы получили следующие фрагменты текста, релевантные запросу:"
+PROMPT_QUESTION = "На основе этих фрагментов ответьте на вопрос: «{query}»"
+WORD_RE = re.compile(r'\w+')
+
+
+class TokenCounter:
+    """Считает токены токенайзером модели; если он недоступен (нет сети, нет transformers),
+    переходит на грубую оценку ~3 символа на токен."""
+
+    CHARS_PER_TOKEN = 3
+
+    def __init__(self, tokenizer_name: str | None):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            if self.tokenizer_name:
+                try:
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                    logging.info(f"Токенайзер для подсчёта промпта: {self.tokenizer_name}")
+                except Exception as e:
+                    logging.warning(f"Не удалось загрузить токенайзер {self.tokenizer_name}, считаем приблизительно: {e}")
+            self._loaded = True
+
+    def __call__(self, text: str) -> int:
+        if not self._loaded:
+            self._load()
+        if self._tokenizer is None:
+            return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+
+def _word_set(text: str) -> set:
+    return set(WORD_RE.findall(text.lower()))
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def build_prompt(query_text, chunks, metadatas=None, distances=None, count_tokens=None,
+                 token_budget=None, max_per_page=None, max_distance=None, dedup_threshold=None) -> dict:
+    """Собирает промпт из чанков (в порядке ранжирования).
+
+    Возвращает prompt, prompt_tokens и отобранные chunks / metadatas / distances.
+    Отсев по порядку: max_distance, max_per_page (по ru_wiki_pageid),
+    dedup_threshold (жаккардово сходство множеств слов), затем token_budget.
+    """
+    metadatas = metadatas or [{} for _ in chunks]
+    distances = distances or [None for _ in chunks]
+    count_tokens = count_tokens or TokenCounter(None)
+
+    header = PROMPT_HEADER
+    footer = PROMPT_QUESTION.format(query=query_text)
+    used_tokens = count_tokens(header) + count_tokens(footer) + 2
+
+    kept = []
+    kept_words = []
+    per_page = {}
+    for chunk, meta, distance in zip(chunks, metadatas, distances):
+        if max_distance is not None and distance is not None and distance > max_distance:
+            continue
+
+        page = (meta or {}).get("ru_wiki_pageid")
+        if max_per_page is not None and page is not None and per_page.get(page, 0) >= max_per_page:
+            continue
+
+        words = _word_set(chunk)
+        if dedup_threshold is not None and any(_jaccard(words, other) >= dedup_threshold for other in kept_words):
+            continue
+
+        line = f"{len(kept) + 1}) {chunk}"
+        line_tokens = count_tokens(line) + 1
+        if token_budget is not None and used_tokens + line_tokens > token_budget:
+            # Этот чанк не влезает, но более короткие из следующих ещё могут
+            continue
+
+        used_tokens += line_tokens
+        kept.append((line, chunk, meta, distance))
+        kept_words.append(words)
+        if page is not None:
+            per_page[page] = per_page.get(page, 0) + 1
+
+    prompt_lines = [header] + [line for line, _, _, _ in kept] + ["", footer]
+    prompt = "\n".join(prompt_lines)
+    return {
+        "prompt": prompt,
+        "prompt_tokens": count_tokens(prompt),
+        "chunks": [chunk for _, chunk, _, _ in kept],
+        "metadatas": [meta for _, _, meta, _ in kept],
+        "distances": [distance for _, _, _, distance in kept]
+    }
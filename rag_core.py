@@ -1,70 +1,838 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import chromadb
-from sentence_transformers import SentenceTransformer
 from pathlib import Path
+import httpx
 import requests
+from LLM import (
+    INSTRUCTION, OLLAMA_HOSTS, OLLAMA_MODEL, OllamaPool, ThinkStripper, completion_payload, parse_completion
+)
+from bm25_index import BM25_INDEX_PATH, LazyBM25Index, reciprocal_rank_fusion
+from collection_versions import list_shards, resolve_collection
+from completion_cache import CompletionCache, completion_key, is_cacheable
+from embedder import load_embedder
+from embedding_batcher import EmbeddingBatcher
+from inference_client import InferenceClient
+import metrics
+import prompt_builder
+from retriever import ChromaRetriever, NumpyRetriever, ShardedRetriever
+from scheduler import GenerationScheduler
+from semantic_cache import SemanticCache
+from vector_store import VECTORS_PATH as DEFAULT_VECTORS_PATH
 
 # === Параметры ===
 PERSIST_DIR = Path("chroma_data").absolute()
-OLLAMA_HOST = "http://127.0.0.1:11434"
-OLLAMA_MODEL = "deepseek-r1"
+COLLECTION_NAME = "ru_bq_collection"
+# Бэкенд поиска: chroma (HNSW в ChromaDB) или numpy (точный поиск в памяти процесса)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma")
+# Для numpy-бэкенда: артефакт векторов и квантизация (none / int8)
+VECTORS_PATH = Path(os.getenv("VECTORS_PATH", str(DEFAULT_VECTORS_PATH)))
+RETRIEVER_QUANTIZE = os.getenv("RETRIEVER_QUANTIZE", "none")
+# Гибридный поиск с BM25 (включается, если индекс построен: python bm25_index.py)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+BM25_PATH = Path(os.getenv("BM25_PATH", str(BM25_INDEX_PATH)))
+# Сколько кандидатов (в долях top_k) берём из каждого списка и константа k в RRF
+HYBRID_CANDIDATES_FACTOR = int(os.getenv("HYBRID_CANDIDATES_FACTOR", "3"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
 
+# Сборка промпта: бюджет токенов контекста, не больше N чанков с одной страницы,
+# порог расстояния (пусто — без отсечки) и порог сходства для отсева почти одинаковых чанков
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_MAX_PER_PAGE = int(os.getenv("PROMPT_MAX_PER_PAGE", "2"))
+PROMPT_MAX_DISTANCE = float(os.getenv("PROMPT_MAX_DISTANCE")) if os.getenv("PROMPT_MAX_DISTANCE") else None
+PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.8"))
+# Токенайзер модели для подсчёта токенов промпта (пусто — приблизительная оценка)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B")
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
-client = chromadb.PersistentClient(path=str(PERSIST_DIR))
-collection = client.get_collection(name="ru_bq_collection")
+# Бэкенды Ollama, модель и таймауты — в LLM.py (OLLAMA_HOSTS через запятую).
+# Сколько генераций одновременно отправляем в каждый бэкенд, остальные ждут своей очереди
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+# Глубина очереди генераций (сверх неё — сразу 429) и дедлайн запроса по умолчанию (с, 0 — без дедлайна)
+GENERATION_QUEUE_DEPTH = int(os.getenv("GENERATION_QUEUE_DEPTH", "32"))
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "120"))
+# Число процессов uvicorn (--workers): лимиты выше заданы на весь сервис и делятся между воркерами,
+# у каждого свой планировщик. Без общего лимита воркеры вместе отправили бы в Ollama API_WORKERS x больше
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", "1")))
+# Потоки для поиска по индексу (вне event loop)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+# Микро-батчинг векторизации: сколько ждём соседние запросы (мс) и максимальный размер батча
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+# Сколько LLM-генераций пакетного запроса выполняется параллельно
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# Кэш ответов: размер, время жизни записи (с) и порог косинусной близости запросов
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
 
+# Дисковый кэш генераций (SQLite, общий для воркеров): путь к файлу (пусто — выключен) и лимит записей
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH", "data/completion_cache.sqlite")
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "10000"))
 
-def strip_think_sections(raw: str) -> str:
-    parts = raw.split("</think>")
-    return "".join(parts[1:]).strip() if len(parts) > 1 else raw.strip()
+# Прогрев при старте API: подгрузка модели в Ollama и сколько её держать в памяти (keep_alive Ollama)
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") == "1"
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+WARMUP_QUERY = "Прогрев индекса"
+# Режим нескольких воркеров: модель и индекс держит один процесс inference_server.py,
+# воркер обращается к нему через этот Unix-сокет (пусто — всё в своём процессе)
+INFERENCE_SOCKET = os.getenv("RAG_INFERENCE_SOCKET", "")
+# Сколько воркер ждёт готовности сервера векторизации при старте (с)
+INFERENCE_WAIT_TIMEOUT = float(os.getenv("RAG_INFERENCE_WAIT_TIMEOUT", "300"))
+# Как часто API проверяет, не сменилась ли активная версия индекса (с); 0 — только через /admin/reload
+RETRIEVER_RELOAD_INTERVAL = float(os.getenv("RETRIEVER_RELOAD_INTERVAL", "10"))
+
+
+# Версия индекса, которую должен обслуживать процесс: активная коллекция ChromaDB
+# (файл-указатель, см. collection_versions.py) или время изменения артефакта векторов
+def active_index_version() -> str:
+    if RETRIEVER_BACKEND == "numpy":
+        return str(VECTORS_PATH.stat().st_mtime_ns)
+    return resolve_collection(PERSIST_DIR, COLLECTION_NAME)
+
+
+def create_retriever(version: str | None = None):
+    if RETRIEVER_BACKEND == "numpy":
+        quantize = None if RETRIEVER_QUANTIZE == "none" else RETRIEVER_QUANTIZE
+        return NumpyRetriever.from_artifact(VECTORS_PATH, quantize=quantize)
+    if RETRIEVER_BACKEND == "chroma":
+        client = chromadb.PersistentClient(path=str(PERSIST_DIR))
+        name = version or active_index_version()
+        # Шардированная версия (chroma_setup.py --rebuild --shards N): поиск по всем шардам со слиянием
+        shards = list_shards(client, name)
+        if shards:
+            return ShardedRetriever([ChromaRetriever(client.get_collection(name=shard)) for shard in shards])
+        return ChromaRetriever(client.get_collection(name=name))
+    raise ValueError(f"Неизвестный RETRIEVER_BACKEND: {RETRIEVER_BACKEND}")
+
+
+# Модель, индекс и батчер создаются в init_pipeline (API вызывает его в lifespan, CLI — при первом запросе),
+# чтобы импорт модуля был быстрым и не падал без коллекции
+model = None
+retriever = None
+retriever_version: str | None = None
+embedding_batcher: EmbeddingBatcher | None = None
+lexical_index = LazyBM25Index(BM25_PATH)
+count_prompt_tokens = prompt_builder.TokenCounter(PROMPT_TOKENIZER)
+_init_lock = threading.Lock()
+_reload_lock = threading.Lock()
+# Состояние старта для /readyz: starting -> ready (или failed) и длительности фаз
+startup_state = {"status": "starting", "phases": {}, "error": None}
+
+answer_cache = SemanticCache(
+    max_size=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    persist_dir=PERSIST_DIR
+)
+completion_cache = (
+    CompletionCache(COMPLETION_CACHE_PATH, max_entries=COMPLETION_CACHE_MAX_ENTRIES)
+    if COMPLETION_CACHE_PATH else None
+)
+
+# Пул бэкендов Ollama: маршрутизация по наименьшей загрузке, исключение упавших и повтор
+llm_pool = OllamaPool(OLLAMA_HOSTS)
+# Ограниченный пул потоков для поиска по индексу (вне event loop)
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+# Допуск к генерации: лимит одновременных генераций (растёт с числом бэкендов, делится между воркерами),
+# очередь по приоритету и дедлайны
+generation_scheduler = GenerationScheduler(
+    max(1, OLLAMA_MAX_CONCURRENCY * len(OLLAMA_HOSTS) // API_WORKERS),
+    max(1, GENERATION_QUEUE_DEPTH // API_WORKERS)
+)
+
+
+def _timed_phase(name: str, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    startup_state["phases"][name] = round(elapsed, 3)
+    logging.info(f"Старт: {name} — {elapsed:.2f} с")
+    return result
+
+
+def init_pipeline() -> None:
+    global model, retriever, retriever_version, embedding_batcher
+    if embedding_batcher is not None:
+        return
+    with _init_lock:
+        if embedding_batcher is not None:
+            return
+        if INFERENCE_SOCKET:
+            # encode и search уходят в общий процесс; свой батчер объединяет запросы воркера в один вызов
+            model = InferenceClient(INFERENCE_SOCKET)
+            _timed_phase("wait_inference_server", model.wait_ready, INFERENCE_WAIT_TIMEOUT)
+        else:
+            # Бэкенд векторизации выбирается через EMBED_BACKEND (torch / onnx / onnx-int8)
+            model = _timed_phase("load_embedder", load_embedder)
+            retriever_version = active_index_version()
+            retriever = _timed_phase("open_retriever", create_retriever, retriever_version)
+        embedding_batcher = EmbeddingBatcher(
+            model.encode,
+            max_batch_size=EMBED_BATCH_MAX_SIZE,
+            max_wait_ms=EMBED_BATCH_WAIT_MS
+        )
+
+
+# Прогрев: первый encode (ленивая инициализация torch / ONNX Runtime), пробный поиск
+# (подгрузка HNSW / memmap-векторов и BM25) и загрузка токенайзера промпта
+def warmup(top_k=10) -> None:
+    init_pipeline()
+    query_vector = _timed_phase("warmup_encode", encode_query, WARMUP_QUERY)
+    _timed_phase("warmup_search", search, query_vector, top_k, [WARMUP_QUERY])
+    _timed_phase("warmup_tokenizer", count_prompt_tokens, WARMUP_QUERY)
+
+
+# Горячая замена индекса: новый ретривер открывается и прогревается рядом со старым,
+# затем подменяется одной операцией присваивания. Запросы, уже начавшие поиск, дорабатывают
+# на старом объекте, новые идут в новый — без простоя и без перезапуска API.
+def reload_retriever(force: bool = False) -> dict:
+    global retriever, retriever_version
+    init_pipeline()
+    if INFERENCE_SOCKET:
+        # Индекс принадлежит серверу векторизации — перезагружается там, а кэш ответов — свой у воркера
+        result = model.reload(force)
+        if result.get("reloaded") or result.get("lexical_reloaded"):
+            answer_cache.invalidate()
+        _observe_index_version(result.get("index_version"))
+        return result
+    with _reload_lock:
+        # BM25 пересобирается preprocess_data независимо от векторного индекса
+        lexical_reloaded = lexical_index.reload(force)
+        if lexical_reloaded:
+            answer_cache.invalidate()
+            logging.info(f"BM25-индекс перезагружен: {lexical_index.version}")
+        version = active_index_version()
+        if version == retriever_version and not force:
+            return {"version": version, "reloaded": False, "lexical_reloaded": lexical_reloaded}
+        started = time.perf_counter()
+        new_retriever = create_retriever(version)
+        new_retriever.search(encode_query(WARMUP_QUERY), 10)
+        previous, retriever, retriever_version = retriever_version, new_retriever, version
+        # Ответы, собранные по старой выдаче, больше не актуальны
+        answer_cache.invalidate()
+        elapsed = time.perf_counter() - started
+        logging.info(f"Индекс перезагружен: {previous} -> {version} за {elapsed:.2f} с")
+        return {
+            "version": version,
+            "previous": previous,
+            "reloaded": True,
+            "lexical_reloaded": lexical_reloaded,
+            "seconds": round(elapsed, 3)
+        }
+
+
+# Версия всего, от чего зависит выдача: активная коллекция, метка синхронизации и BM25.
+# Сервер векторизации отдаёт её с каждым /search, воркеры по её смене сбрасывают свой кэш ответов
+def index_version() -> str:
+    return f"{retriever_version}/{answer_cache.collection_version()}/{lexical_index.version}"
+
+
+_server_index_version: str | None = None
+
+
+def _observe_index_version(version: str | None) -> None:
+    global _server_index_version
+    if version is None or version == _server_index_version:
+        return
+    if _server_index_version is not None:
+        answer_cache.invalidate()
+        logging.info(f"Индекс на сервере векторизации сменился ({version}), кэш ответов сброшен")
+    _server_index_version = version
+
+
+# Фоновая задача API: следит за указателем активной версии и подхватывает новую
+async def watch_index_version(interval: float = RETRIEVER_RELOAD_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if not is_ready():
+            continue
+        try:
+            await asyncio.to_thread(reload_retriever)
+        except Exception:
+            # Например, указатель уже сменился, а коллекция ещё не видна — попробуем в следующий раз
+            logging.exception("Не удалось перезагрузить индекс, продолжаем на текущей версии")
+
+
+# Ключ кэша генераций или None, если генерацию кэшировать нельзя (кэш выключен или temperature > 0)
+def _completion_cache_key(prompt: str, max_tokens: int, temperature: float) -> str | None:
+    if completion_cache is None or not is_cacheable(temperature):
+        return None
+    return completion_key(OLLAMA_MODEL, INSTRUCTION, prompt, max_tokens, temperature)
+
+
+# Ответ, usage (prompt_tokens / completion_tokens) и признак попадания в кэш генераций.
+# use_cache=False — не читать кэш (но свежий ответ в него записать)
+def complete_http(prompt: str, max_tokens: int = 2048, temperature: float = 0.0,
+                  use_cache: bool = True) -> tuple[str, dict | None, bool]:
+    key = _completion_cache_key(prompt, max_tokens, temperature)
+    if key is not None and use_cache:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    payload = completion_payload(prompt, max_tokens, temperature)
+
+    try:
+        data = llm_pool.post_sync("/v1/completions", payload)
+    except requests.RequestException:
+        metrics.LLM_ERRORS.inc()
+        raise
+    metrics.observe_usage(data.get("usage"))
+    answer = parse_completion(data)
+    if key is not None:
+        completion_cache.put(key, OLLAMA_MODEL, answer, data.get("usage"))
+    return answer, data.get("usage"), False
 
 
 def ask_ollama_http(prompt: str, max_tokens: int = 2048, temperature: float = 0.0) -> str:
-    instruction = "Дай максимально лаконичный ответ на данный вопрос.\n\n"
-    payload_prompt = instruction + prompt
-
-    url = f"{OLLAMA_HOST}/v1/completions"
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": payload_prompt,
-        "max_tokens": max_tokens,
-        "temperature": temperature
-    }
+    return complete_http(prompt, max_tokens, temperature)[0]
 
-    resp = requests.post(url, json=payload)
-    resp.raise_for_status()
-    data = resp.json()
 
-    if "choices" in data and data["choices"]:
-        return strip_think_sections(data["choices"][0]["text"])
-    return str(data)
+# Дедлайн запроса (time.monotonic) из таймаута клиента или GENERATION_TIMEOUT
+def request_deadline(timeout: float | None = None) -> float | None:
+    timeout = GENERATION_TIMEOUT if timeout is None else timeout
+    return time.monotonic() + timeout if timeout > 0 else None
 
 
-def query_chromadb(query_text: str, top_k=10) -> dict:
-    # Вектор запроса
-    query_vector = model.encode([query_text]).astype(np.float32)
+async def aclose() -> None:
+    await llm_pool.aclose()
+    if embedding_batcher is not None:
+        embedding_batcher.close()
+    if isinstance(model, InferenceClient):
+        model.close()
 
-    # Поиск по ChromaDB
-    results = collection.query(query_embeddings=query_vector, n_results=top_k)
 
-    # Формируем промпт
-    context_chunks = results['documents'][0]
-    prompt_lines = ["Вы получили следующие фрагменты текста, релевантные запросу:"]
-    for i, chunk in enumerate(context_chunks, start=1):
-        prompt_lines.append(f"{i}) {chunk}")
-    prompt_lines.append("")
-    prompt_lines.append(f"На основе этих фрагментов ответьте на вопрос: «{query_text}»")
-    prompt = "\n".join(prompt_lines)
+# Подгрузка модели во все бэкенды Ollama пустым запросом к нативному API: первая генерация не ждёт
+# загрузки весов, а keep_alive не даёт Ollama выгрузить модель между редкими запросами
+async def apreload_ollama() -> None:
+    payload = {"model": OLLAMA_MODEL, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE}
+    await llm_pool.broadcast("/api/generate", payload)
 
-    # Ответ от LLM
-    answer = ask_ollama_http(prompt)
 
+async def astartup() -> dict:
+    """Инициализация и прогрев для lifespan API; тяжёлые шаги выполняются вне event loop."""
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(warmup)
+    except Exception as e:
+        startup_state.update(status="failed", error=str(e))
+        logging.exception("Старт пайплайна не удался")
+        return startup_state
+
+    if OLLAMA_PRELOAD:
+        preload_started = time.perf_counter()
+        try:
+            await apreload_ollama()
+            startup_state["phases"]["ollama_preload"] = round(time.perf_counter() - preload_started, 3)
+            logging.info(f"Старт: ollama_preload — {time.perf_counter() - preload_started:.2f} с")
+        except httpx.HTTPError as e:
+            # Ollama может подняться позже — это не повод не принимать запросы
+            logging.warning(f"Не удалось подгрузить модель {OLLAMA_MODEL} в Ollama: {e}")
+
+    startup_state["status"] = "ready"
+    logging.info(f"Пайплайн готов за {time.perf_counter() - started:.2f} с: {startup_state['phases']}")
+    return startup_state
+
+
+def is_ready() -> bool:
+    return startup_state["status"] == "ready"
+
+
+async def acomplete(prompt: str, max_tokens: int = 2048, temperature: float = 0.0, use_cache: bool = True,
+                    priority: str = "interactive", deadline: float | None = None) -> tuple[str, dict | None, bool]:
+    key = _completion_cache_key(prompt, max_tokens, temperature)
+    if key is not None and use_cache:
+        # SQLite может ждать блокировку другого воркера — не в event loop
+        cached = await asyncio.to_thread(completion_cache.get, key)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    payload = completion_payload(prompt, max_tokens, temperature)
+
+    try:
+        # Ограничение одновременных генераций; отмена задачи обрывает запрос к Ollama
+        async with generation_scheduler.slot(priority, deadline):
+            data = await llm_pool.post("/v1/completions", payload)
+    except httpx.HTTPError:
+        metrics.LLM_ERRORS.inc()
+        raise
+    metrics.observe_usage(data.get("usage"))
+    answer = parse_completion(data)
+    if key is not None:
+        await asyncio.to_thread(completion_cache.put, key, OLLAMA_MODEL, answer, data.get("usage"))
+    return answer, data.get("usage"), False
+
+
+async def ask_ollama_async(prompt: str, max_tokens: int = 2048, temperature: float = 0.0) -> str:
+    return (await acomplete(prompt, max_tokens, temperature))[0]
+
+
+async def stream_ollama(prompt: str, max_tokens: int = 2048, temperature: float = 0.0, usage: dict | None = None,
+                        priority: str = "interactive", deadline: float | None = None):
+    """Отдаёт сырые фрагменты текста из потокового API Ollama (SSE).
+
+    Если передан словарь usage, в него записывается usage из последнего фрагмента потока.
+    """
+    payload = completion_payload(prompt, max_tokens, temperature, stream=True)
+
+    try:
+        async with generation_scheduler.slot(priority, deadline):
+            async with llm_pool.stream("/v1/completions", payload) as resp:
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("usage"):
+                        metrics.observe_usage(chunk["usage"])
+                        if usage is not None:
+                            usage.update(chunk["usage"])
+                    choices = chunk.get("choices")
+                    if choices and choices[0].get("text"):
+                        yield choices[0]["text"]
+    except httpx.HTTPError:
+        metrics.LLM_ERRORS.inc()
+        raise
+
+
+# Векторизация запроса (через общий батчер, см. embedding_batcher)
+def encode_query(query_text: str) -> np.ndarray:
+    init_pipeline()
+    return embedding_batcher.encode(query_text)
+
+
+async def encode_query_async(query_text: str) -> np.ndarray:
+    # Ждём вектор, не занимая поток: батчер сам соберёт конкурентные запросы в один encode
+    if embedding_batcher is None:
+        await asyncio.to_thread(init_pipeline)
+    vector = await asyncio.wrap_future(embedding_batcher.submit(query_text))
+    return vector[np.newaxis, :]
+
+
+# Гибридный поиск: плотная выдача и BM25 объединяются через reciprocal rank fusion
+def hybrid_search(query_texts: list[str], query_vectors: np.ndarray, top_k=10) -> dict:
+    n_candidates = top_k * HYBRID_CANDIDATES_FACTOR
+    # Локальная ссылка: горячая замена индекса не должна попасть в середину запроса
+    index = retriever
+    dense = index.search(query_vectors, n_candidates)
+    bm25 = lexical_index.get()
+
+    fused_results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    for i, query_text in enumerate(query_texts):
+        lexical_ids = [uid for uid, _ in bm25.search(query_text, n_candidates)]
+        fused_ids = reciprocal_rank_fusion([dense['ids'][i], lexical_ids], k=HYBRID_RRF_K)[:top_k]
+
+        found = {
+            doc_id: (doc, meta, distance)
+            for doc_id, doc, meta, distance in zip(
+                dense['ids'][i], dense['documents'][i], dense['metadatas'][i], dense['distances'][i]
+            )
+        }
+        # Документы, найденные только BM25, дочитываем из индекса и считаем для них то же расстояние
+        missing = [doc_id for doc_id in fused_ids if doc_id not in found]
+        if missing:
+            extra = index.get(missing)
+            extra_distances = index.distances(query_vectors[i], extra['embeddings'])
+            for doc_id, doc, meta, distance in zip(extra['ids'], extra['documents'], extra['metadatas'], extra_distances):
+                found[doc_id] = (doc, meta, float(distance))
+
+        fused_ids = [doc_id for doc_id in fused_ids if doc_id in found]
+        fused_results["ids"].append(fused_ids)
+        fused_results["documents"].append([found[doc_id][0] for doc_id in fused_ids])
+        fused_results["metadatas"].append([found[doc_id][1] for doc_id in fused_ids])
+        fused_results["distances"].append([found[doc_id][2] for doc_id in fused_ids])
+    return fused_results
+
+
+# Поиск по векторному индексу (ChromaDB или in-process NumPy), при наличии BM25 — гибридный
+def search(query_vector: np.ndarray, top_k=10, query_texts: list[str] | None = None) -> dict:
+    init_pipeline()
+    if INFERENCE_SOCKET:
+        results = model.search(query_vector, top_k, query_texts)
+        _observe_index_version(results.get("index_version"))
+        return results
+    if query_texts is not None and HYBRID_SEARCH and lexical_index.exists():
+        return hybrid_search(query_texts, query_vector, top_k)
+    return retriever.search(query_vector, top_k)
+
+
+def retrieve(query_text: str, top_k=10) -> dict:
+    return search(encode_query(query_text), top_k, [query_text])
+
+
+# Формирование промпта из найденных фрагментов (см. prompt_builder):
+# возвращает prompt, prompt_tokens и чанки, которые действительно попали в контекст
+def build_prompt(query_text: str, results: dict) -> dict:
+    return prompt_builder.build_prompt(
+        query_text,
+        results['documents'][0],
+        results['metadatas'][0],
+        results['distances'][0],
+        count_tokens=count_prompt_tokens,
+        token_budget=PROMPT_TOKEN_BUDGET,
+        max_per_page=PROMPT_MAX_PER_PAGE,
+        max_distance=PROMPT_MAX_DISTANCE,
+        dedup_threshold=PROMPT_DEDUP_THRESHOLD
+    )
+
+
+def make_result(query_text: str, context: dict, answer: str, usage: dict | None = None,
+                completion_cached: bool = False) -> dict:
     return {
         "query": query_text,
         "answer": answer,
-        "chunks": context_chunks,
+        "chunks": context['chunks'],
+        "metadatas": context['metadatas'],
+        "distances": context['distances'],
+        "prompt": context['prompt'],
+        "prompt_tokens": context['prompt_tokens'],
+        "usage": usage,
+        # Ответ на вопрос не из кэша ответов, но генерация по тому же промпту взята из кэша генераций
+        "cache": "completion" if completion_cached else None,
+        "timings": None
+    }
+
+
+def split_results(results: dict, i: int) -> dict:
+    # Выдача поиска для i-го запроса пакета в форме одиночного запроса
+    return {key: [results[key][i]] for key in ("ids", "documents", "metadatas", "distances")}
+
+
+def make_retrieval_result(query_text: str, results: dict) -> dict:
+    return {
+        "query": query_text,
+        "answer": None,
+        "chunks": results['documents'][0],
         "metadatas": results['metadatas'][0],
         "distances": results['distances'][0],
-        "prompt": prompt
+        "prompt": None,
+        "prompt_tokens": None,
+        "usage": None,
+        "cache": None,
+        "timings": None
+    }
+
+
+def _cached_result(query_text: str, cached: dict, level: str) -> dict:
+    return {**cached, "query": query_text, "cache": level}
+
+
+# bypass — запрос с X-Cache-Bypass: кэши не читаются, свежий ответ в них записывается
+def _exact_cached(query_text: str, top_k, bypass: bool = False) -> dict | None:
+    if bypass:
+        return None
+    cached = answer_cache.get(query_text, scope=top_k)
+    return _cached_result(query_text, cached, "exact") if cached is not None else None
+
+
+def _semantic_cached(query_text: str, query_vector: np.ndarray, top_k, bypass: bool = False) -> dict | None:
+    if bypass:
+        return None
+    cached = answer_cache.get_similar(query_vector[0], scope=top_k)
+    return _cached_result(query_text, cached, "semantic") if cached is not None else None
+
+
+# Векторизация + семантический кэш + поиск. Возвращает (вектор, выдача, ответ из кэша)
+def _retrieve_or_cached(query_text: str, top_k=10, timer: metrics.StageTimer | None = None,
+                        bypass_cache: bool = False) -> tuple:
+    timer = timer or metrics.StageTimer()
+    with timer.stage("encode"):
+        query_vector = encode_query(query_text)
+    cached = _semantic_cached(query_text, query_vector, top_k, bypass_cache)
+    if cached is not None:
+        return query_vector, None, cached
+    with timer.stage("search"):
+        results = search(query_vector, top_k, [query_text])
+    return query_vector, results, None
+
+
+# Итог запроса: тайминги стадий этого запроса (в том числе для ответа из кэша) и счётчик запросов
+def _finish(result: dict, timer: metrics.StageTimer, mode: str) -> dict:
+    result = {**result, "timings": timer.finish()}
+    metrics.count_query(mode, result)
+    return result
+
+
+def query_chromadb(query_text: str, top_k=10, bypass_cache=False) -> dict:
+    timer = metrics.StageTimer()
+    cached = _exact_cached(query_text, top_k, bypass_cache)
+    if cached is not None:
+        return _finish(cached, timer, "sync")
+
+    query_vector, results, cached = _retrieve_or_cached(query_text, top_k, timer, bypass_cache)
+    if cached is not None:
+        return _finish(cached, timer, "sync")
+
+    with timer.stage("prompt"):
+        context = build_prompt(query_text, results)
+
+    # Ответ от LLM
+    with timer.stage("llm"):
+        answer, usage, completion_cached = complete_http(context['prompt'], use_cache=not bypass_cache)
+
+    result = make_result(query_text, context, answer, usage, completion_cached)
+    answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+    return _finish(result, timer, "sync")
+
+
+# Пакетный поиск: один encode на все вопросы и один запрос к индексу
+def retrieve_batch(questions: list[str], top_k=10) -> tuple:
+    init_pipeline()
+    query_vectors = model.encode(questions).astype(np.float32)
+    return query_vectors, search(query_vectors, top_k, questions)
+
+
+def query_chromadb_batch(questions: list[str], top_k=10, retrieval_only=False, bypass_cache=False) -> list[dict]:
+    if not questions:
+        return []
+    timer = metrics.StageTimer()
+    with timer.stage("batch_retrieval"):
+        query_vectors, results = retrieve_batch(questions, top_k)
+
+    output = []
+    for i, query_text in enumerate(questions):
+        single = split_results(results, i)
+        if retrieval_only:
+            output.append(make_retrieval_result(query_text, single))
+            continue
+
+        query_vector = query_vectors[i:i + 1]
+        cached = (_exact_cached(query_text, top_k, bypass_cache)
+                  or _semantic_cached(query_text, query_vector, top_k, bypass_cache))
+        if cached is not None:
+            output.append(cached)
+            continue
+
+        with timer.stage("prompt"):
+            context = build_prompt(query_text, single)
+        with timer.stage("llm"):
+            result = make_result(query_text, context, *complete_http(context['prompt'], use_cache=not bypass_cache))
+        answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+        output.append(result)
+    for result in output:
+        metrics.count_query("batch", result)
+    return output
+
+
+async def run_in_executor(func, *args):
+    # Поиск блокирует CPU — уносим его из event loop в ограниченный пул
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_retrieval_executor, func, *args)
+
+
+async def retrieve_async(query_text: str, top_k=10) -> dict:
+    query_vector = await encode_query_async(query_text)
+    return await run_in_executor(search, query_vector, top_k, [query_text])
+
+
+async def _aretrieve_or_cached(query_text: str, top_k=10, timer: metrics.StageTimer | None = None,
+                              bypass_cache: bool = False) -> tuple:
+    timer = timer or metrics.StageTimer()
+    # Время encode включает ожидание микро-батча, время search — ожидание потока из пула
+    with timer.stage("encode"):
+        query_vector = await encode_query_async(query_text)
+    cached = _semantic_cached(query_text, query_vector, top_k, bypass_cache)
+    if cached is not None:
+        return query_vector, None, cached
+    with timer.stage("search"):
+        results = await run_in_executor(search, query_vector, top_k, [query_text])
+    return query_vector, results, None
+
+
+async def aquery_chromadb(query_text: str, top_k=10, bypass_cache=False,
+                          priority: str = "interactive", deadline: float | None = None) -> dict:
+    timer = metrics.StageTimer()
+    cached = _exact_cached(query_text, top_k, bypass_cache)
+    if cached is not None:
+        return _finish(cached, timer, "async")
+
+    query_vector, results, cached = await _aretrieve_or_cached(query_text, top_k, timer, bypass_cache)
+    if cached is not None:
+        return _finish(cached, timer, "async")
+
+    with timer.stage("prompt"):
+        context = build_prompt(query_text, results)
+
+    with timer.stage("llm"):
+        answer, usage, completion_cached = await acomplete(
+            context['prompt'], use_cache=not bypass_cache, priority=priority, deadline=deadline
+        )
+
+    result = make_result(query_text, context, answer, usage, completion_cached)
+    answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+    return _finish(result, timer, "async")
+
+
+async def astream_query(query_text: str, top_k=10, bypass_cache=False,
+                        priority: str = "interactive", deadline: float | None = None):
+    """Потоковый вариант aquery_chromadb.
+
+    Генерирует пары (event, data): сначала найденные чанки, затем токены
+    ответа без секции <think>, в конце — итоговый ответ и тайминги.
+    """
+    timer = metrics.StageTimer()
+    started = time.perf_counter()
+    cached = _exact_cached(query_text, top_k, bypass_cache)
+    if cached is None:
+        query_vector, results, cached = await _aretrieve_or_cached(query_text, top_k, timer, bypass_cache)
+    retrieval_time = time.perf_counter() - started
+
+    if cached is not None:
+        # Из кэша ответ отдаём целиком одним событием
+        yield "chunks", {
+            "query": query_text,
+            "chunks": cached["chunks"],
+            "metadatas": cached["metadatas"],
+            "distances": cached["distances"],
+            "prompt_tokens": cached["prompt_tokens"]
+        }
+        yield "token", {"text": cached["answer"]}
+        yield "done", {
+            "answer": cached["answer"],
+            "cache": cached["cache"],
+            "prompt_tokens": cached["prompt_tokens"],
+            "retrieval_time": retrieval_time,
+            "time_to_first_token": 0.0,
+            "generation_time": 0.0,
+            "timings": _finish(cached, timer, "stream")["timings"]
+        }
+        return
+
+    with timer.stage("prompt"):
+        context = build_prompt(query_text, results)
+    yield "chunks", {
+        "query": query_text,
+        "chunks": context['chunks'],
+        "metadatas": context['metadatas'],
+        "distances": context['distances'],
+        "prompt_tokens": context['prompt_tokens']
     }
+
+    # Генерация по тому же промпту уже есть в кэше генераций — отдаём её одним событием
+    key = _completion_cache_key(context['prompt'], 2048, 0.0)
+    completion = None
+    if key is not None and not bypass_cache:
+        completion = await asyncio.to_thread(completion_cache.get, key)
+    if completion is not None:
+        answer, usage = completion
+        result = make_result(query_text, context, answer, usage, completion_cached=True)
+        answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+        yield "token", {"text": answer}
+        yield "done", {
+            "answer": answer,
+            "cache": result["cache"],
+            "prompt_tokens": context['prompt_tokens'],
+            "usage": usage,
+            "retrieval_time": retrieval_time,
+            "time_to_first_token": 0.0,
+            "generation_time": 0.0,
+            "timings": _finish(result, timer, "stream")["timings"]
+        }
+        return
+
+    stripper = ThinkStripper()
+    answer_parts = []
+    first_token_time = None
+    usage = {}
+
+    generation_started = time.perf_counter()
+    async for raw in stream_ollama(context['prompt'], usage=usage, priority=priority, deadline=deadline):
+        text = stripper.feed(raw)
+        if not text:
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - generation_started
+        answer_parts.append(text)
+        yield "token", {"text": text}
+
+    tail = stripper.finish()
+    if tail:
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - generation_started
+        answer_parts.append(tail)
+        yield "token", {"text": tail}
+
+    generation_time = time.perf_counter() - generation_started
+    if first_token_time is not None:
+        timer.record("llm_ttft", first_token_time)
+    timer.record("llm", generation_time)
+
+    answer = "".join(answer_parts).strip()
+    result = make_result(query_text, context, answer, usage or None)
+    answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+    if key is not None:
+        await asyncio.to_thread(completion_cache.put, key, OLLAMA_MODEL, answer, usage or None)
+
+    yield "done", {
+        "answer": answer,
+        "cache": None,
+        "prompt_tokens": context['prompt_tokens'],
+        "usage": result["usage"],
+        "retrieval_time": retrieval_time,
+        # Время до первого видимого токена ответа (после </think>) от начала генерации
+        "time_to_first_token": first_token_time,
+        "generation_time": generation_time,
+        "timings": _finish(result, timer, "stream")["timings"]
+    }
+
+
+async def aquery_chromadb_batch(questions: list[str], top_k=10, retrieval_only=False,
+                                concurrency: int | None = None, bypass_cache=False,
+                                timeout: float | None = None) -> list[dict]:
+    """timeout — ограничение на одну генерацию (по умолчанию GENERATION_TIMEOUT), а не на весь пакет:
+    ночной пакет может идти сколько угодно, а готовые ответы не теряются из-за последних."""
+    if not questions:
+        return []
+    timer = metrics.StageTimer()
+    with timer.stage("batch_retrieval"):
+        query_vectors, results = await run_in_executor(retrieve_batch, questions, top_k)
+    singles = [split_results(results, i) for i in range(len(questions))]
+
+    if retrieval_only:
+        output = [make_retrieval_result(q, single) for q, single in zip(questions, singles)]
+        for result in output:
+            metrics.count_query("batch", result)
+        return output
+
+    # Общий лимит генераций задаёт OLLAMA_MAX_CONCURRENCY, здесь — доля одного пакета
+    limiter = asyncio.Semaphore(max(1, min(concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)))
+
+    async def answer(i: int) -> dict:
+        query_text, single = questions[i], singles[i]
+        query_vector = query_vectors[i:i + 1]
+        cached = (_exact_cached(query_text, top_k, bypass_cache)
+                  or _semantic_cached(query_text, query_vector, top_k, bypass_cache))
+        if cached is not None:
+            return cached
+
+        with timer.stage("prompt"):
+            context = build_prompt(query_text, single)
+        async with limiter:
+            # Дедлайн отсчитывается с начала этой генерации (включая ожидание в очереди планировщика)
+            deadline = request_deadline(timeout)
+            with timer.stage("llm"):
+                result = make_result(query_text, context, *(await acomplete(
+                    context['prompt'], use_cache=not bypass_cache, priority="batch", deadline=deadline
+                )))
+        answer_cache.put(query_text, query_vector[0], result, scope=top_k)
+        return result
+
+    tasks = [asyncio.ensure_future(answer(i)) for i in range(len(questions))]
+    try:
+        output = list(await asyncio.gather(*tasks))
+    except BaseException:
+        # Отказ (очередь, дедлайн) или отмена пакета — остальные генерации пакета не нужны
+        for task in tasks:
+            task.cancel()
+        raise
+    for result in output:
+        metrics.count_query("batch", result)
+    return output
@@ -0,0 +1,252 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from vector_store import load_vectors
+
+# Пространства расстояний совпадают с hnsw:space в ChromaDB
+SPACES = ("l2", "cosine", "ip")
+
+
+# Индексы top_k наибольших значений в каждой строке scores, по убыванию
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    top_k = min(top_k, scores.shape[1])
+    if top_k < scores.shape[1]:
+        part = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), (scores.shape[0], scores.shape[1]))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Перевод косинусной близости нормированных векторов в расстояние выбранного пространства
+def similarity_to_distance(similarities: np.ndarray, space: str) -> np.ndarray:
+    if space == "l2":
+        # Квадрат евклидова расстояния между единичными векторами, как в ChromaDB
+        return np.maximum(2.0 - 2.0 * similarities, 0.0)
+    return 1.0 - similarities
+
+
+class Retriever:
+    """Интерфейс поиска по векторам.
+
+    search возвращает словарь в формате collection.query из ChromaDB:
+    ids / documents / metadatas / distances — списки по одному на каждый запрос.
+    """
+
+    space = "l2"
+
+    def search(self, query_vectors: np.ndarray, top_k: int = 10) -> dict:
+        raise NotImplementedError
+
+    # Записи по id: ids / documents / metadatas / embeddings в порядке запрошенных ids
+    def get(self, ids: list[str]) -> dict:
+        raise NotImplementedError
+
+    # Расстояния от запроса до произвольных векторов в пространстве индекса
+    def distances(self, query_vector: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+        similarities = _normalize(embeddings) @ _normalize(np.atleast_2d(query_vector))[0]
+        return similarity_to_distance(similarities, self.space)
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+
+class ChromaRetriever(Retriever):
+    def __init__(self, collection):
+        self.collection = collection
+        self.space = (collection.metadata or {}).get("hnsw:space", "l2")
+
+    def search(self, query_vectors: np.ndarray, top_k: int = 10) -> dict:
+        return self.collection.query(
+            query_embeddings=np.asarray(query_vectors, dtype=np.float32),
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"]
+        )
+
+    def get(self, ids: list[str]) -> dict:
+        found = self.collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+        # ChromaDB не гарантирует порядок — раскладываем по запрошенным ids
+        position = {doc_id: i for i, doc_id in enumerate(found['ids'])}
+        rows = [position[doc_id] for doc_id in ids if doc_id in position]
+        return {
+            "ids": [found['ids'][i] for i in rows],
+            "documents": [found['documents'][i] for i in rows],
+            "metadatas": [found['metadatas'][i] for i in rows],
+            "embeddings": np.asarray([found['embeddings'][i] for i in rows], dtype=np.float32)
+        }
+
+    def count(self) -> int:
+        return self.collection.count()
+
+
+class NumpyRetriever(Retriever):
+    """Точный поиск в памяти процесса по нормированным векторам.
+
+    quantize="int8" хранит в памяти int8-копию матрицы (в 4 раза меньше float32)
+    и отбирает по ней кандидатов с запасом (rescore_factor * top_k), после чего
+    пересчитывает их точные оценки по исходным векторам — recall не теряется.
+    """
+
+    def __init__(self, vectors, columns, quantize=None, space="l2", rescore_factor=4, chunk_size=16384):
+        if space not in SPACES:
+            raise ValueError(f"Неизвестное пространство {space}, ожидалось одно из {SPACES}")
+        if quantize not in (None, "int8"):
+            raise ValueError(f"Неизвестный тип квантизации {quantize}")
+
+        self.space = space
+        self.quantize = quantize
+        self.rescore_factor = rescore_factor
+        self.chunk_size = chunk_size
+
+        self.ids = [str(uid) for uid in columns['uid']]
+        self._rows = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.documents = columns['text']
+        self.metadatas = [
+            {"uid": str(uid), "ru_wiki_pageid": str(pageid)}
+            for uid, pageid in zip(columns['uid'], columns['ru_wiki_pageid'])
+        ]
+
+        if quantize == "int8":
+            # Исходные векторы остаются на диске (memmap) и читаются только для кандидатов
+            self._source = vectors
+            self._matrix, self._scales = self._quantize_int8(vectors)
+        else:
+            self._source = None
+            self._matrix = _normalize(vectors)
+            self._scales = None
+        logging.info(
+            f"NumpyRetriever: {len(self.ids)} векторов, space={space}, quantize={quantize}, "
+            f"{self._matrix.nbytes / 2 ** 20:.1f} MiB"
+        )
+
+    @classmethod
+    def from_artifact(cls, vectors_path, **kwargs):
+        vectors, columns = load_vectors(vectors_path)
+        return cls(vectors, columns, **kwargs)
+
+    def _quantize_int8(self, vectors):
+        # Симметричная поштучная квантизация нормированных векторов, считаем кусками
+        matrix = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], self.chunk_size):
+            chunk = _normalize(vectors[start:start + self.chunk_size])
+            peak = np.abs(chunk).max(axis=1)
+            peak[peak == 0] = 1.0
+            scales[start:start + len(chunk)] = peak / 127.0
+            matrix[start:start + len(chunk)] = np.round(chunk / scales[start:start + len(chunk), None])
+        return matrix, scales
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        if self._scales is None:
+            return queries @ self._matrix.T
+        scores = np.empty((queries.shape[0], self._matrix.shape[0]), dtype=np.float32)
+        for start in range(0, self._matrix.shape[0], self.chunk_size):
+            block = self._matrix[start:start + self.chunk_size].astype(np.float32)
+            scores[:, start:start + len(block)] = (queries @ block.T) * self._scales[start:start + len(block)]
+        return scores
+
+    def _rescore(self, queries: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        exact = np.empty(candidates.shape, dtype=np.float32)
+        for i, rows in enumerate(candidates):
+            # Читаем memmap в порядке возрастания строк, оценки раскладываем обратно
+            order = np.argsort(rows)
+            exact[i, order] = _normalize(self._source[rows[order]]) @ queries[i]
+        return exact
+
+    def search(self, query_vectors: np.ndarray, top_k: int = 10) -> dict:
+        queries = _normalize(np.atleast_2d(query_vectors))
+        scores = self._scores(queries)
+
+        if self._scales is None:
+            top = top_k_indices(scores, top_k)
+            similarities = np.take_along_axis(scores, top, axis=1)
+        else:
+            candidates = top_k_indices(scores, top_k * self.rescore_factor)
+            exact = self._rescore(queries, candidates)
+            order = top_k_indices(exact, top_k)
+            top = np.take_along_axis(candidates, order, axis=1)
+            similarities = np.take_along_axis(exact, order, axis=1)
+
+        distances = similarity_to_distance(similarities, self.space)
+        return {
+            "ids": [[self.ids[j] for j in row] for row in top],
+            "documents": [[self.documents[j] for j in row] for row in top],
+            "metadatas": [[self.metadatas[j] for j in row] for row in top],
+            "distances": distances.tolist()
+        }
+
+    def get(self, ids: list[str]) -> dict:
+        rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        source = self._source if self._source is not None else self._matrix
+        return {
+            "ids": [self.ids[i] for i in rows],
+            "documents": [self.documents[i] for i in rows],
+            "metadatas": [self.metadatas[i] for i in rows],
+            "embeddings": np.asarray(source[rows], dtype=np.float32).reshape(len(rows), -1)
+        }
+
+    def count(self) -> int:
+        return len(self.ids)
+
+
+# Слияние выдач шардов: для каждого запроса top_k по расстоянию из объединения кандидатов.
+# Если каждый шард вернул свои top_k, глобальные top_k среди них — как у нешардированного индекса.
+def merge_top_k(results: list[dict], top_k: int) -> dict:
+    merged = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    for i in range(len(results[0]["ids"])):
+        candidates = [
+            (distance, doc_id, doc, meta)
+            for result in results
+            for doc_id, doc, meta, distance in zip(
+                result["ids"][i], result["documents"][i], result["metadatas"][i], result["distances"][i]
+            )
+        ]
+        candidates.sort(key=lambda candidate: candidate[0])
+        top = candidates[:top_k]
+        merged["ids"].append([doc_id for _, doc_id, _, _ in top])
+        merged["documents"].append([doc for _, _, doc, _ in top])
+        merged["metadatas"].append([meta for _, _, _, meta in top])
+        merged["distances"].append([float(distance) for distance, _, _, _ in top])
+    return merged
+
+
+class ShardedRetriever(Retriever):
+    """Поиск по нескольким шардам (записи разложены по хэшу uid, см. chroma_setup.py --shards).
+
+    Запрос уходит во все шарды параллельно, у каждого берутся top_k, затем выдачи
+    сливаются по расстоянию.
+    """
+
+    def __init__(self, shards: list[Retriever]):
+        self.shards = shards
+        self.space = shards[0].space
+        self._executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard-search")
+
+    def _fan_out(self, method: str, *args) -> list:
+        return list(self._executor.map(lambda shard: getattr(shard, method)(*args), self.shards))
+
+    def search(self, query_vectors: np.ndarray, top_k: int = 10) -> dict:
+        return merge_top_k(self._fan_out("search", query_vectors, top_k), top_k)
+
+    def get(self, ids: list[str]) -> dict:
+        found = {}
+        for part in self._fan_out("get", ids):
+            for doc_id, doc, meta, embedding in zip(part['ids'], part['documents'], part['metadatas'], part['embeddings']):
+                found[doc_id] = (doc, meta, embedding)
+        rows = [doc_id for doc_id in ids if doc_id in found]
+        return {
+            "ids": rows,
+            "documents": [found[doc_id][0] for doc_id in rows],
+            "metadatas": [found[doc_id][1] for doc_id in rows],
+            "embeddings": np.asarray([found[doc_id][2] for doc_id in rows], dtype=np.float32).reshape(len(rows), -1)
+        }
+
+    def count(self) -> int:
+        return sum(self._fan_out("count"))
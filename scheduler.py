@@ -0,0 +1,130 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+import metrics
+
+# Планировщик генераций перед Ollama: не больше max_concurrency генераций одновременно,
+# ожидающие стоят в ограниченной очереди по приоритету (интерактивные раньше пакетных),
+# при полной очереди запрос сразу отклоняется, а ожидание и генерация ограничены дедлайном.
+# Отмена задачи (клиент отключился) снимает запрос с очереди или обрывает генерацию.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class AdmissionError(Exception):
+    """Запрос не допущен к генерации; retry_after — через сколько секунд имеет смысл повторить."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionError):
+    status_code = 429
+
+
+class DeadlineExceeded(AdmissionError):
+    status_code = 503
+
+
+class GenerationScheduler:
+    def __init__(self, max_concurrency=4, max_queue=32, default_duration=10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self._queue = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        # Скользящее среднее длительности генерации — для оценки Retry-After
+        self._avg_duration = default_duration
+        self.rejected = 0
+        self.expired = 0
+
+    def queued(self) -> int:
+        return sum(1 for *_, future in self._queue if not future.done())
+
+    # Новый запрос сейчас был бы отклонён — проверка до начала потокового ответа
+    def full(self) -> bool:
+        return self.running >= self.max_concurrency and self.queued() >= self.max_queue
+
+    def retry_after(self) -> int:
+        waves = (self.queued() + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self._avg_duration))
+
+    def _wake_next(self) -> None:
+        while self._queue and self.running < self.max_concurrency:
+            *_, future = heapq.heappop(self._queue)
+            if future.done():
+                # Отменённый или просроченный ожидающий
+                continue
+            self.running += 1
+            future.set_result(None)
+
+    # Слот мог быть выдан ожидающему одновременно с таймаутом или отменой — отдаём его следующему
+    def _give_back(self, future) -> None:
+        if future.done() and not future.cancelled():
+            self.running -= 1
+            self._wake_next()
+
+    async def _acquire(self, priority: str, deadline: float | None) -> None:
+        if self.running < self.max_concurrency and not self.queued():
+            self.running += 1
+            return
+        if self.queued() >= self.max_queue:
+            self.rejected += 1
+            metrics.ADMISSION_REJECTED.labels(reason="queue_full").inc()
+            raise QueueFull(f"Очередь генераций заполнена ({self.max_queue})", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), future))
+        metrics.GENERATION_QUEUE.labels(priority=priority).inc()
+        started = time.perf_counter()
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._give_back(future)
+            self.expired += 1
+            metrics.ADMISSION_REJECTED.labels(reason="deadline").inc()
+            raise DeadlineExceeded("Дедлайн запроса истёк в очереди генераций", self.retry_after()) from None
+        except asyncio.CancelledError:
+            self._give_back(future)
+            raise
+        finally:
+            metrics.GENERATION_QUEUE.labels(priority=priority).dec()
+            metrics.STAGE_SECONDS.labels(stage="llm_queue").observe(time.perf_counter() - started)
+
+    def _release(self, duration: float) -> None:
+        self.running -= 1
+        self._avg_duration = 0.9 * self._avg_duration + 0.1 * duration
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive", deadline: float | None = None):
+        """Слот генерации. Внутри действует остаток дедлайна: по его истечении генерация
+        отменяется (httpx закрывает соединение, и Ollama прекращает генерацию)."""
+        await self._acquire(priority, deadline)
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                yield
+        except TimeoutError:
+            self.expired += 1
+            metrics.ADMISSION_REJECTED.labels(reason="generation_deadline").inc()
+            raise DeadlineExceeded("Дедлайн запроса истёк во время генерации", self.retry_after()) from None
+        finally:
+            self._release(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queued(),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_generation_s": round(self._avg_duration, 3)
+        }
@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+# Файл-метка версии коллекции. chroma_setup перезаписывает его после пересборки,
+# а кэш сбрасывается, как только видит, что метка изменилась.
+COLLECTION_VERSION_FILE = "collection_version"
+
+
+def write_collection_version(persist_dir) -> str:
+    version = uuid.uuid4().hex
+    path = Path(persist_dir) / COLLECTION_VERSION_FILE
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(version, encoding='utf-8')
+    os.replace(tmp_path, path)
+    return version
+
+
+def read_collection_version(persist_dir) -> str | None:
+    path = Path(persist_dir) / COLLECTION_VERSION_FILE
+    try:
+        return path.read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+
+
+# Нормализация вопроса для точного совпадения
+def normalize_question(question: str) -> str:
+    question = re.sub(r'[^\w\s]', '', question.lower())
+    return re.sub(r'\s+', ' ', question).strip()
+
+
+class SemanticCache:
+    """Двухуровневый кэш ответов: точное совпадение нормализованного вопроса
+    и семантическое — по косинусной близости эмбеддингов запросов.
+
+    Вытеснение LRU с ограничением по размеру и TTL. Записи хранятся в
+    пространстве scope (например, top_k), чтобы не смешивать разные выдачи.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600.0, threshold=0.95, persist_dir=None, version_check_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.persist_dir = persist_dir
+        # Метку версии проверяем не чаще раза в version_check_interval секунд и перечитываем,
+        # только если у файла сменились mtime / inode: кэш вызывается прямо из event loop
+        self.version_check_interval = version_check_interval
+        self._next_version_check = 0.0
+        self._version_stat = None
+
+        self._entries = OrderedDict()  # key -> (scope, embedding, value, created_at)
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = []
+        self._version = self._current_version()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _version_file_stat(self):
+        try:
+            stat = os.stat(Path(self.persist_dir) / COLLECTION_VERSION_FILE)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _current_version(self):
+        if self.persist_dir is None:
+            return None
+        self._version_stat = self._version_file_stat()
+        self._next_version_check = time.monotonic() + self.version_check_interval
+        return read_collection_version(self.persist_dir)
+
+    def _check_version(self):
+        # Коллекцию пересобрали (возможно, в другом процессе) — старые ответы неактуальны
+        if self.persist_dir is None or time.monotonic() < self._next_version_check:
+            return
+        self._next_version_check = time.monotonic() + self.version_check_interval
+        stat = self._version_file_stat()
+        if stat == self._version_stat:
+            return
+        version = self._current_version()
+        if version != self._version:
+            self._clear()
+            self._version = version
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._matrix_keys = []
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.monotonic() - created_at > self.ttl
+
+    @staticmethod
+    def _key(question: str, scope) -> tuple:
+        return scope, normalize_question(question)
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._matrix = None
+
+    def get(self, question: str, scope=None):
+        with self._lock:
+            self._check_version()
+            key = self._key(question, scope)
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[3]):
+                if entry is not None:
+                    self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[2]
+
+    def get_similar(self, embedding: np.ndarray, scope=None):
+        with self._lock:
+            self._check_version()
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix_keys = list(self._entries.keys())
+                    self._matrix = np.stack([self._entries[k][1] for k in self._matrix_keys])
+
+                query = embedding / (np.linalg.norm(embedding) or 1.0)
+                similarities = self._matrix @ query
+                for idx in np.argsort(similarities)[::-1]:
+                    if similarities[idx] < self.threshold:
+                        break
+                    key = self._matrix_keys[idx]
+                    entry = self._entries[key]
+                    if key[0] != scope or self._expired(entry[3]):
+                        continue
+                    self._entries.move_to_end(key)
+                    self.semantic_hits += 1
+                    return entry[2]
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, embedding: np.ndarray, value, scope=None):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self._lock:
+            self._check_version()
+            key = self._key(question, scope)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (scope, embedding, value, time.monotonic())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    # Текущая метка версии коллекции (с той же проверкой, что и при обращениях к кэшу)
+    def collection_version(self):
+        with self._lock:
+            self._check_version()
+            return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self._version = self._current_version()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+            }
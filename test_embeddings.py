@@ -1,31 +1,39 @@
-import json
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-from pathlib import Path
+from embedder import load_embedder
+from retriever import top_k_indices
+from vector_store import VECTORS_PATH, load_vectors
 
-# Загрузка данных
+_model = None
+
+# Модель загружается один раз на процесс, а не на каждый запрос
+def get_model():
+    global _model
+    if _model is None:
+        _model = load_embedder()
+    return _model
+
+# Загрузка данных (векторы отображаются в память без копирования)
 def load_data(input_path):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_vectors(input_path)
 
 # Подготовка векторов с сохранением uid
 def prepare_vectors(data):
-    uids = [item['uid'] for item in data]
-    texts = [item['text'] for item in data]
-    vectors = np.array([item['vector'] for item in data])
-    return uids, texts, vectors
+    vectors, columns = data
+    return columns['uid'], columns['text'], vectors
 
 # Поиск похожих текстов
 def find_similar_texts(query_text, uids, texts, vectors, top_k=10):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    query_vector = model.encode([query_text])[0].reshape(1, -1)
+    query_vector = get_model().encode([query_text])[0].astype(np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
 
-    # Вычисляем косинусное сходство
-    similarities = cosine_similarity(query_vector, vectors)[0]
+    # Вычисляем косинусное сходство одним матрично-векторным произведением
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    similarities = (vectors @ query_vector) / norms
 
-    # Сортируем по убыванию сходства и берем топ-k
-    top_indices = similarities.argsort()[-top_k-1:-1][::-1]
+    # Топ-k через argpartition вместо полной сортировки
+    top_indices = top_k_indices(similarities[np.newaxis, :], top_k)[0]
     top_similarities = similarities[top_indices]
     top_uids = [uids[i] for i in top_indices]
     top_texts = [texts[i] for i in top_indices]
@@ -34,7 +42,7 @@ def find_similar_texts(query_text, uids, texts, vectors, top_k=10):
     return list(zip(top_uids, top_texts, top_vectors, top_similarities))[:top_k]
 
 if __name__ == "__main__":
-    input_path = Path("data/vectored_RuBQ_2.0_paragraphs.json")
+    input_path = VECTORS_PATH
 
     # Загрузка данных
     data = load_data(input_path)
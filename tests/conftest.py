@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# Модули проекта лежат плоско в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# rag_core при импорте открывает кэш генераций — тестам он не нужен
+os.environ.setdefault("COMPLETION_CACHE_PATH", "")
@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+import API
+import rag_core
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(rag_core.startup_state, "status", "ready")
+    monkeypatch.setattr(rag_core, "reload_retriever", lambda force=False: {"reloaded": force})
+    # Без with: lifespan (загрузка модели и индекса) не запускается
+    return TestClient(API.app)
+
+
+def test_admin_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(API, "ADMIN_TOKEN", "")
+    assert client.post("/admin/reload", headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_requires_token(client, monkeypatch):
+    monkeypatch.setattr(API, "ADMIN_TOKEN", "s3cret")
+    assert client.post("/admin/reload").status_code == 401
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    response = client.post("/admin/reload?force=true", headers={"X-Admin-Token": "s3cret"})
+    assert response.status_code == 200 and response.json() == {"reloaded": True}
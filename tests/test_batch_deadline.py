@@ -0,0 +1,62 @@
+import asyncio
+import numpy as np
+import pytest
+import rag_core
+from scheduler import DeadlineExceeded
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    def retrieve_batch(questions, top_k=10):
+        n = len(questions)
+        results = {
+            "ids": [["1"]] * n, "documents": [["текст"]] * n,
+            "metadatas": [[{"uid": "1"}]] * n, "distances": [[0.1]] * n
+        }
+        return np.zeros((n, 4), dtype=np.float32), results
+
+    def build_prompt(query_text, results):
+        return {"prompt": query_text, "prompt_tokens": 1, "chunks": results["documents"][0],
+                "metadatas": results["metadatas"][0], "distances": results["distances"][0]}
+
+    monkeypatch.setattr(rag_core, "retrieve_batch", retrieve_batch)
+    monkeypatch.setattr(rag_core, "build_prompt", build_prompt)
+
+
+def _generation(monkeypatch, seconds):
+    async def post(path, payload):
+        await asyncio.sleep(seconds)
+        return {"choices": [{"text": "ответ на " + payload["prompt"][-2:]}]}
+
+    monkeypatch.setattr(rag_core.llm_pool, "post", post)
+
+
+def test_batch_longer_than_timeout(fake_pipeline, monkeypatch):
+    # 6 генераций по 0.1 с подряд — пакет идёт 0.6 с при таймауте 0.25 с на генерацию
+    monkeypatch.setattr(rag_core, "GENERATION_TIMEOUT", 0.25)
+    _generation(monkeypatch, 0.1)
+    questions = [f"вопрос {i:02d}" for i in range(6)]
+    output = asyncio.run(rag_core.aquery_chromadb_batch(questions, concurrency=1, bypass_cache=True))
+    assert [result["answer"] for result in output] == [f"ответ на {i:02d}" for i in range(6)]
+
+
+def test_batch_generation_timeout(fake_pipeline, monkeypatch):
+    # Одна генерация дольше таймаута — пакет отклоняется
+    _generation(monkeypatch, 1.0)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(rag_core.aquery_chromadb_batch(["вопрос"], bypass_cache=True, timeout=0.1))
+
+
+def test_api_batch_longer_than_timeout(fake_pipeline, monkeypatch):
+    from fastapi.testclient import TestClient
+    import API
+
+    monkeypatch.setitem(rag_core.startup_state, "status", "ready")
+    monkeypatch.setattr(rag_core, "GENERATION_TIMEOUT", 0.25)
+    _generation(monkeypatch, 0.1)
+    questions = [f"вопрос {i:02d}" for i in range(6)]
+    response = TestClient(API.app).post(
+        "/query/batch", json={"questions": questions, "concurrency": 1}, headers={"X-Cache-Bypass": "1"}
+    )
+    assert response.status_code == 200
+    assert [item["answer"] for item in response.json()["results"]] == [f"ответ на {i:02d}" for i in range(6)]
@@ -0,0 +1,63 @@
+import numpy as np
+from bm25_index import ARRAYS, BM25Index, KEEP_VERSIONS, LazyBM25Index, read_index_version
+
+DOCS_V1 = [
+    {"uid": "1", "text": "москва столица россии"},
+    {"uid": "2", "text": "цска футбольный клуб из москвы"},
+]
+DOCS_V2 = [
+    {"uid": "10", "text": "санкт петербург основан петром"},
+    {"uid": "11", "text": "нева течёт через санкт петербург"},
+    {"uid": "12", "text": "эрмитаж музей в санкт петербурге"},
+]
+
+
+def test_save_does_not_touch_loaded_version(tmp_path):
+    BM25Index.build(DOCS_V1).save(tmp_path)
+    lazy = LazyBM25Index(tmp_path)
+    old = lazy.get()
+    old_doc_ids = np.array(old.doc_ids)
+
+    BM25Index.build(DOCS_V2).save(tmp_path)
+    # Старая версия, открытая через memmap, осталась целой и согласованной со своим словарём
+    assert np.array_equal(old.doc_ids, old_doc_ids)
+    assert old.search("столица")[0][0] == "1"
+
+    assert lazy.reload()
+    assert lazy.version == read_index_version(tmp_path)
+    assert lazy.get().search("петербург", 3)[0][0] in {"10", "11", "12"}
+    assert not lazy.reload()
+
+
+def test_reload_before_first_load_is_noop(tmp_path):
+    BM25Index.build(DOCS_V1).save(tmp_path)
+    lazy = LazyBM25Index(tmp_path)
+    assert not lazy.reload(force=True)
+    assert lazy.get().search("цска")[0][0] == "2"
+
+
+def test_old_versions_removed(tmp_path):
+    for _ in range(KEEP_VERSIONS + 2):
+        BM25Index.build(DOCS_V1).save(tmp_path)
+    versions = sorted(p.name for p in tmp_path.iterdir() if p.is_dir())
+    assert len(versions) == KEEP_VERSIONS
+    assert read_index_version(tmp_path) == versions[-1]
+
+
+def test_legacy_layout(tmp_path):
+    # Индекс, сохранённый до версий: файлы лежат прямо в каталоге и читаются без указателя
+    index = BM25Index.build(DOCS_V1)
+    saved = index.save(tmp_path)
+    for name in (*(f"{array}.npy" for array in ARRAYS), "vocab.json"):
+        (saved / name).rename(tmp_path / name)
+    saved.rmdir()
+    (tmp_path / "current").unlink()
+
+    lazy = LazyBM25Index(tmp_path)
+    assert lazy.exists()
+    assert lazy.get().search("столица")[0][0] == "1"
+
+    BM25Index.build(DOCS_V2).save(tmp_path)
+    assert not (tmp_path / "vocab.json").exists()
+    assert lazy.reload()
+    assert lazy.get().search("эрмитаж")[0][0] == "12"
@@ -0,0 +1,49 @@
+import json
+import pytest
+from chroma_query import _prepare_resume, load_questions
+
+
+@pytest.mark.parametrize("name, content", [
+    ("q.jsonl", '{"question_text": "Кто основал Петербург?"}\n{"question": "Столица России?"}\n{"uid": 3}\n\n'),
+    ("q.json", json.dumps([{"question_text": "Кто основал Петербург?"}, "Столица России?", {"question": None}, "  "])),
+    ("q.csv", "question,answer\nКто основал Петербург?,Пётр I\nСтолица России?,Москва\n,пусто\n"),
+    ("q.txt", "Кто основал Петербург?\n\nСтолица России?\n"),
+])
+def test_load_questions(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding='utf-8')
+    assert [text for _, text in load_questions(path)] == ["Кто основал Петербург?", "Столица России?"]
+
+
+def test_load_questions_csv_first_column(tmp_path):
+    path = tmp_path / "q.csv"
+    path.write_text("text\nСтолица России?\n", encoding='utf-8')
+    assert load_questions(path) == [({"text": "Столица России?"}, "Столица России?")]
+
+
+def test_load_questions_empty_csv(tmp_path):
+    path = tmp_path / "q.csv"
+    path.write_text("", encoding='utf-8')
+    assert load_questions(path) == []
+
+
+def test_prepare_resume(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    rows = [
+        {"index": 0, "answer": "a"},
+        {"index": 1, "error": "timeout"},
+        {"index": 2, "answer": "c"},
+        {"index": 1, "answer": "b"},
+        {"index": 2, "answer": "c (повтор)"},
+        {"index": 3, "error": "timeout"},
+    ]
+    path.write_text("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows) + '{"index": 4, "ans',
+                    encoding='utf-8')
+
+    assert _prepare_resume(path) == {0, 1, 2}
+    kept = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert kept == [{"index": 0, "answer": "a"}, {"index": 2, "answer": "c"}, {"index": 1, "answer": "b"}]
+
+
+def test_prepare_resume_missing_file(tmp_path):
+    assert _prepare_resume(tmp_path / "answers.jsonl") == set()
@@ -0,0 +1,51 @@
+import json
+import pytest
+from json_stream import iter_chunks, iter_json_array
+
+RECORDS = [
+    {"uid": 1, "text": "Москва — столица России"},
+    {"uid": 2, "text": "строка с ] и [ и \"кавычками\" и \\\\ слешем, {скобками}"},
+    12345678901234567890,
+    3.5e-7,
+    "просто строка",
+    None,
+    True,
+    [],
+    {"nested": {"list": [1, 2, {"a": "b"}]}},
+]
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "data.json"
+    path.write_text(text, encoding='utf-8')
+    return path
+
+
+@pytest.mark.parametrize("buffer_size", [1, 2, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_matches_json_load(tmp_path, buffer_size, indent):
+    path = _write(tmp_path, json.dumps(RECORDS, ensure_ascii=False, indent=indent))
+    assert list(iter_json_array(path, buffer_size=buffer_size)) == RECORDS
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ ]  ", "\n[\n]\n"])
+def test_empty_array(tmp_path, text):
+    assert list(iter_json_array(_write(tmp_path, text), buffer_size=1)) == []
+
+
+@pytest.mark.parametrize("text", ['{"a": 1}', "", "   "])
+def test_not_an_array(tmp_path, text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(_write(tmp_path, text)))
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1}', '[{"a": 1}, {"b": ', '[1, 2'])
+def test_truncated(tmp_path, text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(_write(tmp_path, text), buffer_size=3))
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks(range(6), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(iter_chunks([], 3)) == []
@@ -0,0 +1,80 @@
+import json
+import numpy as np
+import pytest
+from near_dedup import MinHasher, NearDuplicateFilter, lsh_params, near_dedup_config
+
+BASE = "санкт петербург основан петром i в 1703 году и был столицей российской империи"
+
+
+def _jaccard(hasher, a, b):
+    sa, sb = set(hasher.shingles(a).tolist()), set(hasher.shingles(b).tolist())
+    return len(sa & sb) / len(sa | sb)
+
+
+@pytest.mark.parametrize("threshold, num_perm", [(0.85, 128), (0.5, 128), (0.9, 64), (0.7, 100)])
+def test_lsh_params(threshold, num_perm):
+    bands, rows = lsh_params(threshold, num_perm)
+    assert bands * rows == num_perm
+    assert (1.0 / bands) ** (1.0 / rows) <= threshold
+
+
+def test_signature_deterministic():
+    assert np.array_equal(MinHasher().signature(BASE), MinHasher().signature(BASE))
+    assert MinHasher().signatures([BASE, "москва"]).shape == (2, 128)
+
+
+def test_signature_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    other = BASE.replace("столицей", "главным городом")
+    estimate = float(np.mean(hasher.signature(BASE) == hasher.signature(other)))
+    assert abs(estimate - _jaccard(hasher, BASE, other)) < 0.1
+
+
+def test_short_text():
+    # Текст короче n-граммы — одна шингла, а не пустая сигнатура
+    assert MinHasher(ngram=5).shingles("ab").size == 1
+
+
+def test_filter_keeps_first_occurrence():
+    hasher = MinHasher()
+    near = BASE + "!"
+    texts = [BASE, "москва столица россии и крупнейший город страны", near, BASE]
+    assert _jaccard(hasher, BASE, near) >= 0.85
+
+    dedup = NearDuplicateFilter(threshold=0.85)
+    keep = dedup.filter(["a", "b", "c", "d"], hasher.signatures(texts), texts)
+    assert keep.tolist() == [True, True, False, False]
+    assert dedup.dropped == 2
+    assert [entry["uid"] for entry in dedup.clusters["a"]] == ["c", "d"]
+
+
+def test_filter_is_incremental():
+    # Пачками — тот же результат, что и за один проход (так работает потоковая предобработка)
+    hasher = MinHasher()
+    texts = [BASE, BASE + "!", "другой текст про москву и её районы", "другой текст про москву и её районы.", BASE]
+    uids = list(range(len(texts)))
+    signatures = hasher.signatures(texts)
+
+    whole = NearDuplicateFilter().filter(uids, signatures, texts)
+    chunked_filter = NearDuplicateFilter()
+    chunked = np.concatenate([chunked_filter.filter(uids[i:i + 2], signatures[i:i + 2], texts[i:i + 2])
+                              for i in range(0, len(texts), 2)])
+    assert whole.tolist() == chunked.tolist() == [True, False, True, False, False]
+
+
+def test_report(tmp_path):
+    hasher = MinHasher()
+    texts = [BASE, BASE + "!"]
+    dedup = NearDuplicateFilter()
+    dedup.filter(["a", "b"], hasher.signatures(texts), texts)
+    path = tmp_path / "report" / "near.json"
+    dedup.save_report(path)
+    report = json.loads(path.read_text(encoding='utf-8'))
+    assert report["kept"] == 1 and report["dropped"] == 1
+    assert report["clusters"][0]["representative"] == "a"
+
+
+def test_config_defaults():
+    assert near_dedup_config({})["enabled"] is True
+    assert near_dedup_config({"near_dedup": {"threshold": 0.9}})["threshold"] == 0.9
+    assert near_dedup_config(None)["num_perm"] == 128
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import httpx
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from LLM import OllamaPool
+
+HOSTS = ["http://a:11434", "http://b:11434", "http://c:11434"]
+COMPLETION = {"choices": [{"text": "ЦСКА"}]}
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class FakeOllama:
+    """Ответы бэкендов по url: 'ok', 'down' (ошибка соединения), 'error' (500), 'bad' (400)."""
+
+    def __init__(self, pool: OllamaPool, states: dict):
+        self.states = states
+        self.calls = {url: [] for url in states}
+        for backend in pool.backends:
+            backend._async_client = httpx.AsyncClient(
+                base_url=backend.url, transport=httpx.MockTransport(self._handler(backend.url))
+            )
+            backend.session.mount(backend.url, _Adapter(self, backend.url))
+
+    def response(self, url: str, path: str):
+        self.calls[url].append(path)
+        state = self.states[url]
+        if state == "down":
+            return None
+        if state == "error":
+            return 500, {"error": "internal"}
+        if state == "bad":
+            return 400, {"error": "bad request"}
+        if path == "/api/version":
+            return 200, {"version": "test"}
+        return 200, COMPLETION
+
+    def _handler(self, url):
+        def handle(request: httpx.Request) -> httpx.Response:
+            result = self.response(url, request.url.path)
+            if result is None:
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(result[0], json=result[1])
+        return handle
+
+
+class _Adapter(BaseAdapter):
+    def __init__(self, fake: FakeOllama, url: str):
+        super().__init__()
+        self.fake = fake
+        self.url = url
+
+    def send(self, request, **kwargs):
+        result = self.fake.response(self.url, request.path_url)
+        if result is None:
+            raise requests.ConnectionError("connection refused", request=request)
+        response = requests.Response()
+        response.status_code, response._content = result[0], json.dumps(result[1]).encode()
+        response.request, response.url = request, request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def test_pick_least_outstanding():
+    pool = OllamaPool(HOSTS)
+    picked = [pool._pick(set()).url for _ in range(6)]
+    assert sorted(picked) == sorted(HOSTS * 2)
+    # Освободившийся бэкенд — наименее загруженный
+    pool._done(pool.backends[1], 0.0)
+    assert pool._pick(set()).url == HOSTS[1]
+
+
+def test_async_failover_and_eject():
+    async def main():
+        pool = OllamaPool(HOSTS, max_attempts=3)
+        fake = FakeOllama(pool, {HOSTS[0]: "down", HOSTS[1]: "error", HOSTS[2]: "ok"})
+        for _ in range(3):
+            assert await pool.post("/v1/completions", {}) == COMPLETION
+        assert [b.healthy for b in pool.backends] == [False, False, True]
+        # Исключённые бэкенды больше не пробуются
+        assert len(fake.calls[HOSTS[0]]) + len(fake.calls[HOSTS[1]]) <= 2
+        assert len(fake.calls[HOSTS[2]]) == 3
+        assert all(b.outstanding == 0 for b in pool.backends)
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_client_error_not_retried():
+    async def main():
+        pool = OllamaPool(HOSTS[:2])
+        fake = FakeOllama(pool, {HOSTS[0]: "bad", HOSTS[1]: "bad"})
+        with pytest.raises(httpx.HTTPStatusError):
+            await pool.post("/v1/completions", {})
+        # 4xx — ошибка запроса, а не бэкенда: без повтора и без исключения из пула
+        assert sum(len(calls) for calls in fake.calls.values()) == 1
+        assert all(b.healthy for b in pool.backends)
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_all_down_raises_after_max_attempts():
+    async def main():
+        pool = OllamaPool(HOSTS, max_attempts=2)
+        fake = FakeOllama(pool, {url: "down" for url in HOSTS})
+        with pytest.raises(httpx.ConnectError):
+            await pool.post("/v1/completions", {})
+        assert sum(len(calls) for calls in fake.calls.values()) == 2
+        with pytest.raises(httpx.ConnectError):
+            await pool.post("/v1/completions", {})
+        assert not any(b.healthy for b in pool.backends)
+        # Исключены все — запрос всё равно уходит (на любой), а не падает без попытки
+        fake.states = {url: "ok" for url in HOSTS}
+        assert await pool.post("/v1/completions", {}) == COMPLETION
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_stream_retries_before_response():
+    async def main():
+        pool = OllamaPool(HOSTS[:2])
+        fake = FakeOllama(pool, {HOSTS[0]: "error", HOSTS[1]: "ok"})
+        pool.backends[1].outstanding = 1  # первым выберется упавший
+        async with pool.stream("/v1/completions", {}) as resp:
+            assert json.loads(await resp.aread()) == COMPLETION
+        assert fake.calls[HOSTS[0]] and fake.calls[HOSTS[1]]
+        assert not pool.backends[0].healthy
+        assert [b.outstanding for b in pool.backends] == [0, 1]
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_stream_error_after_response_is_raised():
+    async def main():
+        pool = OllamaPool(HOSTS[:1])
+        FakeOllama(pool, {HOSTS[0]: "ok"})
+        with pytest.raises(RuntimeError):
+            async with pool.stream("/v1/completions", {}):
+                raise RuntimeError("клиент отключился")
+        assert pool.backends[0].outstanding == 0 and pool.backends[0].healthy
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_health_check_restores():
+    async def main():
+        pool = OllamaPool(HOSTS[:2], eject_seconds=3600)
+        fake = FakeOllama(pool, {HOSTS[0]: "down", HOSTS[1]: "ok"})
+        await pool.health_check()
+        assert [b.healthy for b in pool.backends] == [False, True]
+        # 4xx на /api/version — сервер жив
+        fake.states[HOSTS[0]] = "bad"
+        stats = await pool.health_check()
+        assert [s["healthy"] for s in stats] == [True, True]
+        await pool.aclose()
+
+    _run(main())
+
+
+def test_sync_failover():
+    pool = OllamaPool(HOSTS[:2])
+    fake = FakeOllama(pool, {HOSTS[0]: "down", HOSTS[1]: "ok"})
+    pool.backends[1].outstanding = 1
+    assert pool.post_sync("/v1/completions", {}) == COMPLETION
+    assert fake.calls[HOSTS[0]] == ["/v1/completions"]
+    assert not pool.backends[0].healthy
+    assert [b.outstanding for b in pool.backends] == [0, 1]
+
+
+def test_broadcast_fails_only_if_all_fail():
+    async def main():
+        pool = OllamaPool(HOSTS[:2])
+        fake = FakeOllama(pool, {HOSTS[0]: "down", HOSTS[1]: "ok"})
+        await pool.broadcast("/api/generate", {})
+        fake.states[HOSTS[1]] = "down"
+        with pytest.raises(httpx.ConnectError):
+            await pool.broadcast("/api/generate", {})
+        await pool.aclose()
+
+    _run(main())
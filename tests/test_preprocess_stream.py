@@ -0,0 +1,65 @@
+import json
+import pandas as pd
+import pytest
+from preprocess_data import StreamingDeduplicator, _process_chunk, preprocess_stream, quality_check
+
+
+def _records():
+    return [
+        {"uid": 1, "text": "Москва — столица России, крупнейший город страны."},
+        {"uid": 2, "text": "Москва — столица России, крупнейший город страны."},
+        {"uid": 1, "text": "Повторный uid с другим текстом должен быть отброшен."},
+        {"uid": 3, "text": "коротко"},
+        {"uid": 4, "text": None},
+        {"uid": 5, "text": "   "},
+        {"uid": 6, "text": "ЦСКА — советский и российский футбольный клуб из Москвы!!"},
+        {"uid": 7, "text": "Санкт-Петербург основан Петром I в 1703 году."},
+        {"uid": 8, "text": "Санкт-Петербург основан Петром I в 1703 году."},
+        {"uid": 9, "text": "Санкт-Петербург основан Петром I в 1703 году!"},
+    ]
+
+
+def _write(tmp_path, records):
+    path = tmp_path / "input.json"
+    path.write_text(json.dumps(records, ensure_ascii=False), encoding='utf-8')
+    return path
+
+
+def _stream(tmp_path, records, config, **kwargs):
+    output = tmp_path / "output.json"
+    stats = preprocess_stream(_write(tmp_path, records), output, config, **kwargs)
+    return stats, json.loads(output.read_text(encoding='utf-8'))
+
+
+def test_process_chunk_empty():
+    assert _process_chunk([], 10) == ([], [], [], None)
+
+
+def test_stream_all_duplicates_in_chunk(tmp_path):
+    # Дедупликация отбрасывает целые чанки: раньше это падало с KeyError: 'text'
+    records = [{"uid": 1, "text": "одинаковый текст параграфа"}] * 3
+    config = {"min_length": 10, "near_dedup": {"enabled": False}}
+    stats, output = _stream(tmp_path, records, config, chunk_size=1)
+    assert stats == {"initial_count": 3, "final_count": 1}
+    assert [row["uid"] for row in output] == [1]
+
+
+@pytest.mark.parametrize("near_dedup", [False, True])
+@pytest.mark.parametrize("chunk_size", [1, 2, 4, 100])
+def test_stream_matches_in_memory(tmp_path, chunk_size, near_dedup):
+    config = {"min_length": 10, "near_dedup": {"enabled": near_dedup, "report_path": None}}
+    expected = quality_check(pd.DataFrame(_records()), config)
+    _, output = _stream(tmp_path, _records(), config, chunk_size=chunk_size)
+    assert output == expected.to_dict('records')
+
+
+def test_deduplicator_keeps_set_semantics():
+    dedup = StreamingDeduplicator()
+    try:
+        first = dedup.filter([{"uid": 1, "text": "а"}, {"uid": "1", "text": "б"}, {"uid": None, "text": "в"}])
+        second = dedup.filter([{"uid": 1, "text": "г"}, {"uid": None, "text": "д"}, {"uid": 2, "text": "б"}])
+    finally:
+        dedup.close()
+    assert [row["text"] for row in first] == ["а", "б", "в"]
+    assert second == []
+    assert (dedup.duplicate_uids, dedup.duplicate_texts) == (2, 1)
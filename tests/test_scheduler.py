@@ -0,0 +1,157 @@
+import asyncio
+import time
+import pytest
+import scheduler
+from scheduler import DeadlineExceeded, GenerationScheduler, QueueFull
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _hold(sched, release: asyncio.Event, **kwargs):
+    async with sched.slot(**kwargs):
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_priority_order():
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=8)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(sched, release))
+        await _settle()
+
+        order = []
+
+        async def job(name, priority):
+            async with sched.slot(priority=priority):
+                order.append(name)
+
+        tasks = [
+            asyncio.create_task(job("batch-1", "batch")),
+            asyncio.create_task(job("interactive-1", "interactive")),
+            asyncio.create_task(job("batch-2", "batch")),
+            asyncio.create_task(job("interactive-2", "interactive")),
+        ]
+        await _settle()
+        assert sched.queued() == 4
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
+        assert sched.running == 0
+
+    _run(main())
+
+
+def test_queue_full():
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_hold(sched, release)) for _ in range(2)]
+        await _settle()
+        assert sched.full()
+        with pytest.raises(QueueFull) as exc:
+            async with sched.slot():
+                pass
+        assert exc.value.status_code == 429 and exc.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sched.running == 0 and sched.rejected == 1
+
+    _run(main())
+
+
+def test_deadline_in_queue():
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=4)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(sched, release))
+        await _settle()
+        with pytest.raises(DeadlineExceeded):
+            async with sched.slot(deadline=time.monotonic() + 0.05):
+                pass
+        assert sched.queued() == 0 and sched.expired == 1
+        release.set()
+        await holder
+        assert sched.running == 0
+
+    _run(main())
+
+
+def test_deadline_during_generation():
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1)
+        with pytest.raises(DeadlineExceeded):
+            async with sched.slot(deadline=time.monotonic() + 0.05):
+                await asyncio.sleep(1)
+        assert sched.running == 0
+
+    _run(main())
+
+
+def test_cancel_while_queued():
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=4)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(sched, release))
+        await _settle()
+        waiter = asyncio.create_task(_hold(sched, asyncio.Event()))
+        await _settle()
+        waiter.cancel()
+        await _settle()
+        assert sched.queued() == 0
+        release.set()
+        await holder
+        assert sched.running == 0
+
+    _run(main())
+
+
+def test_cancel_after_slot_granted():
+    # Отмена приходит, когда _wake_next уже выдал слот ожидающему
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=4)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(sched, release))
+        await _settle()
+        waiter = asyncio.create_task(_hold(sched, asyncio.Event()))
+        await _settle()
+        release.set()
+        await holder
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert sched.running == 0
+
+    _run(main())
+
+
+def test_timeout_after_slot_granted(monkeypatch):
+    # Гонка wait_for в Python 3.12: результат уже выставлен _wake_next, но наружу вылетает TimeoutError
+    async def racy_wait_for(future, timeout):
+        await asyncio.shield(future)
+        raise asyncio.TimeoutError
+
+    async def main():
+        sched = GenerationScheduler(max_concurrency=1, max_queue=4)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(sched, release))
+        await _settle()
+        monkeypatch.setattr(scheduler.asyncio, "wait_for", racy_wait_for)
+        waiter = asyncio.create_task(_hold(sched, asyncio.Event(), deadline=time.monotonic() + 60))
+        await _settle()
+        release.set()
+        await holder
+        with pytest.raises(DeadlineExceeded):
+            await waiter
+        assert sched.running == 0
+        monkeypatch.undo()
+        async with sched.slot(deadline=time.monotonic() + 1):
+            assert sched.running == 1
+
+    _run(main())
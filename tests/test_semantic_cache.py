@@ -0,0 +1,66 @@
+import numpy as np
+import semantic_cache
+from semantic_cache import SemanticCache, write_collection_version
+
+
+def _vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def test_exact_and_semantic_hits():
+    cache = SemanticCache(threshold=0.95)
+    cache.put("Кто основал Петербург?", _vector(1, 0), "Пётр I", scope=10)
+    assert cache.get("кто основал петербург", scope=10) == "Пётр I"
+    assert cache.get("кто основал петербург", scope=5) is None
+    assert cache.get_similar(_vector(0.99, 0.05), scope=10) == "Пётр I"
+    assert cache.get_similar(_vector(0, 1), scope=10) is None
+
+
+def test_lru_and_ttl(monkeypatch):
+    cache = SemanticCache(max_size=2, ttl=10.0)
+    for i, question in enumerate(["a", "b", "c"]):
+        cache.put(question, _vector(1, i), question)
+    assert cache.get("a") is None and cache.get("c") == "c"
+
+    now = semantic_cache.time.monotonic()
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now + 11.0)
+    assert cache.get("c") is None
+
+
+def test_version_change_clears_cache(tmp_path):
+    write_collection_version(tmp_path)
+    cache = SemanticCache(persist_dir=tmp_path, version_check_interval=0.0)
+    cache.put("вопрос", _vector(1, 0), "старый ответ")
+    assert cache.get("вопрос") == "старый ответ"
+    write_collection_version(tmp_path)
+    assert cache.get("вопрос") is None
+
+
+def test_version_file_read_only_on_change(tmp_path, monkeypatch):
+    write_collection_version(tmp_path)
+    cache = SemanticCache(persist_dir=tmp_path, version_check_interval=0.0)
+    reads = []
+    original = semantic_cache.read_collection_version
+    monkeypatch.setattr(semantic_cache, "read_collection_version", lambda path: reads.append(path) or original(path))
+
+    cache.put("вопрос", _vector(1, 0), "ответ")
+    for _ in range(10):
+        assert cache.get("вопрос") == "ответ"
+    assert reads == []
+
+    write_collection_version(tmp_path)
+    assert cache.get("вопрос") is None
+    assert len(reads) == 1
+
+
+def test_version_check_interval(tmp_path, monkeypatch):
+    write_collection_version(tmp_path)
+    cache = SemanticCache(persist_dir=tmp_path, version_check_interval=60.0)
+    cache.put("вопрос", _vector(1, 0), "ответ")
+    write_collection_version(tmp_path)
+    # До следующей проверки файл не трогаем
+    assert cache.get("вопрос") == "ответ"
+
+    now = semantic_cache.time.monotonic()
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now + 61.0)
+    assert cache.get("вопрос") is None
@@ -0,0 +1,75 @@
+import random
+import pytest
+from LLM import ThinkStripper, parse_completion, strip_think_sections
+
+SAMPLES = [
+    "ЦСКА",
+    "  ЦСКА  ",
+    "",
+    "   ",
+    "<think>\nрассуждение\n</think>\n\nЦСКА",
+    # Шаблон подставил <think> в промпт — в выводе модели только закрывающий тег
+    "Okay, the user asks about the club.\n</think>\n\nЦСКА",
+    "prefix <think>x</think>y",
+    "<think>a</think>b</think>c",
+    "<think>незакрытое рассуждение",
+    "ответ с </thi в конце",
+    "<think></think>",
+    "<think>x</think>  ответ  \n",
+    "</</think>think>ответ",
+    "a</think>b </think> c </thi",
+    "<think>x</think>слово  слово\n\nабзац",
+]
+
+
+def _stream(raw: str, sizes) -> tuple[str, list[str]]:
+    stripper = ThinkStripper()
+    pieces = []
+    pos = 0
+    for size in sizes:
+        if pos >= len(raw):
+            break
+        pieces.append(stripper.feed(raw[pos:pos + size]))
+        pos += size
+    if pos < len(raw):
+        pieces.append(stripper.feed(raw[pos:]))
+    pieces.append(stripper.finish())
+    return "".join(pieces), pieces
+
+
+@pytest.mark.parametrize("raw", SAMPLES)
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_matches_strip_think_sections(raw, size):
+    streamed, _ = _stream(raw, [size] * len(raw))
+    assert streamed == strip_think_sections(raw)
+
+
+def test_matches_on_random_splits():
+    rng = random.Random(0)
+    alphabet = ["<think>", "</think>", "</thi", "<", "/", " ", "\n", "a", "б", "think>"]
+    for _ in range(2000):
+        raw = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        sizes = [rng.randint(1, 6) for _ in range(len(raw))]
+        streamed, _ = _stream(raw, sizes)
+        assert streamed == strip_think_sections(raw), raw
+
+
+def test_reasoning_without_open_tag_is_not_streamed():
+    raw = "Okay, the user asks about the club.\n</think>\n\nЦСКА"
+    _, pieces = _stream(raw, [4] * len(raw))
+    assert "".join(pieces[:raw.index("</think>") // 4]) == ""
+    assert "".join(pieces) == "ЦСКА"
+
+
+def test_answer_streams_after_close_tag():
+    stripper = ThinkStripper()
+    assert stripper.feed("<think>x</think>") == ""
+    assert stripper.feed(" Москва") == "Москва"
+    assert stripper.feed(" —") == " —"
+    assert stripper.feed(" столица ") == " столица"
+    assert stripper.finish() == ""
+
+
+def test_parse_completion():
+    assert parse_completion({"choices": [{"text": "<think>x</think> ЦСКА"}]}) == "ЦСКА"
+    assert parse_completion({"completion": "рассуждение</think>ЦСКА"}) == "ЦСКА"
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from vector_store import load_vectors, save_vectors
+from vectorize_data import vectorize_texts
+
+
+def _encoder(calls):
+    def encode(records):
+        calls.append([record['uid'] for record in records])
+        return np.asarray([[len(record['text']), record['uid'], 0.0] for record in records], dtype=np.float32)
+    return encode
+
+
+def _records(texts):
+    return [{"uid": uid, "ru_wiki_pageid": uid, "text": text} for uid, text in texts.items()]
+
+
+def test_incremental_reuses_unchanged(tmp_path):
+    path = tmp_path / "vectors.npy"
+    calls = []
+    embeddings, records = vectorize_texts(_records({1: "москва", 2: "цска", 3: " "}), _encoder(calls))
+    assert calls == [[1, 2]]
+    save_vectors(path, embeddings, records)
+
+    previous = load_vectors(path)
+    calls.clear()
+    embeddings, records = vectorize_texts(_records({1: "москва", 2: "цска — клуб", 4: "нева"}), _encoder(calls),
+                                          previous)
+    # Пересчитываются только изменённый и новый тексты
+    assert calls == [[2, 4]]
+    assert embeddings.tolist() == [[6, 1, 0], [11, 2, 0], [4, 4, 0]]
+
+    # Сохранение поверх артефакта, из которого брались векторы
+    previous = None
+    save_vectors(path, embeddings, records)
+    assert np.array_equal(load_vectors(path)[0], embeddings)
+
+
+def test_empty_input_without_previous():
+    with pytest.raises(ValueError):
+        vectorize_texts(_records({1: "  "}), _encoder([]))
+
+
+def test_empty_input_with_previous(tmp_path):
+    path = tmp_path / "vectors.npy"
+    save_vectors(path, np.ones((1, 3), dtype=np.float32), _records({1: "москва"}))
+    embeddings, records = vectorize_texts([], _encoder([]), load_vectors(path))
+    assert embeddings.shape == (0, 3) and records == []
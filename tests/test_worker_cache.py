@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import rag_core
+
+
+class FakeInferenceClient:
+    def __init__(self):
+        self.version = "v1"
+
+    def search(self, query_vectors, top_k=10, query_texts=None):
+        return {"ids": [["1"]], "documents": [["текст"]], "metadatas": [[{}]], "distances": [[0.1]],
+                "index_version": self.version}
+
+    def reload(self, force=False):
+        return {"version": self.version, "reloaded": force, "index_version": self.version}
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # Воркер в режиме RAG_INFERENCE_SOCKET: поиск и перезагрузка идут в сервер векторизации
+    client = FakeInferenceClient()
+    monkeypatch.setattr(rag_core, "INFERENCE_SOCKET", "/tmp/test.sock")
+    monkeypatch.setattr(rag_core, "model", client)
+    monkeypatch.setattr(rag_core, "embedding_batcher", object())
+    monkeypatch.setattr(rag_core, "_server_index_version", None)
+    rag_core.answer_cache.invalidate()
+    yield client
+    rag_core.answer_cache.invalidate()
+
+
+def _cache_answer():
+    rag_core.answer_cache.put("вопрос", np.ones(4, dtype=np.float32), "ответ", scope=10)
+
+
+def test_search_version_change_invalidates(worker):
+    query = np.ones((1, 4), dtype=np.float32)
+    rag_core.search(query, 10)
+    _cache_answer()
+    rag_core.search(query, 10)
+    assert rag_core.answer_cache.get("вопрос", scope=10) == "ответ"
+
+    worker.version = "v2"
+    rag_core.search(query, 10)
+    assert rag_core.answer_cache.get("вопрос", scope=10) is None
+
+
+def test_reload_invalidates(worker):
+    _cache_answer()
+    rag_core.reload_retriever(force=True)
+    assert rag_core.answer_cache.get("вопрос", scope=10) is None
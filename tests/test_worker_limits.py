@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _scheduler_limits(**env) -> dict:
+    # Лимиты считаются при импорте rag_core — проверяем в отдельном процессе с нужным окружением
+    code = "import json, rag_core; print(json.dumps(rag_core.generation_scheduler.stats()))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "COMPLETION_CACHE_PATH": "", **env}
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("workers, expected_concurrency, expected_queue", [
+    ("1", 8, 32),
+    ("4", 2, 8),
+    ("16", 1, 2),
+])
+def test_limits_split_between_workers(workers, expected_concurrency, expected_queue):
+    stats = _scheduler_limits(
+        API_WORKERS=workers, OLLAMA_MAX_CONCURRENCY="4", GENERATION_QUEUE_DEPTH="32",
+        OLLAMA_HOSTS="http://a:11434,http://b:11434"
+    )
+    assert (stats["max_concurrency"], stats["max_queue"]) == (expected_concurrency, expected_queue)
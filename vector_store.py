@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from pathlib import Path
+
+# Формат артефакта векторов:
+#   <name>.npy        — матрица (N, dim) float32 или float16, читается через memmap
+#   <name>.meta.json  — колоночный sidecar: uid / ru_wiki_pageid / text / hash в том же порядке, что и строки матрицы
+VECTORS_PATH = Path("data/vectored_RuBQ_2.0_paragraphs.npy")
+META_COLUMNS = ("uid", "ru_wiki_pageid", "text")
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+# Хэш содержимого параграфа: по нему определяем, нужно ли пересчитывать вектор
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def meta_path_for(vectors_path) -> Path:
+    return Path(vectors_path).with_suffix(".meta.json")
+
+
+# Сохранение векторов и метаданных
+def save_vectors(vectors_path, embeddings, records, dtype="float32"):
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Неподдерживаемый dtype {dtype}, ожидался один из {SUPPORTED_DTYPES}")
+    if len(embeddings) != len(records):
+        raise ValueError(f"Число векторов ({len(embeddings)}) не совпадает с числом записей ({len(records)})")
+
+    vectors_path = Path(vectors_path)
+    vectors_path.parent.mkdir(parents=True, exist_ok=True)
+    matrix = np.ascontiguousarray(embeddings, dtype=dtype)
+
+    # Пишем во временные файлы и подменяем, чтобы читатели не увидели половину артефакта
+    tmp_vectors = vectors_path.with_name(vectors_path.name + ".tmp")
+    with open(tmp_vectors, 'wb') as f:
+        np.save(f, matrix)
+
+    meta = {
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "dtype": dtype,
+        "columns": {column: [record[column] for record in records] for column in META_COLUMNS}
+    }
+    meta["columns"]["hash"] = [text_hash(record['text']) for record in records]
+    meta_path = meta_path_for(vectors_path)
+    tmp_meta = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    os.replace(tmp_vectors, vectors_path)
+    os.replace(tmp_meta, meta_path)
+    logging.info(f"Сохранено {meta['count']} векторов ({dtype}) в {vectors_path}")
+
+
+# Загрузка метаданных (колонки uid / ru_wiki_pageid / text / hash)
+def load_meta(vectors_path) -> dict:
+    with open(meta_path_for(vectors_path), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Загрузка векторов без копирования: матрица отображается в память только для чтения
+def load_vectors(vectors_path, mmap=True) -> tuple:
+    vectors_path = Path(vectors_path)
+    vectors = np.load(vectors_path, mmap_mode='r' if mmap else None)
+    meta = load_meta(vectors_path)
+    if vectors.shape[0] != meta["count"]:
+        raise ValueError(
+            f"Артефакт повреждён: {vectors.shape[0]} векторов, а в {meta_path_for(vectors_path)} {meta['count']} записей"
+        )
+    columns = meta["columns"]
+    if "hash" not in columns:
+        # Артефакты, сохранённые до появления хэшей
+        columns["hash"] = [text_hash(text) for text in columns["text"]]
+    return vectors, columns
+
+
+# Конвертация старого формата (JSON со списками float) в новый артефакт
+def convert_legacy_json(json_path, vectors_path, dtype="float32"):
+    logging.info(f"Конвертация {json_path} -> {vectors_path}")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    embeddings = np.array([item['vector'] for item in data], dtype=np.float32)
+    save_vectors(vectors_path, embeddings, data, dtype=dtype)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(filename='vectorize.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Конвертация JSON с векторами в бинарный артефакт .npy + sidecar")
+    parser.add_argument("json_path", nargs="?", default="data/vectored_RuBQ_2.0_paragraphs.json")
+    parser.add_argument("--output", default=str(VECTORS_PATH))
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    args = parser.parse_args()
+
+    convert_legacy_json(args.json_path, args.output, dtype=args.dtype)
+    print(f"Артефакт сохранён: {args.output}")
@@ -1,45 +1,202 @@
+import hashlib
 import json
 import logging
+import multiprocessing
+import os
+import shutil
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from embedder import EMBED_BACKEND, EMBED_BACKENDS, load_embedder
 from pathlib import Path
+from vector_store import SUPPORTED_DTYPES, VECTORS_PATH, load_vectors, save_vectors, text_hash
 
-# Настройка логирования
-logging.basicConfig(filename='vectorize.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+CHECKPOINT_DIR = Path("data/vectorize_checkpoint")
+
+# Модель в процессе-воркере (по одной на процесс)
+_worker_model = None
 
 # Загрузка данных
 def load_data(input_path):
     with open(input_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-# Векторизация текстов
-def vectorize_texts(data, model):
-    texts = [item['text'] for item in data if item['text'] and item['text'].strip()]
-    logging.info(f"Найдено текстов для векторизации: {len(texts)}")
-    embeddings = model.encode(texts, show_progress_bar=True)
-    return embeddings, texts
-
-# Сохранение результатов
-def save_vectors(embeddings, texts, output_path):
-    data_with_vectors = [
-        {'uid': data[i]['uid'], 'ru_wiki_pageid': data[i]['ru_wiki_pageid'], 'text': text, 'vector': embedding.tolist()}
-        for i, (embedding, text) in enumerate(zip(embeddings, texts))
-    ]
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data_with_vectors, f, ensure_ascii=False, indent=2)
-    logging.info(f"Векторы сохранены в {output_path}")
+# Инициализация воркера: своя модель и своя доля ядер
+def _init_worker(backend, device, threads):
+    global _worker_model
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+    _worker_model = load_embedder(backend, device=device, threads=threads)
+
+# Векторизация одного шарда с записью на диск (через временный файл, чтобы не оставить половину шарда)
+def _encode_shard(shard_id, texts, shard_dir, batch_size):
+    started = time.perf_counter()
+    embeddings = _worker_model.encode(texts, batch_size=batch_size)
+    path = Path(shard_dir) / f"shard_{shard_id:05d}.npy"
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.asarray(embeddings, dtype=np.float32))
+    os.replace(tmp_path, path)
+    return shard_id, len(texts), time.perf_counter() - started
+
+# Отпечаток входа: шарды из прошлого запуска годятся, только если uid и тексты те же и в том же порядке
+def _fingerprint(records, shard_size) -> str:
+    digest = hashlib.sha1(str(shard_size).encode('utf-8'))
+    for item in records:
+        digest.update(f"{item['uid']}:{text_hash(item['text'])}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+# Шардированная векторизация в пуле процессов с возобновлением с последнего готового шарда
+def vectorize_sharded(records, checkpoint_dir=CHECKPOINT_DIR, backend=EMBED_BACKEND, device=None,
+                      workers=1, shard_size=4096, batch_size=64):
+    checkpoint_dir = Path(checkpoint_dir)
+    fingerprint = _fingerprint(records, shard_size)
+    manifest_path = checkpoint_dir / "manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get("fingerprint") != fingerprint:
+                logging.warning(f"Чекпоинт в {checkpoint_dir} от другого набора данных, начинаем заново")
+                shutil.rmtree(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"fingerprint": fingerprint, "count": len(records), "shard_size": shard_size}, f)
+
+    n_shards = (len(records) + shard_size - 1) // shard_size
+    pending = [i for i in range(n_shards) if not (checkpoint_dir / f"shard_{i:05d}.npy").exists()]
+    logging.info(f"Шардов всего: {n_shards}, готово: {n_shards - len(pending)}, к обработке: {len(pending)}")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    started = time.perf_counter()
+    done_docs = 0
+
+    def report(shard_id, count, elapsed):
+        nonlocal done_docs
+        done_docs += count
+        rate = done_docs / (time.perf_counter() - started)
+        logging.info(f"Шард {shard_id}: {count} текстов за {elapsed:.1f} с, всего {done_docs}, {rate:.1f} док/с")
+
+    def shard_texts(shard_id):
+        return [item['text'] for item in records[shard_id * shard_size:(shard_id + 1) * shard_size]]
+
+    if pending and workers <= 1:
+        _init_worker(backend, device, threads)
+        for shard_id in pending:
+            report(*_encode_shard(shard_id, shard_texts(shard_id), checkpoint_dir, batch_size))
+    elif pending:
+        # spawn: CUDA и потоки torch не переживают fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(backend, device, threads)) as pool:
+            futures = [
+                pool.submit(_encode_shard, shard_id, shard_texts(shard_id), str(checkpoint_dir), batch_size)
+                for shard_id in pending
+            ]
+            for future in as_completed(futures):
+                report(*future.result())
+
+    elapsed = time.perf_counter() - started
+    if done_docs:
+        print(f"Векторизовано {done_docs} текстов за {elapsed:.1f} с ({done_docs / elapsed:.1f} док/с, воркеров: {workers})")
+
+    # Сборка шардов строго по порядку: строка i результата соответствует records[i]
+    parts = []
+    for shard_id in range(n_shards):
+        part = np.load(checkpoint_dir / f"shard_{shard_id:05d}.npy")
+        expected = len(records[shard_id * shard_size:(shard_id + 1) * shard_size])
+        if len(part) != expected:
+            raise ValueError(f"Шард {shard_id} содержит {len(part)} векторов вместо {expected}")
+        parts.append(part)
+    return np.concatenate(parts) if parts else None
+
+# Векторизация текстов. previous — (векторы, колонки) прошлого артефакта:
+# векторы параграфов с тем же uid и хэшем текста берутся из него без пересчёта.
+# encode — функция, которая векторизует список записей (например, vectorize_sharded)
+def vectorize_texts(data, encode, previous=None):
+    # Пустые тексты отбрасываем вместе с записями, чтобы uid не разъехались с векторами
+    records = [item for item in data if item['text'] and item['text'].strip()]
+    hashes = [text_hash(item['text']) for item in records]
+
+    reuse = {}
+    prev_vectors = None
+    if previous is not None:
+        prev_vectors, prev_columns = previous
+        prev_rows = {
+            str(uid): (row, h) for row, (uid, h) in enumerate(zip(prev_columns['uid'], prev_columns['hash']))
+        }
+        for i, (item, h) in enumerate(zip(records, hashes)):
+            prev = prev_rows.get(str(item['uid']))
+            if prev is not None and prev[1] == h:
+                reuse[i] = prev[0]
+
+    to_encode = [i for i in range(len(records)) if i not in reuse]
+    logging.info(
+        f"Найдено текстов для векторизации: {len(records)}, "
+        f"из них без изменений: {len(reuse)}, к пересчёту: {len(to_encode)}"
+    )
+
+    if prev_vectors is None and not to_encode:
+        # Размерность векторов неоткуда взять — ни прошлого артефакта, ни текстов для модели
+        raise ValueError("Нет ни одного непустого текста для векторизации")
+    encoded = encode([records[i] for i in to_encode]) if to_encode else None
+    dim = prev_vectors.shape[1] if prev_vectors is not None else encoded.shape[1]
+    embeddings = np.empty((len(records), dim), dtype=np.float32)
+    if reuse:
+        rows = np.fromiter(reuse.keys(), dtype=np.int64, count=len(reuse))
+        prev_rows_idx = np.fromiter(reuse.values(), dtype=np.int64, count=len(reuse))
+        embeddings[rows] = prev_vectors[prev_rows_idx]
+    if to_encode:
+        embeddings[to_encode] = encoded
+    return embeddings, records
 
 if __name__ == "__main__":
-    input_path = Path("data/processed_RuBQ_2.0_paragraphs.json")
-    output_path = Path("data/vectored_RuBQ_2.0_paragraphs.json")
+    import argparse
+
+    # Лог в файл — только при запуске скрипта, не при импорте
+    logging.basicConfig(filename='vectorize.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    # Загрузка модели
-    model = SentenceTransformer('all-MiniLM-L6-v2', device='cuda') # Модель с размером вектора 384
-    logging.info("Модель загружена: all-MiniLM-L6-v2")
+    parser = argparse.ArgumentParser(description="Векторизация обработанных параграфов RuBQ")
+    parser.add_argument("--input", default="data/processed_RuBQ_2.0_paragraphs.json")
+    parser.add_argument("--output", default=str(VECTORS_PATH))
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32",
+                        help="float16 вдвое уменьшает артефакт ценой точности")
+    parser.add_argument("--backend", choices=EMBED_BACKENDS, default=EMBED_BACKEND,
+                        help="torch (GPU/CPU), onnx или onnx-int8 для машин без GPU")
+    parser.add_argument("--device", default=None, help="устройство для torch-бэкенда, по умолчанию cuda при наличии")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов-воркеров, каждый со своей моделью и долей ядер")
+    parser.add_argument("--shard-size", type=int, default=4096, help="текстов в одном шарде-чекпоинте")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--checkpoint-dir", default=str(CHECKPOINT_DIR))
+    parser.add_argument("--full", action="store_true",
+                        help="пересчитать все векторы, не используя прошлый артефакт")
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    output_path = Path(args.output)
 
     # Загрузка и обработка данных
     data = load_data(input_path)
-    embeddings, texts = vectorize_texts(data, model)
+    previous = None
+    if not args.full and output_path.exists():
+        previous = load_vectors(output_path)
+        logging.info(f"Инкрементальный режим: прошлый артефакт {output_path}, {len(previous[0])} векторов")
+
+    # Модель all-MiniLM-L6-v2 (вектор 384) загружается в воркерах и только если есть что пересчитывать
+    def encode(records):
+        return vectorize_sharded(
+            records, args.checkpoint_dir, backend=args.backend, device=args.device,
+            workers=args.workers, shard_size=args.shard_size, batch_size=args.batch_size
+        )
+
+    embeddings, records = vectorize_texts(data, encode, previous)
+    # Нужные строки уже скопированы в embeddings; memmap прошлого артефакта закрываем до os.replace
+    # в save_vectors — на Windows открытый файл подменить нельзя
+    previous = None
+
+    # Сохранение результатов (.npy + sidecar с uid / ru_wiki_pageid / text)
+    save_vectors(output_path, embeddings, records, dtype=args.dtype)
+    logging.info(f"Векторы сохранены в {output_path}")
 
-    # Сохранение результатов
-    save_vectors(embeddings, texts, output_path)
\ No newline at end of file
+    # Артефакт записан — чекпоинты больше не нужны
+    shutil.rmtree(args.checkpoint_dir, ignore_errors=True)